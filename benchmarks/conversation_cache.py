@@ -0,0 +1,72 @@
+"""
+MongoDB round trips of the hot path with and without the in-process conversation cache.
+
+Simulates active chats exchanging messages through ConversationRepository (read the recent window,
+then append the user and assistant turns) against an in-memory collection, and counts find_one calls.
+With the cache, only the first message of every chat reads its window from MongoDB. The background folds
+of the rolling summary read the messages to fold (every HISTORY_SUMMARY_BATCH messages) off the hot path,
+they are counted separately.
+
+Usage:
+    python -m benchmarks.conversation_cache --chats 100 --messages-per-chat 20
+"""
+import asyncio
+import argparse
+
+from benchmarks.stubs import InMemoryCollection
+
+
+async def run(cache, chats: int, messages_per_chat: int):
+    from src.config import settings
+    from src.apps.mongodb.repository import ConversationRepository
+
+    collection = InMemoryCollection()
+    repository = ConversationRepository(collection, cache=cache)
+    # ======== Window reads of the hot path, the fold reads of the summary are not counted here ========
+    window_reads = 0
+    read_window = repository._read_window
+
+    async def counted_read_window(*args, **kwargs):
+        nonlocal window_reads
+        window_reads += 1
+        return await read_window(*args, **kwargs)
+    repository._read_window = counted_read_window
+
+    async def chat(username):
+        for i in range(messages_per_chat):
+            await repository.get_recent_history(username, settings.HISTORY_WINDOW)
+            await repository.append_messages(username, [
+                {"role": "user", "content": f"question {i}"},
+                {"role": "assistant", "content": f"answer {i}"}
+            ])
+
+    await asyncio.gather(*(chat(f"client_{n}") for n in range(chats)))
+    return collection, window_reads
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--messages-per-chat", type=int, default=20)
+    args = parser.parse_args()
+
+    from src.config import settings
+    from src.apps.mongodb.cache import ConversationCache
+
+    total = args.chats * args.messages_per_chat
+    cache = ConversationCache(
+        maxsize=settings.CONVERSATION_CACHE_MAX_CHARS,
+        ttl=settings.CONVERSATION_CACHE_TTL,
+        window=settings.CONVERSATION_CACHE_WINDOW
+    )
+    for name, chat_cache in (("no cache", None), ("cache", cache)):
+        collection, window_reads = asyncio.run(run(chat_cache, args.chats, args.messages_per_chat))
+        reads = collection.calls["find_one"]
+        print(f"{name:>9}: {reads} reads for {total} messages ({reads / total:.2f} per message), "
+              f"hot path reads after the first message of every chat: {max(window_reads - args.chats, 0)}, "
+              f"summary fold reads: {reads - window_reads}")
+    print(f"cache stats: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
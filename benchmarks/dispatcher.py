@@ -0,0 +1,88 @@
+"""
+Sequential update handling against the per-chat ordered PerChatUpdateProcessor.
+
+Generates a synthetic multi-chat load (updates of many chats interleaved, every update takes
+`--latency` seconds like a RAG round trip) and reports the time to handle all updates and whether
+the updates of every chat were handled in their arrival order.
+
+Usage:
+    python -m benchmarks.dispatcher --chats 50 --updates-per-chat 5 --latency 0.05
+"""
+import time
+import random
+import asyncio
+import argparse
+from types import SimpleNamespace
+
+from src.apps.telegram.dispatcher import PerChatUpdateProcessor
+
+
+def make_updates(chats: int, updates_per_chat: int):
+    updates = [
+        SimpleNamespace(update_id=None, business_message=SimpleNamespace(chat=SimpleNamespace(id=chat_id)), seq=seq)
+        for chat_id in range(chats) for seq in range(updates_per_chat)
+    ]
+    # ======== Interleave the chats but keep every chat's own order ========
+    random.shuffle(updates)
+    for chat_id in range(chats):
+        chat_updates = [update for update in updates if update.business_message.chat.id == chat_id]
+        for seq, update in enumerate(chat_updates):
+            update.seq = seq
+    for update_id, update in enumerate(updates):
+        update.update_id = update_id
+    return updates
+
+
+async def handle(update, latency: float, handled: dict) -> None:
+    await asyncio.sleep(latency * random.uniform(0.5, 1.5))
+    handled.setdefault(update.business_message.chat.id, []).append(update.seq)
+
+
+def in_order(handled: dict) -> bool:
+    return all(seqs == sorted(seqs) for seqs in handled.values())
+
+
+async def run_sequential(updates, latency: float):
+    handled = {}
+    start = time.perf_counter()
+    for update in updates:
+        await handle(update, latency, handled)
+    return time.perf_counter() - start, handled
+
+
+async def run_per_chat(updates, latency: float, max_concurrent_chats: int, chat_queue_size: int):
+    handled = {}
+    processor = PerChatUpdateProcessor(max_concurrent_chats, chat_queue_size, idle_timeout=1)
+    async with processor:
+        start = time.perf_counter()
+        # ======== Same as Application: one task per update, created in arrival order ========
+        tasks = [asyncio.create_task(processor.process_update(update, handle(update, latency, handled)))
+                 for update in updates]
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - start, handled
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--updates-per-chat", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean handling time of an update in seconds")
+    parser.add_argument("--max-concurrent-chats", type=int, default=64)
+    parser.add_argument("--chat-queue-size", type=int, default=16)
+    args = parser.parse_args()
+
+    updates = make_updates(args.chats, args.updates_per_chat)
+    sequential, sequential_handled = asyncio.run(run_sequential(updates, args.latency))
+    per_chat, per_chat_handled = asyncio.run(
+        run_per_chat(updates, args.latency, args.max_concurrent_chats, args.chat_queue_size)
+    )
+
+    print(f"{'mode':>10} {'seconds':>9} {'updates/s':>10} {'in order':>9}")
+    for name, elapsed, handled in (("sequential", sequential, sequential_handled),
+                                   ("per_chat", per_chat, per_chat_handled)):
+        print(f"{name:>10} {elapsed:>9.2f} {len(updates) / elapsed:>10.1f} {str(in_order(handled)):>9}")
+    print(f"speedup: {sequential / per_chat:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Read and write costs of the two conversation history layouts at 10k+ messages per chat.
+
+Seeds --chats conversations of --messages-per-chat messages in the document layout (telegram_conversations,
+one document with a history array per chat), copies them into the message-per-document layout with the
+split_history migration, then measures on both layouts:
+  - reading the last --window messages of a random chat (get_recent_conversation, no cache),
+  - appending a client message and its answer (append_messages),
+  - the index keys and documents the server examines for the "last N messages" query,
+  - the size of the collections and their indexes.
+The summary is disabled, only the storage is measured. Needs a reachable MongoDB deployment, the
+benchmark database is dropped at the end.
+
+Usage:
+    python -m benchmarks.history_storage --mongo-uri mongodb://localhost:27017 --chats 5 --messages-per-chat 10000
+"""
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+from pymongo import MongoClient, DESCENDING
+
+from src.apps.mongodb.repository import ConversationRepository, MessageRepository
+from src.apps.mongodb.migrations.split_history import split_history
+
+
+def make_message(index: int, length: int) -> dict:
+    role = "user" if index % 2 == 0 else "assistant"
+    return {"role": role, "content": (f"{role} message {index} " * length)[:length]}
+
+
+def seed(conversations, chats: int, messages_per_chat: int, length: int) -> None:
+    for chat in range(chats):
+        conversations.insert_one({
+            "username": f"client_{chat}",
+            "history": [make_message(index, length) for index in range(messages_per_chat)],
+            "message_count": messages_per_chat,
+        })
+
+
+def quantiles(values) -> str:
+    cuts = statistics.quantiles(values, n=100) if len(values) > 1 else values * 99
+    return f"{statistics.median(values) * 1000:>9.2f} {cuts[94] * 1000:>9.2f}"
+
+
+async def measure(repository, chats: int, operations: int, window: int, length: int):
+    reads, writes = [], []
+    for index in range(operations):
+        username = f"client_{random.randrange(chats)}"
+        start = time.perf_counter()
+        await repository.get_recent_conversation(username, window)
+        reads.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await repository.append_messages(username, [make_message(2 * index, length), make_message(2 * index + 1, length)])
+        writes.append(time.perf_counter() - start)
+    return reads, writes
+
+
+def collection_size(database, name: str) -> str:
+    stats = database.command("collStats", name)
+    return f"data {stats['size'] / 2 ** 20:.1f} MiB, indexes {stats['totalIndexSize'] / 2 ** 20:.1f} MiB"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default="revise_bot_history_benchmark")
+    parser.add_argument("--chats", type=int, default=5)
+    parser.add_argument("--messages-per-chat", type=int, default=10_000)
+    parser.add_argument("--message-length", type=int, default=200, help="Characters per message")
+    parser.add_argument("--operations", type=int, default=200, help="Reads and appends per layout")
+    parser.add_argument("--window", type=int, default=16)
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo_uri)
+    client.drop_database(args.database)
+    database = client[args.database]
+    conversations, messages, chats = database["telegram_conversations"], database["telegram_messages"], database["telegram_chats"]
+    try:
+        seed(conversations, args.chats, args.messages_per_chat, args.message_length)
+        document_size = next(conversations.aggregate([{"$group": {"_id": None, "size": {"$avg": {"$bsonSize": "$$ROOT"}}}}]))
+        print(f"{args.chats} chats x {args.messages_per_chat} messages of {args.message_length} characters, "
+              f"conversation documents of {document_size['size'] / 2 ** 20:.1f} MiB (limit 16 MiB)")
+
+        message_repository = MessageRepository(messages, chats, summary_batch=0)
+        asyncio.run(message_repository.ensure_indexes())
+        start = time.perf_counter()
+        _, copied = split_history(conversations, messages, chats, batch_size=10)
+        elapsed = time.perf_counter() - start
+        print(f"split_history migration: {copied} messages in {elapsed:.1f}s ({copied / elapsed:.0f} messages/s)")
+
+        # ======== Keeps every message, like the message layout, so both layouts hold the same history ========
+        document_repository = ConversationRepository(
+            conversations, max_messages=args.messages_per_chat + 2 * args.operations, summary_batch=0
+        )
+        asyncio.run(document_repository.ensure_indexes())
+
+        plan = messages.find({"chat": "client_0"}).sort("seq", DESCENDING).limit(args.window) \
+            .explain()["executionStats"]
+        print(f"last {args.window} messages query: {plan['totalKeysExamined']} index keys and "
+              f"{plan['totalDocsExamined']} documents examined")
+
+        print(f"\n{'layout':>10} {'read p50':>9} {'read p95':>9} {'write p50':>9} {'write p95':>9}  (ms)  size")
+        for name, repository, collection in (("document", document_repository, "telegram_conversations"),
+                                             ("messages", message_repository, "telegram_messages")):
+            reads, writes = asyncio.run(measure(repository, args.chats, args.operations, args.window,
+                                                args.message_length))
+            print(f"{name:>10} {quantiles(reads)} {quantiles(writes)}        {collection_size(database, collection)}")
+    finally:
+        client.drop_database(args.database)
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
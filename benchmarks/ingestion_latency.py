@@ -0,0 +1,115 @@
+"""
+Update ingestion latency of long polling against the webhook mode.
+
+A stub Telegram Bot API stands in for Telegram. In polling mode the updates are queued at the stub and
+fetched by the PTB Updater with getUpdates, in webhook mode they are POSTed to the webhook app served by
+uvicorn. The latency is measured from the moment an update is handed to "Telegram" until a handler sees it.
+`--network-latency` simulates the one-way delay between Telegram and the bot: it delays the getUpdates
+answers in polling mode and the webhook requests in webhook mode.
+
+Usage:
+    python -m benchmarks.ingestion_latency --updates 500 --rate 100 --network-latency 0.05
+"""
+import time
+import asyncio
+import argparse
+import statistics
+import threading
+
+import httpx
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+from benchmarks.stubs import StubServer, StubTelegramServer, fixed_latency, make_business_update
+
+TOKEN = "123:stub"
+SECRET_TOKEN = "benchmark-secret"
+
+
+def build_application(telegram: StubTelegramServer, received: dict, updater: bool) -> Application:
+    async def record(update: Update, context) -> None:
+        received[update.update_id] = time.perf_counter()
+
+    builder = Application.builder().token(TOKEN).base_url(telegram.url + "/bot")
+    if not updater:
+        builder = builder.updater(None)
+    application = builder.build()
+    application.add_handler(TypeHandler(Update, record))
+    return application
+
+
+async def wait_for(received: dict, count: int, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while len(received) < count and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+
+
+async def run_polling(updates: int, rate: float, network_latency: float) -> list:
+    sent, received = {}, {}
+    with StubTelegramServer(latency=fixed_latency(network_latency)) as telegram:
+        application = build_application(telegram, received, updater=True)
+        async with application:
+            await application.updater.start_polling(poll_interval=0, timeout=10)
+            await application.start()
+            for update_id in range(updates):
+                sent[update_id] = time.perf_counter()
+                telegram.add_update(make_business_update(update_id, update_id % 50, "hello"))
+                await asyncio.sleep(1 / rate)
+            await wait_for(received, updates)
+            await application.updater.stop()
+            await application.stop()
+    return [received[update_id] - sent[update_id] for update_id in received]
+
+
+async def run_webhook(updates: int, rate: float, network_latency: float) -> list:
+    from src.apps.telegram.webhook import create_webhook_app
+
+    sent, received = {}, {}
+    with StubTelegramServer() as telegram:
+        application = build_application(telegram, received, updater=False)
+        webhook = StubServer(None, lifespan="on")
+        webhook.app = create_webhook_app(application, webhook.url + "/webhook", SECRET_TOKEN, path="/webhook")
+        with webhook:
+            async with httpx.AsyncClient(base_url=webhook.url) as client:
+                async def post(update_id):
+                    sent[update_id] = time.perf_counter()
+                    await asyncio.sleep(network_latency)
+                    response = await client.post(
+                        "/webhook",
+                        json=make_business_update(update_id, update_id % 50, "hello"),
+                        headers={"X-Telegram-Bot-Api-Secret-Token": SECRET_TOKEN}
+                    )
+                    response.raise_for_status()
+
+                tasks = []
+                for update_id in range(updates):
+                    tasks.append(asyncio.create_task(post(update_id)))
+                    await asyncio.sleep(1 / rate)
+                await asyncio.gather(*tasks)
+            # ======== The handler runs in the uvicorn thread, wait until it saw every update ========
+            deadline = time.monotonic() + 60
+            while len(received) < updates and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+    return [received[update_id] - sent[update_id] for update_id in received]
+
+
+def report(name: str, latencies: list, updates: int) -> None:
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"{name:>8} {len(latencies):>5}/{updates:<5} {quantiles[49] * 1000:>8.1f} {quantiles[94] * 1000:>8.1f} "
+          f"{quantiles[98] * 1000:>8.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=100, help="Updates per second")
+    parser.add_argument("--network-latency", type=float, default=0.05, help="One-way Telegram delay in seconds")
+    args = parser.parse_args()
+
+    print(f"{'mode':>8} {'received':>11} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    report("polling", asyncio.run(run_polling(args.updates, args.rate, args.network_latency)), args.updates)
+    report("webhook", asyncio.run(run_webhook(args.updates, args.rate, args.network_latency)), args.updates)
+
+
+if __name__ == "__main__":
+    main()
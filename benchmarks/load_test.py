@@ -0,0 +1,189 @@
+"""
+End-to-end load test of handle_message with local stand-ins.
+
+Simulated clients send business messages to the real handle_message, one message at a time per client
+(like the per-chat dispatcher). The RAG model is a stub server with a configurable latency distribution,
+MongoDB is an in-memory collection with a configurable round trip, and replies go to a stub Telegram Bot
+API. Reports the throughput, the p50/p95/p99 end-to-end latency and a per-stage breakdown
+(history fetch, request build, RAG call, LEAD_CAPTURED post-processing, history write, Telegram reply), and saves the results as JSON so that runs can
+be compared.
+
+Usage:
+    python -m benchmarks.load_test --clients 50 --messages-per-client 10 --output results.json
+    python -m benchmarks.load_test --compare results.json
+"""
+import io
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import platform
+import statistics
+import contextlib
+import contextvars
+from types import SimpleNamespace
+
+from benchmarks.stubs import (StubRAGServer, StubTelegramServer, InMemoryCollection, fixed_latency,
+                              lognormal_latency, make_business_update)
+
+TOKEN = "123:stub"
+STAGES = ("history_fetch", "request_build", "rag", "lead_postprocess", "history_write", "telegram_reply")
+
+# ======== Stage durations of the update being handled by the current task ========
+current_stages = contextvars.ContextVar("current_stages")
+
+
+@contextlib.contextmanager
+def record_stage(stage: str, attributes: dict):
+    # ======== Tracing hook of src.apps.metrics.instrumentation, called around every measured stage ========
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages = current_stages.get(None)
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + time.perf_counter() - start
+
+
+def percentiles(values) -> dict:
+    if len(values) < 2:
+        values = list(values) * 2 or [0.0, 0.0]
+    quantiles = statistics.quantiles(values, n=100)
+    return {"p50": quantiles[49], "p95": quantiles[94], "p99": quantiles[98], "mean": statistics.fmean(values)}
+
+
+async def run(args) -> dict:
+    from telegram import Bot, Update
+    from telegram.request import HTTPXRequest
+    from src.apps.telegram import bot as bot_module
+    from src.apps.mongodb.repository import conversation_repository
+    from src.apps.metrics.instrumentation import set_tracing_hook
+
+    # ======== In-memory stand-in instead of MongoDB, stage timings through the tracing hook ========
+    conversation_repository.collection = InMemoryCollection(latency=fixed_latency(args.mongo_latency))
+    if hasattr(conversation_repository, "chats"):
+        # ======== HISTORY_STORAGE=messages ========
+        conversation_repository.chats = InMemoryCollection(latency=fixed_latency(args.mongo_latency))
+    set_tracing_hook(record_stage)
+
+    # ======== Same connection pool size as the bot built by Application.builder() ========
+    bot = Bot(TOKEN, base_url=args.telegram_url + "/bot", request=HTTPXRequest(connection_pool_size=256))
+    await bot.initialize()
+    context = SimpleNamespace(bot=bot)
+    update_ids = iter(range(1, 10 ** 9))
+    samples = []
+
+    async def client(chat_id: int):
+        for i in range(args.messages_per_client):
+            await asyncio.sleep(random.uniform(0, args.think_time))
+            data = make_business_update(next(update_ids), chat_id, f"client {chat_id} question {i}")
+            update = Update.de_json(data, bot)
+            stages = {}
+            current_stages.set(stages)
+            start = time.perf_counter()
+            await bot_module.handle_message(update, context)
+            samples.append({"total": time.perf_counter() - start, **stages})
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(chat_id) for chat_id in range(1, args.clients + 1)))
+    elapsed = time.perf_counter() - start
+    await bot.shutdown()
+
+    from src.apps.rag.rag_model_endpoint import close_rag_client
+    await close_rag_client()
+
+    for sample in samples:
+        sample["other"] = sample["total"] - sum(sample.get(stage, 0.0) for stage in STAGES)
+    return {
+        "messages": len(samples),
+        "seconds": elapsed,
+        "throughput": len(samples) / elapsed,
+        "latency": percentiles([sample["total"] for sample in samples]),
+        "stages": {stage: percentiles([sample.get(stage, 0.0) for sample in samples])
+                   for stage in STAGES + ("other",)},
+    }
+
+
+def print_results(results: dict, previous: dict = None) -> None:
+    def delta(path):
+        if previous is None:
+            return ""
+        old = previous
+        for key in path:
+            old = old.get(key, {}) if isinstance(old, dict) else {}
+        new = results
+        for key in path:
+            new = new[key]
+        return f" ({(new - old) / old * 100:+.0f}%)" if isinstance(old, (int, float)) and old else ""
+
+    print(f"messages: {results['messages']}, throughput: {results['throughput']:.1f} msg/s"
+          f"{delta(['throughput'])}")
+    print(f"{'stage':>16} {'p50 ms':>16} {'p95 ms':>16} {'p99 ms':>16}")
+    rows = [("end-to-end", ["latency"])] + [(stage, ["stages", stage]) for stage in results["stages"]]
+    for name, path in rows:
+        values = results
+        for key in path:
+            values = values[key]
+        cells = [f"{values[q] * 1000:.1f}{delta(path + [q])}" for q in ("p50", "p95", "p99")]
+        print(f"{name:>16} " + " ".join(f"{cell:>16}" for cell in cells))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--messages-per-client", type=int, default=10)
+    parser.add_argument("--think-time", type=float, default=0.5, help="Maximum pause between messages of a client")
+    parser.add_argument("--rag-latency", type=float, default=0.5, help="Median RAG latency in seconds")
+    parser.add_argument("--rag-latency-sigma", type=float, default=0.5,
+                        help="Sigma of the log-normal RAG latency, 0 for a fixed latency")
+    parser.add_argument("--mongo-latency", type=float, default=0.002, help="MongoDB round trip in seconds")
+    parser.add_argument("--telegram-latency", type=float, default=0.03, help="Telegram API latency in seconds")
+    parser.add_argument("--rag-cache", action="store_true", help="Keep the RAG response cache enabled")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+    args = parser.parse_args()
+    random.seed(args.seed)
+    logging.disable(logging.WARNING)
+
+    rag_latency = (lognormal_latency(args.rag_latency, args.rag_latency_sigma) if args.rag_latency_sigma
+                   else fixed_latency(args.rag_latency))
+    with StubRAGServer(latency=rag_latency) as rag, \
+            StubTelegramServer(latency=fixed_latency(args.telegram_latency)) as telegram:
+        # ======== Settings are read when src.config is imported ========
+        os.environ.update({
+            "ENV": "development",
+            "DEV_URL": rag.url + "/",
+            "DEV_COMPANY_NAME": "Benchmark",
+            "DEV_BUSINESS_USERNAME": "@benchmark_business",
+            "LEAD_EXPORT_ENABLED": "false",
+        })
+        if not args.rag_cache:
+            os.environ["RAG_CACHE_MAX_ENTRIES"] = "0"
+        args.telegram_url = telegram.url
+
+        # ======== The handler prints every message and payload, keep the report readable ========
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = asyncio.run(run(args))
+
+    results["config"] = {key: value for key, value in vars(args).items()
+                         if key not in ("output", "compare", "telegram_url")}
+    results["environment"] = {"python": platform.python_version(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)
+    print_results(results, previous)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
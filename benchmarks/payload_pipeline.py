@@ -0,0 +1,133 @@
+"""
+CPU time and memory of turning a stored history into a RAG request body and parsing the answer.
+
+Runs the path of a chat message from the history documents read from MongoDB to the parsed RAG response,
+without the network, for histories of --history messages:
+  - before: pydantic Message objects in a validated QueryRequest, converted back into dicts, the payload
+    dumped with indent=4 and printed twice, the response parsed twice and dumped with indent=4,
+  - after: the history window dicts go into the request as they are (QueryRequest.model_construct),
+    the body is serialized once, the response parsed once, the debug logs are skipped below DEBUG level.
+Reports the CPU time per chat message, the peak of the traced memory (tracemalloc) while building one
+request and the size of the body.
+
+Usage:
+    python -m benchmarks.payload_pipeline --history 10 100 1000 --iterations 200
+"""
+import io
+import json
+import time
+import logging
+import argparse
+import tracemalloc
+import contextlib
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class LegacyMessage(BaseModel):
+    role: str
+    content: str
+
+
+class LegacyQueryRequest(BaseModel):
+    query: str
+    conversation_history: Optional[List[LegacyMessage]] = ""
+    company_name: str
+
+
+def make_history(length: int, message_chars: int) -> List[dict]:
+    # ======== Latin and Cyrillic text, like the Uzbek and Russian chats of the bot ========
+    text = ("Salom, bel og'rig'i bo'yicha konsultatsiya kerak. Здравствуйте, хочу записаться на приём. "
+            * (message_chars // 80 + 1))[:message_chars]
+    return [{"role": "user" if index % 2 == 0 else "assistant", "content": f"{index} {text}"}
+            for index in range(length)]
+
+
+def before(history, response_body: bytes, build_history_window) -> dict:
+    window = build_history_window(history, "", char_budget=10 ** 9)
+    conversation_history = [LegacyMessage(content=message["content"], role=message["role"]) for message in window]
+    request = LegacyQueryRequest(query="Narxi qancha?", conversation_history=conversation_history,
+                                 company_name="Benchmark")
+    payload = {
+        "query": request.query,
+        "conversation_history": [{"role": msg.role, "content": msg.content} for msg in request.conversation_history],
+        "company_name": request.company_name
+    }
+    print(f"Payload being sent to RAG model: {json.dumps(payload, indent=4)}")
+    print(f"Exact payload being sent to RAG model: {payload}")
+    json.dumps(payload).encode("utf-8")  # ======== httpx json= ========
+    print("Full Response from RAG model: ", json.dumps(json.loads(response_body), indent=4))
+    return json.loads(response_body)
+
+
+def after(history, response_body: bytes, build_history_window, encode_payload, QueryRequest, logger) -> dict:
+    window = build_history_window(history, "", char_budget=10 ** 9)
+    request = QueryRequest.model_construct(query="Narxi qancha?", conversation_history=window,
+                                           company_name="Benchmark")
+    body = encode_payload(request)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("RAG request: %s", body.decode())
+    return json.loads(response_body)
+
+
+def measure(pipeline, iterations: int):
+    # ======== CPU time without tracing, then the traced peak of a single run ========
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        start = time.process_time()
+        for _ in range(iterations):
+            pipeline()
+            output.seek(0)
+            output.truncate()
+        cpu = (time.process_time() - start) / iterations
+
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        pipeline()
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        tracemalloc.stop()
+    return cpu, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--history", type=int, nargs="+", default=[10, 100, 1000],
+                        help="Messages in the history sent to the RAG model")
+    parser.add_argument("--message-chars", type=int, default=200)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    from src.apps.rag.history_window import build_history_window
+    from src.apps.rag.rag_model_endpoint import encode_payload, QueryRequest, logger
+
+    response_body = json.dumps({
+        "response": "Konsultatsiya narxi 150 000 so'm. Qaysi kunga yozib qo'yay? " * 8,
+        "additional_data": {"customer_info": {"name": "Shaxzod", "phone": "+998993233532", "service": "massaj"}}
+    }).encode()
+
+    print(f"{'history':>8} {'pipeline':>9} {'CPU us/msg':>11} {'peak KiB':>9} {'body KiB':>9}")
+    for length in args.history:
+        history = make_history(length, args.message_chars)
+        window = build_history_window(history, "", char_budget=10 ** 9)
+        request = QueryRequest.model_construct(query="Narxi qancha?", conversation_history=window,
+                                               company_name="Benchmark")
+        sizes = {
+            "before": len(json.dumps({"query": request.query, "conversation_history": window,
+                                      "company_name": request.company_name}).encode()),
+            "after": len(encode_payload(request)),
+        }
+        results = {}
+        for name, pipeline in (
+                ("before", lambda: before(history, response_body, build_history_window)),
+                ("after", lambda: after(history, response_body, build_history_window, encode_payload,
+                                        QueryRequest, logger))):
+            results[name] = measure(pipeline, args.iterations)
+            cpu, peak = results[name]
+            print(f"{length:>8} {name:>9} {cpu * 1e6:>11.1f} {peak / 1024:>9.1f} {sizes[name] / 1024:>9.1f}")
+        print(f"{'':>8} {'speedup':>9} {results['before'][0] / results['after'][0]:>10.1f}x "
+              f"{results['before'][1] / results['after'][1]:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
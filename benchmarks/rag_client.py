@@ -0,0 +1,61 @@
+"""
+Throughput of rag_model_endpoint with N simultaneous chats against a local stub RAG server.
+
+Each chat sends its requests one after another, like a customer waiting for every answer,
+so with a non-blocking client the throughput should grow with the number of chats
+until RAG_MAX_CONCURRENT_REQUESTS (or the connection pool) is reached.
+
+Usage:
+    python -m benchmarks.rag_client --chats 1,2,4,8,16,32,64 --requests-per-chat 5 --latency 0.2
+"""
+import os
+import time
+import asyncio
+import logging
+import argparse
+
+from benchmarks.stubs import StubRAGServer, fixed_latency
+
+
+async def run_chats(n_chats: int, requests_per_chat: int) -> float:
+    from src.apps.rag.rag_model_endpoint import rag_model_endpoint, close_rag_client, QueryRequest
+
+    async def chat(chat_id: int):
+        for i in range(requests_per_chat):
+            await rag_model_endpoint(QueryRequest(
+                query=f"chat {chat_id} question {i}",
+                conversation_history=[],
+                company_name="Benchmark"
+            ))
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(chat(chat_id) for chat_id in range(n_chats)))
+    finally:
+        await close_rag_client()
+    return n_chats * requests_per_chat / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", default="1,2,4,8,16,32,64", help="Comma separated numbers of simultaneous chats")
+    parser.add_argument("--requests-per-chat", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.2, help="Stub RAG latency in seconds")
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    with StubRAGServer(latency=fixed_latency(args.latency)) as stub:
+        # ======== Point the RAG settings at the stub before src.config is imported ========
+        os.environ["ENV"] = "development"
+        os.environ["DEV_URL"] = stub.url + "/"
+
+        print(f"{'chats':>6} {'requests/s':>12} {'speedup':>8}")
+        baseline = None
+        for n_chats in [int(n) for n in args.chats.split(",")]:
+            throughput = asyncio.run(run_chats(n_chats, args.requests_per_chat))
+            baseline = baseline or throughput
+            print(f"{n_chats:>6} {throughput:>12.1f} {throughput / baseline:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Tail latency and errors of the RAG requests with several replicas, one of them degraded or down.
+
+Compares a plain round robin over the replicas (what a DNS name in front of them gives) with
+RAGBalancer without and with hedging. Every scenario runs --chats simultaneous chats that send
+their requests one after another.
+
+Usage:
+    python -m benchmarks.rag_replicas --replicas 3 --chats 16 --requests-per-chat 20 --latency 0.2 --slow-latency 2
+"""
+import json
+import time
+import asyncio
+import logging
+import itertools
+import argparse
+import statistics
+
+import httpx
+
+from benchmarks.stubs import StubRAGServer, free_port, lognormal_latency
+
+
+async def run(send, chats: int, requests_per_chat: int):
+    latencies, errors = [], 0
+
+    async def chat(chat_id: int):
+        nonlocal errors
+        for i in range(requests_per_chat):
+            start = time.perf_counter()
+            try:
+                await send({"query": f"chat {chat_id} question {i}", "conversation_history": [],
+                            "company_name": "Benchmark"})
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                errors += 1
+
+    await asyncio.gather(*(chat(chat_id) for chat_id in range(chats)))
+    return latencies, errors
+
+
+def report(name: str, latencies, errors: int, extra: str = "") -> None:
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0.0] * 99
+    print(f"{name:>22} {statistics.median(latencies):>8.3f} {quantiles[94]:>8.3f} {quantiles[98]:>8.3f} "
+          f"{errors:>7} {extra}")
+
+
+async def scenario(title: str, urls, args) -> None:
+    from src.apps.rag.balancer import RAGBalancer
+
+    print(f"\n{title}")
+    print(f"{'':>22} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'errors':>7}")
+    async with httpx.AsyncClient(timeout=30, limits=httpx.Limits(max_connections=200)) as client:
+        round_robin = itertools.cycle(urls)
+
+        async def send_round_robin(payload):
+            response = await client.post(next(round_robin), json=payload)
+            response.raise_for_status()
+
+        report("round robin", *await run(send_round_robin, args.chats, args.requests_per_chat))
+
+        for name, percentile in (("balancer", 0), ("balancer + hedging", args.hedge_percentile)):
+            balancer = RAGBalancer(urls, hedge_percentile=percentile, hedge_min_delay=args.hedge_min_delay,
+                                   failure_threshold=5, reset_timeout=30)
+            latencies, errors = await run(lambda payload: balancer.post(client, json.dumps(payload).encode()),
+                                          args.chats, args.requests_per_chat)
+            stats = balancer.stats()
+            report(name, latencies, errors, f"hedges={stats['hedges']} hedge_wins={stats['hedge_wins']} "
+                                            f"failovers={stats['failovers']} open_circuits={stats['open_circuits']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument("--chats", type=int, default=16)
+    parser.add_argument("--requests-per-chat", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2, help="Median latency of a healthy replica in seconds")
+    parser.add_argument("--slow-latency", type=float, default=2.0, help="Median latency of the degraded replica")
+    parser.add_argument("--hedge-percentile", type=float, default=95)
+    parser.add_argument("--hedge-min-delay", type=float, default=0.3)
+    args = parser.parse_args()
+    # ======== Failovers and cancelled hedges are expected here, keep the tables readable ========
+    logging.getLogger("src.apps.rag.balancer").setLevel(logging.ERROR)
+    logging.getLogger("uvicorn.error").setLevel(logging.CRITICAL)
+
+    servers = [StubRAGServer(latency=lognormal_latency(args.latency)) for _ in range(args.replicas - 1)]
+    servers.append(StubRAGServer(latency=lognormal_latency(args.slow_latency)))
+    for server in servers:
+        server.start()
+    try:
+        urls = [server.url + "/" for server in servers]
+        asyncio.run(scenario(f"{args.replicas} replicas, one with a median latency of {args.slow_latency}s",
+                             urls, args))
+        # ======== Nothing listens on the last port: the replica is down ========
+        asyncio.run(scenario(f"{args.replicas} replicas, one down",
+                             urls[:-1] + [f"http://127.0.0.1:{free_port()}/"], args))
+    finally:
+        for server in servers:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Outbound Telegram sends under a burst, with and without the send scheduler.
+
+--chats chats get --replies-per-chat customer replies at once, while --background background sends
+(retried answers, streaming edits) go to the same chats. The stub Telegram server applies flood control
+(--chat-limit messages per second per chat, --global-limit over all the chats) and answers the sends above
+it with a 429. Without the scheduler these 429s reach the handlers as errors; with it they are retried after
+retry_after, and the customer replies overtake the background sends.
+
+Usage:
+    python -m benchmarks.send_scheduler --chats 50 --replies-per-chat 2 --background 100
+"""
+import time
+import asyncio
+import logging
+import argparse
+import statistics
+
+from telegram.ext import ExtBot
+from telegram.request import HTTPXRequest
+
+from benchmarks.stubs import StubTelegramServer
+
+
+async def run(base_url: str, scheduler, args):
+    from src.apps.telegram.send_scheduler import send_priority, BACKGROUND
+
+    bot = ExtBot("123:stub", base_url=base_url, rate_limiter=scheduler,
+                 request=HTTPXRequest(connection_pool_size=256))
+    latencies = {"reply": [], "background": []}
+    errors = 0
+
+    async def send(chat_id: int, kind: str):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            await bot.send_message(chat_id, f"{kind} message",
+                                   **(send_priority(bot, BACKGROUND) if kind == "background" else {}))
+            latencies[kind].append(time.perf_counter() - start)
+        except Exception:
+            errors += 1
+
+    async with bot:
+        sends = [send(chat_id, "background") for chat_id in range(args.background)]
+        sends += [send(chat_id % args.chats, "reply") for chat_id in range(args.chats * args.replies_per_chat)]
+        start = time.perf_counter()
+        await asyncio.gather(*sends)
+        total = time.perf_counter() - start
+    return latencies, errors, total
+
+
+def report(name: str, latencies, errors: int, total: float, flooded: int) -> None:
+    def p95(values):
+        return statistics.quantiles(values, n=20)[18] if len(values) > 1 else (values[0] if values else 0.0)
+
+    def cells(values):
+        # ======== "-" when every send of the kind failed ========
+        if not values:
+            return f"{'-':>10} {'-':>10}"
+        return f"{statistics.median(values):>10.2f} {p95(values):>10.2f}"
+
+    print(f"{name:>16} {cells(latencies['reply'])} {cells(latencies['background'])} "
+          f"{errors:>7} {flooded:>6} {total:>8.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--replies-per-chat", type=int, default=2)
+    parser.add_argument("--background", type=int, default=100, help="Background sends, one per chat id")
+    parser.add_argument("--chat-limit", type=int, default=3, help="Stub flood limit per chat, messages per second")
+    parser.add_argument("--global-limit", type=int, default=30, help="Stub flood limit over all chats, messages per second")
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("src.apps.telegram.send_scheduler").setLevel(logging.ERROR)
+
+    from src.apps.telegram.send_scheduler import OutboundScheduler
+
+    print(f"{'':>16} {'reply p50':>10} {'reply p95':>10} {'bg p50':>10} {'bg p95':>10} {'errors':>7} {'429s':>6} {'total s':>8}")
+    for name in ("no scheduler", "scheduler"):
+        with StubTelegramServer(flood_limits=(args.chat_limit, args.global_limit)) as stub:
+            # ======== burst + rate per second stays within the one second window of the stub ========
+            scheduler = OutboundScheduler(global_rate=args.global_limit * 0.8, global_burst=max(args.global_limit // 5, 1),
+                                          chat_rate=1, chat_burst=max(args.chat_limit - 1, 1), max_retries=5) \
+                if name == "scheduler" else None
+            latencies, errors, total = asyncio.run(run(stub.url + "/bot", scheduler, args))
+            report(name, latencies, errors, total, stub.flooded)
+
+
+if __name__ == "__main__":
+    main()
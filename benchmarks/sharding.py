@@ -0,0 +1,142 @@
+"""
+Throughput of the bot sharded across 1..N worker processes.
+
+A stub Telegram server feeds --chats x --updates-per-chat business messages through getUpdates. The ingress
+process (ShardRouter) routes them to the worker processes, which burn --cpu-ms of CPU per update (standing in
+for the parsing, history building and serialization of the real handler) and answer with sendMessage.
+Reports the updates answered per second, whether every chat was answered in order, and how evenly the chats
+spread over the workers. With --restart, a worker is stopped (SIGTERM) halfway through the run: the updates
+of its chats wait in the ingress while it restarts, and none is lost or answered out of order.
+
+Speedup needs as many CPU cores as workers.
+
+Usage:
+    python -m benchmarks.sharding --workers 1 2 4 --chats 200 --updates-per-chat 5 --cpu-ms 5
+    python -m benchmarks.sharding --workers 2 4 --updates-per-chat 10 --interval 0.5 --restart
+"""
+import os
+import sys
+import time
+import signal
+import asyncio
+import logging
+import argparse
+import tempfile
+import collections
+
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+from benchmarks.stubs import StubTelegramServer, make_business_update
+from src.apps.telegram.dispatcher import PerChatUpdateProcessor
+from src.apps.telegram.sharding import ShardRouter, run_worker
+
+
+def burn(milliseconds: float) -> None:
+    deadline = time.perf_counter() + milliseconds / 1000
+    while time.perf_counter() < deadline:
+        pass
+
+
+def worker(args) -> None:
+    async def answer(update: Update, context) -> None:
+        burn(args.cpu_ms)
+        message = update.business_message
+        await context.bot.send_message(message.chat.id, f"{os.getpid()} {message.text}")
+
+    application = (Application.builder().token("123:stub").base_url(args.base_url).updater(None)
+                   .concurrent_updates(PerChatUpdateProcessor(64, 16, idle_timeout=60)).build())
+    application.add_handler(TypeHandler(Update, answer))
+    run_worker(application, args.socket)
+
+
+async def run(server: StubTelegramServer, workers: int, args):
+    command = lambda index, socket_path: [sys.executable, "-m", "benchmarks.sharding", "--worker",
+                                          "--base-url", server.url + "/bot", "--socket", socket_path,
+                                          "--cpu-ms", str(args.cpu_ms)]
+    socket_dir = tempfile.TemporaryDirectory(prefix="revise-bot-bench-")
+    router = ShardRouter(workers, command, socket_dir.name, restart_backoff=0.2)
+    application = (Application.builder().token("123:stub").base_url(server.url + "/bot")
+                   .concurrent_updates(router).build())
+    total = args.chats * args.updates_per_chat
+    sent_before = len(server.sent)
+
+    async def feed():
+        update_id = 1_000_000 * workers
+        for seq in range(args.updates_per_chat):
+            if args.restart and seq == args.updates_per_chat // 2:
+                # ======== Halfway through, a worker stops while the updates keep coming ========
+                router.workers[0].process.send_signal(signal.SIGTERM)
+            for chat_id in range(args.chats):
+                update_id += 1
+                server.add_update(make_business_update(update_id, chat_id, str(seq)))
+            await asyncio.sleep(args.interval)
+
+    async with application:
+        await application.start()
+        await application.updater.start_polling(poll_interval=0, timeout=1)
+        # ======== Wait for every worker, the startup is not part of the measurement ========
+        while router.stats()["workers_connected"] < workers:
+            await asyncio.sleep(0.05)
+
+        start = time.perf_counter()
+        feeding = asyncio.create_task(feed())
+        while len(server.sent) - sent_before < total and time.perf_counter() - start < args.timeout:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        stats = router.stats()
+
+        await feeding
+        await application.updater.stop()
+        await application.stop()
+    socket_dir.cleanup()
+
+    answers = [params for _, method, params in server.sent[sent_before:] if method == "sendMessage"]
+    by_chat, chats_per_worker = collections.defaultdict(list), collections.defaultdict(set)
+    for params in answers:
+        pid, seq = params["text"].split()
+        by_chat[params["chat_id"]].append(int(seq))
+        chats_per_worker[pid].add(params["chat_id"])
+    in_order = all(seqs == sorted(seqs) for seqs in by_chat.values())
+    spread = sorted(len(chats) for chats in chats_per_worker.values())
+    return elapsed, len(answers), total, in_order, spread, stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--updates-per-chat", type=int, default=5)
+    parser.add_argument("--cpu-ms", type=float, default=5, help="CPU time a worker spends on an update")
+    parser.add_argument("--interval", type=float, default=0, help="Seconds between the rounds of updates")
+    parser.add_argument("--restart", action="store_true", help="Stop a worker halfway through every run")
+    parser.add_argument("--timeout", type=float, default=120)
+    # ======== Worker process mode, used by the ingress ========
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    parser.add_argument("--socket", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        logging.basicConfig(level=logging.WARNING)
+        worker(args)
+        return
+
+    logging.getLogger("src.apps.telegram.sharding").setLevel(logging.ERROR)
+    print(f"{os.cpu_count()} CPU cores, {args.chats * args.updates_per_chat} updates, {args.cpu_ms} ms CPU each")
+    print(f"{'workers':>8} {'seconds':>9} {'updates/s':>10} {'speedup':>8} {'answered':>10} {'in order':>9} "
+          f"{'chats per worker':>18}")
+    with StubTelegramServer() as server:
+        baseline = None
+        for workers in args.workers:
+            elapsed, answered, total, in_order, spread, stats = asyncio.run(run(server, workers, args))
+            throughput = answered / elapsed
+            baseline = baseline or throughput
+            restarts = sum(value for key, value in stats.items() if key.endswith("_restarts"))
+            print(f"{workers:>8} {elapsed:>9.2f} {throughput:>10.1f} {throughput / baseline:>7.1f}x "
+                  f"{f'{answered}/{total}':>10} {str(in_order):>9} {'/'.join(map(str, spread)):>18}"
+                  + (f"  restarts={restarts}" if args.restart else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Time from process start to the first handled update.
+
+Starts the bot (`python src/config/main.py`) in a subprocess against a stub Telegram Bot API and a stub
+RAG server, with one client message already waiting in getUpdates. Reports the time until the bot asks
+for updates (ready to receive) and until it sends the reply to the waiting message (first handled update).
+
+The reply needs MongoDB, pass `--mongo-uri` of a reachable deployment. With an unreachable one the bot
+still becomes ready to receive right away, which is what the lazy connection setup is about.
+
+Usage:
+    python -m benchmarks.startup_time --runs 5 --mongo-uri mongodb://localhost:27017
+"""
+import os
+import sys
+import time
+import signal
+import argparse
+import statistics
+import subprocess
+
+from benchmarks.stubs import StubRAGServer, StubTelegramServer, fixed_latency, make_business_update
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "123:stub"
+
+
+def start_once(mongo_uri: str, timeout: float):
+    with StubTelegramServer() as telegram, StubRAGServer(latency=fixed_latency(0)) as rag:
+        telegram.add_update(make_business_update(1, 1, "hello"))
+        env = {
+            **os.environ,
+            "ENV": "development",
+            "TELEGRAM_BOT_TOKEN": TOKEN,
+            "TELEGRAM_API_BASE_URL": telegram.url + "/bot",
+            "DEV_URL": rag.url + "/",
+            "DEV_COMPANY_NAME": "Benchmark",
+            "DEV_BUSINESS_USERNAME": "@benchmark_business",
+            "MONGO_CLIENT": mongo_uri,
+            "DATABASE_NAME": "benchmark",
+            "LEAD_EXPORT_ENABLED": "false",
+        }
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, "src/config/main.py", "--mode", "polling"], cwd=ROOT, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = start + timeout
+            while not telegram.sent and time.perf_counter() < deadline and process.poll() is None:
+                time.sleep(0.005)
+        finally:
+            process.send_signal(signal.SIGINT)
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+        ready = telegram.first_calls.get("getUpdates")
+        handled = telegram.sent[0][0] if telegram.sent else None
+        return (ready - start if ready else None), (handled - start if handled else None)
+
+
+def summary(values) -> str:
+    values = [value for value in values if value is not None]
+    if not values:
+        return "n/a"
+    return f"{statistics.median(values) * 1000:.0f} ms (min {min(values) * 1000:.0f}, max {max(values) * 1000:.0f})"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for the first reply")
+    args = parser.parse_args()
+
+    results = [start_once(args.mongo_uri, args.timeout) for _ in range(args.runs)]
+    print(f"ready to receive updates: {summary([ready for ready, _ in results])}")
+    print(f"first handled update:     {summary([handled for _, handled in results])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+Local stand-ins for the external services the bot talks to.
+They are used by the benchmark scripts so that no real RAG model, database or Telegram account is needed.
+"""
+import copy
+import json
+import time
+import types
+import random
+import socket
+import asyncio
+import threading
+import itertools
+import collections
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def free_port() -> int:
+    """
+    Returns a free TCP port on localhost.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# ======== Latency distributions for the stub servers ========
+def fixed_latency(seconds: float):
+    return lambda: seconds
+
+
+def lognormal_latency(median: float, sigma: float = 0.5):
+    """
+    Long-tailed latency, which is closer to what an LLM backend looks like than a fixed delay.
+    """
+    return lambda: random.lognormvariate(0, sigma) * median
+
+
+class StubServer:
+    """
+    Serves an ASGI app with uvicorn in a background thread, so the stub does not share
+    the event loop of the code being measured.
+    """
+
+    def __init__(self, app, host: str = "127.0.0.1", port: int = None, lifespan: str = "off"):
+        self.app = app
+        self.host = host
+        self.port = port or free_port()
+        self.lifespan = lifespan
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        config = uvicorn.Config(self.app, host=self.host, port=self.port, log_level="warning",
+                                lifespan=self.lifespan)
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def stop(self) -> None:
+        self._server.should_exit = True
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class StubRAGServer(StubServer):
+    """
+    Answers RAG queries after a delay drawn from `latency`.
+    """
+
+    def __init__(self, latency=fixed_latency(0.2), **kwargs):
+        self.latency = latency
+        self.requests = 0
+        app = FastAPI()
+
+        @app.post("/")
+        async def query(request: Request):
+            payload = await request.json()
+            self.requests += 1
+            await asyncio.sleep(self.latency())
+            return {"response": f"Stub answer to: {payload['query']}", "additional_data": {}}
+
+        super().__init__(app, **kwargs)
+
+
+def make_business_update(update_id: int, chat_id: int, text: str, username: str = None,
+                         from_username: str = None) -> dict:
+    """
+    Builds the JSON of a Telegram update carrying a business message from a client chat.
+    """
+    username = username or f"client_{chat_id}"
+    return {
+        "update_id": update_id,
+        "business_message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "business_connection_id": "stub-connection",
+            "chat": {"id": chat_id, "type": "private", "username": username, "first_name": username},
+            "from": {"id": chat_id, "is_bot": False, "first_name": username, "username": from_username or username},
+            "text": text,
+        },
+    }
+
+
+class StubTelegramServer(StubServer):
+    """
+    Minimal Telegram Bot API: getMe, setWebhook, deleteWebhook, getUpdates (long polling), and the send/edit
+    methods, which are recorded in `sent`. getUpdates and the send/edit methods are answered after a delay
+    drawn from `latency`.
+    With `flood_limits` = (per chat, global) messages per second, sends above the limits get a 429 with
+    retry_after, like Telegram's flood control. They are counted in `flooded`.
+    Use `url + "/bot"` as the base_url of the bot.
+    """
+
+    def __init__(self, latency=fixed_latency(0), flood_limits=None, **kwargs):
+        self.latency = latency
+        self.flood_limits = flood_limits
+        self.flooded = 0
+        self._recent_sends = collections.defaultdict(collections.deque)
+        self.calls = collections.Counter()
+        self.first_calls = {}
+        self.sent = []
+        self._updates = []
+        self._lock = threading.Lock()
+        self._loop = None
+        self._new_updates = None
+        self._message_ids = itertools.count(1)
+        app = FastAPI()
+
+        @app.post("/bot{token}/{method}")
+        async def api(token: str, method: str, request: Request):
+            self.calls[method] += 1
+            self.first_calls.setdefault(method, time.perf_counter())
+            params = await self._params(request)
+            if self._flood_control(method, params):
+                self.flooded += 1
+                return JSONResponse(status_code=429, content={
+                    "ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1}
+                })
+            return {"ok": True, "result": await self._call(method, params)}
+
+        super().__init__(app, **kwargs)
+
+    def add_update(self, update: dict) -> None:
+        """
+        Queues an update for getUpdates, can be called from any thread.
+        """
+        with self._lock:
+            self._updates.append(update)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._new_updates.set)
+
+    @staticmethod
+    async def _params(request: Request) -> dict:
+        if request.headers.get("content-type", "").startswith("application/json"):
+            return await request.json()
+        params = {}
+        for name, value in (await request.form()).items():
+            try:
+                params[name] = json.loads(value)
+            except ValueError:
+                params[name] = value
+        return params
+
+    def _flood_control(self, method: str, params: dict) -> bool:
+        # ======== Sliding window of one second per chat and over all the chats ========
+        if self.flood_limits is None or method not in ("sendMessage", "editMessageText"):
+            return False
+        now = time.monotonic()
+        chat_limit, global_limit = self.flood_limits
+        windows = ((self._recent_sends[params.get("chat_id")], chat_limit), (self._recent_sends[None], global_limit))
+        for window, _ in windows:
+            while window and window[0] <= now - 1:
+                window.popleft()
+        if any(len(window) >= limit for window, limit in windows):
+            return True
+        for window, _ in windows:
+            window.append(now)
+        return False
+
+    async def _call(self, method: str, params: dict):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot",
+                    "can_join_groups": False, "can_read_all_group_messages": False,
+                    "supports_inline_queries": False, "can_connect_to_business": True}
+        if method == "getUpdates":
+            updates = await self._get_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0))
+            await asyncio.sleep(self.latency())
+            return updates
+        if method in ("sendMessage", "editMessageText"):
+            await asyncio.sleep(self.latency())
+            self.sent.append((time.perf_counter(), method, params))
+            return {
+                "message_id": params.get("message_id") or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": params.get("chat_id"), "type": "private"},
+                "text": params.get("text"),
+            }
+        # ======== setWebhook, deleteWebhook, sendChatAction, ... ========
+        return True
+
+    async def _get_updates(self, offset: int, timeout: float):
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._new_updates = asyncio.Event()
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._updates = [update for update in self._updates if update["update_id"] >= offset]
+                updates = list(self._updates)
+                self._new_updates.clear()
+            remaining = deadline - time.monotonic()
+            if updates or remaining <= 0:
+                return updates
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+
+class InMemoryCollection:
+    """
+    Stand-in for a pymongo collection with the subset of operations used by the repositories.
+    Calls are blocking (like pymongo) and take `latency` seconds, every call is counted in `calls`.
+    """
+
+    def __init__(self, latency=fixed_latency(0)):
+        self.latency = latency
+        self.documents = []
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+
+    def _round_trip(self, operation: str) -> None:
+        self.calls[operation] += 1
+        delay = self.latency()
+        if delay:
+            time.sleep(delay)
+
+    _OPERATORS = {
+        "$exists": lambda document, field, value: (field in document) == value,
+        "$in": lambda document, field, value: document.get(field) in value,
+        "$gte": lambda document, field, value: field in document and document[field] >= value,
+        "$gt": lambda document, field, value: field in document and document[field] > value,
+        "$lte": lambda document, field, value: field in document and document[field] <= value,
+        "$lt": lambda document, field, value: field in document and document[field] < value,
+    }
+
+    @classmethod
+    def _matches(cls, document, query) -> bool:
+        for field, value in query.items():
+            if isinstance(value, dict):
+                if not all(cls._OPERATORS[operator](document, field, operand) for operator, operand in value.items()):
+                    return False
+            elif isinstance(document.get(field), list) and not isinstance(value, list):
+                # ======== Like MongoDB, a value matches an array field containing it ========
+                if value not in document[field]:
+                    return False
+            elif document.get(field) != value:
+                return False
+        return True
+
+    def _find(self, query):
+        for document in self.documents:
+            if self._matches(document, query):
+                return document
+        return None
+
+    @staticmethod
+    def _project(document, projection):
+        document = copy.deepcopy(document)
+        included = [field for field, spec in (projection or {}).items()
+                    if spec == 1 or isinstance(spec, dict)]
+        if included:
+            # ======== Inclusion projection: only the listed fields (and _id unless excluded) are returned ========
+            document = {field: value for field, value in document.items() if field in included or field == "_id"}
+        for field, spec in (projection or {}).items():
+            if spec == 0:
+                document.pop(field, None)
+            elif isinstance(spec, dict) and "$slice" in spec:
+                document[field] = document.get(field, [])[spec["$slice"]:]
+        return document
+
+    def create_index(self, keys, **kwargs):
+        self._round_trip("create_index")
+        return str(keys)
+
+    def find(self, query, projection=None):
+        """
+        :return: Cursor supporting sort() and limit(), the documents are read when it is iterated
+        """
+        return _InMemoryCursor(self, query, projection)
+
+    def insert_many(self, documents, ordered=True):
+        self._round_trip("insert_many")
+        with self._lock:
+            self.documents.extend(copy.deepcopy(list(documents)))
+
+    def _update(self, query, update, upsert):
+        document = self._find(query)
+        if document is None:
+            if not upsert:
+                return None
+            document = {field: value for field, value in query.items() if not isinstance(value, dict)}
+            self.documents.append(document)
+        for field, value in update.get("$set", {}).items():
+            document[field] = value
+        for field, value in update.get("$inc", {}).items():
+            document[field] = document.get(field, 0) + value
+        for field, spec in update.get("$push", {}).items():
+            values = document.get(field, []) + list(spec["$each"])
+            document[field] = values[spec["$slice"]:] if "$slice" in spec else values
+        return document
+
+    def find_one(self, query, projection=None):
+        self._round_trip("find_one")
+        with self._lock:
+            document = self._find(query)
+            return None if document is None else self._project(document, projection)
+
+    def update_one(self, query, update, upsert=False):
+        self._round_trip("update_one")
+        with self._lock:
+            document = self._update(query, update, upsert)
+        return types.SimpleNamespace(modified_count=int(document is not None))
+
+    def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=None):
+        # ======== Always returns the document after the update, like ReturnDocument.AFTER ========
+        self._round_trip("find_one_and_update")
+        with self._lock:
+            document = self._update(query, update, upsert)
+            return None if document is None else self._project(document, projection)
+
+
+class _InMemoryCursor:
+    def __init__(self, collection: InMemoryCollection, query, projection):
+        self.collection = collection
+        self.query = query
+        self.projection = projection
+        self._sort = []
+        self._limit = 0
+
+    def sort(self, key, direction=None):
+        self._sort = [(key, direction or 1)] if isinstance(key, str) else list(key)
+        return self
+
+    def limit(self, limit: int):
+        self._limit = limit
+        return self
+
+    def __iter__(self):
+        self.collection._round_trip("find")
+        with self.collection._lock:
+            documents = [document for document in self.collection.documents
+                         if self.collection._matches(document, self.query)]
+        for field, direction in reversed(self._sort):
+            documents.sort(key=lambda document: document.get(field), reverse=direction < 0)
+        if self._limit:
+            documents = documents[:self._limit]
+        return iter([self.collection._project(document, self.projection) for document in documents])
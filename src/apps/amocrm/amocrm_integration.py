@@ -1,10 +1,13 @@
 import os
-from amocrm.v2 import Lead, tokens
-from typing import Dict
+import threading
+from amocrm.v2 import Lead, tokens, exceptions, interaction
+from typing import Dict, List, Optional
 import logging
 from dotenv import load_dotenv
 import asyncio
 
+from src.config import settings
+
 load_dotenv()
 
 # ===== Logging configuration =====
@@ -13,7 +16,7 @@ logger = logging.getLogger(__name__)
 
 CLIENT_ID = os.getenv("CLIENT_ID")
 CLIENT_SECRET = os.getenv("CLIENT_SECRET")
-SUBDOMAIN = os.getenv("SUBDOMAIN")
+SUBDOMAIN = os.getenv("SUBDOMAIN") or 'muxsinmuxtorov01'  # your amoCRM account subdomain (e.g. company.amocrm.com)
 REDIRECT_URI = os.getenv("REDIRECT_URI")
 AUTH_CODE = os.getenv("AUTH_CODE")
 
@@ -23,6 +26,96 @@ AUTH_CODE = os.getenv("AUTH_CODE")
 # print("REDIRECT_URI:", REDIRECT_URI)
 # print("AUTH_CODE:", AUTH_CODE)
 
+# ===== The token manager is initialized once per process, tokens are refreshed by amocrm itself =====
+_token_manager_lock = threading.Lock()
+_token_manager_ready = False
+
+
+def init_token_manager() -> None:
+    """
+    Configures the amoCRM token manager on the first call, later calls return right away.
+    :raises Exception: If the token initialization fails, the next call tries again
+    """
+    global _token_manager_ready
+    if _token_manager_ready:
+        return
+    with _token_manager_lock:
+        if _token_manager_ready:
+            return
+        tokens.default_token_manager(
+            client_id=CLIENT_ID,
+            client_secret=CLIENT_SECRET,
+            subdomain=SUBDOMAIN,
+            redirect_url=REDIRECT_URI,
+            storage=tokens.FileTokensStorage()  # storage to persist tokens
+        )
+        tokens.default_token_manager.init(
+            code=AUTH_CODE, skip_error=True
+        )
+        _token_manager_ready = True
+        logger.info("Token initialization successful.")
+
+
+# ===== Lead interactions of the tenants' amoCRM accounts, by subdomain (they share the HTTP session) =====
+_tenant_interactions: Dict[str, interaction.GenericInteraction] = {}
+
+
+def get_lead_interaction(amocrm: Optional[Dict[str, str]] = None) -> interaction.GenericInteraction:
+    """
+    :param amocrm: amoCRM credentials of a tenant (client_id, client_secret, subdomain, redirect_uri, auth_code),
+        None for the credentials of the environment
+    :return: Interaction creating leads in the amoCRM account, its token manager is initialized on the first call
+    :raises Exception: If the token initialization fails, the next call tries again
+    """
+    if amocrm is None:
+        init_token_manager()
+        return Lead.objects._interaction
+
+    subdomain = amocrm["subdomain"]
+    lead_interaction = _tenant_interactions.get(subdomain)
+    if lead_interaction is not None:
+        return lead_interaction
+    with _token_manager_lock:
+        if subdomain not in _tenant_interactions:
+            # ======== Every account keeps its tokens in its own directory ========
+            tokens_dir = os.path.join(settings.AMOCRM_TOKENS_DIR, subdomain)
+            os.makedirs(tokens_dir, exist_ok=True)
+            token_manager = tokens.TokenManager()
+            token_manager(
+                client_id=amocrm["client_id"],
+                client_secret=amocrm["client_secret"],
+                subdomain=subdomain,
+                redirect_url=amocrm.get("redirect_uri"),
+                storage=tokens.FileTokensStorage(tokens_dir)
+            )
+            token_manager.init(code=amocrm.get("auth_code"), skip_error=True)
+            _tenant_interactions[subdomain] = interaction.GenericInteraction(token_manager=token_manager, path="leads")
+            logger.info(f"Token initialization of the amoCRM account {subdomain} successful.")
+        return _tenant_interactions[subdomain]
+
+
+def format_lead_name(customer_info) -> str:
+    return (f"Имя:{customer_info.get('name')} \n"
+            f"Номер_телефона:{customer_info.get('phone')} \n"
+            f"Услуга:{customer_info.get('service') or 'Hizmat aniqlanmadi'} \n"
+            f"Платформа: Telegram Bot")
+
+
+def create_leads(customer_infos: List[Dict], amocrm: Optional[Dict[str, str]] = None) -> List[int]:
+    """
+    :does: Creates the leads of all the customers with a single amoCRM request (blocking)
+    :param customer_infos: Customer info dicts with name, phone and service
+    :param amocrm: amoCRM credentials of the tenant, None for the account of the environment
+    :return: IDs of the created leads
+    """
+    lead_interaction = get_lead_interaction(amocrm)
+    response, status = lead_interaction.request(
+        "post", lead_interaction._get_path(), data=[{"name": format_lead_name(info)} for info in customer_infos]
+    )
+    if status == 400:
+        raise exceptions.ValidationError(response)
+    return [lead["id"] for lead in response["_embedded"]["leads"]]
+
 
 async def handle_customer_info(rag_response):
     customer_info = rag_response.get("additional_data", {}).get("customer_info", {})
@@ -41,33 +134,12 @@ async def send_data_to_amocrm(customer_info):
     """
 
     try:
-        tokens.default_token_manager(
-            client_id=CLIENT_ID,
-            client_secret=CLIENT_SECRET,
-            subdomain='muxsinmuxtorov01',  # your amoCRM account subdomain (e.g. company.amocrm.com)
-            redirect_url=REDIRECT_URI,
-            storage=tokens.FileTokensStorage()  # storage to persist tokens
-        )
-        tokens.default_token_manager.init(
-            code=AUTH_CODE, skip_error=True
-        )
-        logger.info("Token initialization successful.")
+        await asyncio.to_thread(init_token_manager)
     except Exception as e:
         logger.error(f"Error during token initialization: {str(e)}")
         return {"Error":"Token initialization failed."}
 
-    lead_data = (f"Имя:{customer_info.get('name')} \n"
-                 f"Номер_телефона:{customer_info.get('phone')} \n"
-                 f"Услуга:{customer_info.get('service') or 'Hizmat aniqlanmadi'} \n"
-                 f"Платформа: Telegram Bot")
-
-    lead_ = Lead.objects.create(name=lead_data)
-
-    # Return success response
-    leads = Lead.objects.all()
-
-    for lead in leads:
-        print(f'Lead ID: {lead.id}, Lead Name: {lead.name}')
+    lead_ = await asyncio.to_thread(Lead.objects.create, name=format_lead_name(customer_info))
 
     return {"Success": True}  # Optionally return a success message
 
@@ -82,4 +154,4 @@ async def send_data_to_amocrm(customer_info):
 #                 }
 #             }
 #         }
-#     asyncio.run(handle_customer_info(data))
\ No newline at end of file
+#     asyncio.run(handle_customer_info(data))
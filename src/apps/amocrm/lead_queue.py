@@ -0,0 +1,152 @@
+import re
+import asyncio
+import logging
+import itertools
+from typing import Dict, Optional
+from amocrm.v2 import exceptions
+
+from src.config import settings
+from src.apps.mongodb.connection import get_collection
+from src.apps.mongodb.durable_queue import DurableQueue
+from src.apps.amocrm.amocrm_integration import create_leads, CLIENT_ID
+from src.apps.tenants.registry import Tenant, default_tenant, get_tenant
+from src.apps.metrics.instrumentation import QUEUE_DEPTH
+
+
+# ===== Logging configuration =====
+logger = logging.getLogger(__name__)
+
+
+def normalize_phone(phone) -> str:
+    # ======== "+998 99 323-35-32" and "998993233532" are the same customer ========
+    return re.sub(r"\D", "", str(phone or ""))
+
+
+class LeadExportQueue:
+    """
+    Background export of the captured leads to amoCRM.
+
+    handle_message only puts the customer_info into a durable MongoDB queue, deduplicated by the phone number
+    for LEAD_DEDUP_WINDOW_DAYS after the lead was exported.
+    A worker task creates the queued leads in batches of `batch_size` with one amoCRM request, off the event
+    loop, and retries failed batches with backoff. A batch rejected by amoCRM is bisected, so one invalid lead
+    does not hold back the others. Chat replies never wait on amoCRM. Every lead goes to the
+    amoCRM account of its tenant, resolved again at export time so new credentials apply to queued leads.
+    """
+
+    def __init__(self, queue: DurableQueue, batch_size: int, poll_interval: float):
+        self.queue = queue
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.exported = 0
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    async def enqueue(self, customer_info: Dict, tenant: Tenant = default_tenant,
+                      business_connection_id: Optional[str] = None) -> bool:
+        """
+        Queues the lead of the customer, errors are logged and never raised to the chat handler.
+        :param customer_info: customer_info of the RAG response (name, phone, service)
+        :param tenant: Tenant whose business account captured the lead
+        :param business_connection_id: Business connection of the chat, resolves the tenant at export time
+        :return: True if the lead was queued, False if it is a duplicate or invalid
+        """
+        if tenant.amocrm is None and not (tenant.is_default and CLIENT_ID):
+            logger.info(f"Tenant {tenant.id} has no amoCRM account, the lead is not exported")
+            return False
+        phone = normalize_phone(customer_info.get("phone"))
+        if not phone:
+            logger.warning(f"Customer info without a phone number is not exported: {customer_info}")
+            return False
+        lead = {
+            "name": customer_info.get("name"),
+            "phone": customer_info.get("phone"),
+            "service": customer_info.get("service"),
+            "tenant": tenant.id,
+            "business_connection_id": business_connection_id,
+        }
+        # ======== The same customer may contact two tenants, the default tenant keeps the former keys ========
+        key = phone if tenant.is_default else f"{tenant.id}:{phone}"
+        try:
+            queued = await self.queue.put(lead, key=key)
+        except Exception as e:
+            logger.error(f"Queueing the lead {lead} failed: {e}", exc_info=True)
+            return False
+        if queued and self._wakeup is not None:
+            self._wakeup.set()
+        return queued
+
+    def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="LeadExportQueue")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        try:
+            await self.queue.ensure_indexes()
+        except Exception as e:
+            logger.error(f"Preparing the lead queue failed: {e}")
+
+        while True:
+            try:
+                await self.queue.requeue_stale_if_due()
+                QUEUE_DEPTH.labels("amocrm_leads").set(await self.queue.depth())
+                batch = await self.queue.claim(self.batch_size)
+            except Exception as e:
+                logger.error(f"Claiming leads failed: {e}")
+                batch = []
+
+            if not batch:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # ======== One amoCRM request per business connection of the batch ========
+            connection = lambda lead: lead.get("business_connection_id") or ""
+            for business_connection_id, leads in itertools.groupby(sorted(batch, key=connection), key=connection):
+                await self._export(business_connection_id, list(leads))
+
+    async def _export(self, business_connection_id: str, leads) -> None:
+        try:
+            tenant = await get_tenant(business_connection_id)
+            if tenant is None:
+                raise LookupError(f"Business connection {business_connection_id} is not served")
+            lead_ids = await asyncio.to_thread(create_leads, leads, tenant.amocrm)
+            await self.queue.complete(leads)
+            self.exported += len(leads)
+            logger.info(f"Exported {len(leads)} leads of {tenant.id} to amoCRM: {lead_ids}")
+        except exceptions.ValidationError as e:
+            if len(leads) > 1:
+                # ======== amoCRM rejects the whole request for one invalid lead, bisect to find it ========
+                middle = len(leads) // 2
+                await self._export(business_connection_id, leads[:middle])
+                await self._export(business_connection_id, leads[middle:])
+                return
+            # ======== The same lead would be rejected again ========
+            logger.error(f"amoCRM rejected the lead {leads[0].get('_id')}: {e}")
+            await self.queue.fail(leads, str(e))
+        except Exception as e:
+            logger.error(f"Exporting {len(leads)} leads to amoCRM failed: {e}")
+            await self.queue.retry(leads, str(e))
+
+
+# ======== Lead export queue, disabled without amoCRM credentials ========
+lead_export_queue = LeadExportQueue(
+    queue=DurableQueue(
+        get_collection(settings.LEAD_QUEUE_COLLECTION),
+        max_attempts=settings.LEAD_MAX_ATTEMPTS,
+        backoff=settings.LEAD_RETRY_BACKOFF,
+        max_backoff=settings.LEAD_RETRY_MAX_BACKOFF,
+        retention=settings.LEAD_DEDUP_WINDOW_DAYS * 86400
+    ),
+    batch_size=settings.LEAD_BATCH_SIZE,
+    poll_interval=settings.LEAD_POLL_INTERVAL
+) if settings.LEAD_EXPORT_ENABLED else None
@@ -4,6 +4,8 @@ from typing import Dict
 import logging
 import asyncio
 
+from src.apps.amocrm.amocrm_integration import init_token_manager
+
 # ===== Logging configuration =====
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -23,16 +25,8 @@ def send_data_to_amocrm(customer_info) -> Dict[str, str]:
     """
 
     try:
-        tokens.default_token_manager(
-            client_id=CLIENT_ID,
-            client_secret=CLIENT_SECRET,
-            subdomain=SUBDOMAIN,
-            redirect_url=REDIRECT_URI,
-            storage=tokens.FileTokensStorage()
-            )
-        # Uncomment the next line if you need to initialize with AUTH_CODE
-        tokens.default_token_manager.init(code=AUTH_CODE, skip_error=True)
-        logger.info("Token initialization successful.")
+        # ======== Configures the token manager on the first lead only ========
+        init_token_manager()
     except Exception as e:
         logger.error(f"Error during token initialization: {str(e)}")
         return {"Error":"Token initialization failed."}
@@ -60,7 +54,7 @@ async def handle_customer_info(rag_response):
     customer_info = rag_response.get("additional_data", {}).get("customer_info", {})
     logger.info(f"Received Customer info: {customer_info}")
     if customer_info and customer_info.get('name') and customer_info.get('phone'):
-        amocrm_response = send_data_to_amocrm(customer_info)
+        amocrm_response = await asyncio.to_thread(send_data_to_amocrm, customer_info)
         logger.info(f"Amocrm response: {amocrm_response}")
     else:
         logger.warning("Customer info is missing name or phone.")
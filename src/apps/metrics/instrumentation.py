@@ -0,0 +1,76 @@
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, ContextManager, Dict, Optional
+from prometheus_client import Gauge, Histogram, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+
+
+# ======== Latency of the hot path stages of a message, per company ========
+STAGE_LATENCY = Histogram(
+    "bot_stage_duration_seconds",
+    "Duration of the stages of answering a client message",
+    ["stage", "company"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40)
+)
+
+# ======== Saturation of the RAG client and the in-process queues ========
+RAG_IN_FLIGHT = Gauge("bot_rag_requests_in_flight", "RAG model requests waiting for an answer")
+QUEUE_DEPTH = Gauge("bot_queue_depth", "Items waiting in the queues of the bot", ["queue"])
+QUEUE_OLDEST_AGE = Gauge("bot_queue_oldest_age_seconds", "Age of the oldest item waiting in a queue of the bot", ["queue"])
+SEND_QUEUE_WAIT = Histogram(
+    "bot_send_queue_wait_seconds",
+    "Time an outbound Telegram request waited in the send scheduler",
+    ["priority"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60)
+)
+
+# ======== Health of the RAG replicas ========
+RAG_ENDPOINT_IN_FLIGHT = Gauge("bot_rag_endpoint_requests_in_flight", "Requests in flight per RAG replica", ["endpoint"])
+RAG_ENDPOINT_CIRCUIT_OPEN = Gauge("bot_rag_endpoint_circuit_open", "1 while the circuit breaker of the RAG replica is not closed", ["endpoint"])
+
+# ======== Optional tracing hook, e.g. lambda stage, attributes: tracer.start_as_current_span(stage, attributes=attributes) ========
+_tracing_hook: Optional[Callable[[str, Dict[str, str]], ContextManager]] = None
+
+
+def set_tracing_hook(hook: Optional[Callable[[str, Dict[str, str]], ContextManager]]) -> None:
+    """
+    Wraps every measured stage into the context manager returned by `hook(stage, attributes)`,
+    so the stages also show up as spans in a tracing system. None removes the hook.
+    """
+    global _tracing_hook
+    _tracing_hook = hook
+
+
+@contextmanager
+def stage_timer(stage: str, company: str):
+    """
+    Measures the duration of a stage of the hot path into STAGE_LATENCY and the tracing hook.
+    :param stage: Name of the stage, e.g. "rag"
+    :param company: Company the message belongs to
+    """
+    span = _tracing_hook(stage, {"company": company}) if _tracing_hook is not None else nullcontext()
+    start = time.perf_counter()
+    with span:
+        try:
+            yield
+        finally:
+            STAGE_LATENCY.labels(stage, company).observe(time.perf_counter() - start)
+
+
+class StatsCollector:
+    """
+    Exposes the stats() dict of a component (caches, coalescer, ...) as gauges named <prefix>_<key>.
+    """
+
+    def __init__(self, prefix: str, stats: Callable[[], Dict[str, float]], description: str):
+        self.prefix = prefix
+        self.stats = stats
+        self.description = description
+
+    def collect(self):
+        for key, value in self.stats().items():
+            yield GaugeMetricFamily(f"{self.prefix}_{key}", f"{self.description}: {key}", value=value)
+
+
+def register_stats(prefix: str, stats: Callable[[], Dict[str, float]], description: str) -> None:
+    REGISTRY.register(StatsCollector(prefix, stats, description))
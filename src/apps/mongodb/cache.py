@@ -0,0 +1,134 @@
+from typing import Dict, List, NamedTuple, Optional
+from cachetools import TTLCache
+
+
+class Conversation(NamedTuple):
+    """
+    Recent window of a conversation and its rolling summary.
+    `unsummarized` is the number of the latest messages not folded into the summary, None before the first fold.
+    """
+    history: List[Dict[str, str]]
+    summary: str = ""
+    unsummarized: Optional[int] = None
+
+    @property
+    def unsummarized_history(self) -> List[Dict[str, str]]:
+        # ======== Messages of the window that are not covered by the summary ========
+        if self.unsummarized is None:
+            return self.history
+        return self.history[max(len(self.history) - self.unsummarized, 0):]
+
+
+def _conversation_size(conversation: Conversation) -> int:
+    # ======== Approximate memory of a cached conversation by the length of its content ========
+    return sum(len(message.get("content") or "") for message in conversation.history) + len(conversation.summary) + 1
+
+
+class ConversationCache(TTLCache):
+    """
+    In-process cache of the most recent messages of the active chats, keyed by client_username.
+
+    Least recently used chats are evicted once the cached content exceeds `maxsize` characters,
+    and chats idle for longer than `ttl` seconds expire. It is written through by
+    ConversationRepository: MongoDB is updated first, then the cached window.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, window: int):
+        super().__init__(maxsize=maxsize, ttl=ttl, getsizeof=_conversation_size)
+        self.window = window
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # ======== Reads from MongoDB in progress, invalidated by writes that land meanwhile ========
+        self._loads = {}
+
+    def popitem(self):
+        # ======== Called by cachetools when the memory bound is exceeded ========
+        item = super().popitem()
+        self.evictions += 1
+        return item
+
+    def expire(self, time=None):
+        size = len(self)
+        super().expire(time)
+        self.expirations += size - len(self)
+
+    def get_conversation(self, username) -> Optional[Conversation]:
+        """
+        :return: Cached window of the chat, None on a cache miss
+        """
+        conversation = self.get(username)
+        if conversation is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return conversation._replace(history=list(conversation.history))
+
+    def begin_load(self, username) -> object:
+        """
+        Marks the start of a MongoDB read for the chat.
+        :return: Token to pass to finish_load
+        """
+        token = object()
+        self._loads[username] = token
+        return token
+
+    def finish_load(self, username, token, conversation: Conversation) -> None:
+        """
+        Caches the conversation read from MongoDB, unless a write for the chat happened while it was read.
+        """
+        if self._loads.get(username) is not token:
+            return
+        del self._loads[username]
+        self._set(username, conversation)
+
+    def append(self, username, messages: List[Dict[str, str]]) -> None:
+        """
+        Appends already persisted messages to the cached window of the chat.
+        """
+        self._loads.pop(username, None)
+        conversation = self.get(username)
+        if conversation is not None:
+            self._set(username, conversation._replace(
+                history=conversation.history + messages,
+                unsummarized=None if conversation.unsummarized is None else conversation.unsummarized + len(messages)
+            ))
+
+    def apply_summary(self, username, summary: str, unsummarized: int) -> None:
+        """
+        Puts a new summary of the chat in the cached window after a fold, the chat stays cached.
+        :param unsummarized: Number of the latest messages not covered by the new summary
+        """
+        self._loads.pop(username, None)
+        conversation = self.get(username)
+        if conversation is not None:
+            history = conversation.history
+            self._set(username, conversation._replace(
+                history=history[max(len(history) - unsummarized, 0):], summary=summary, unsummarized=unsummarized
+            ))
+
+    def invalidate(self, username) -> None:
+        """
+        Drops the chat (and any read in progress), the next read goes to MongoDB.
+        """
+        self._loads.pop(username, None)
+        self.pop(username, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "chats": len(self),
+            "size": self.currsize,
+            "maxsize": self.maxsize,
+        }
+
+    def _set(self, username, conversation: Conversation) -> None:
+        try:
+            self[username] = conversation._replace(history=conversation.history[-self.window:])
+        except ValueError:
+            # ======== A single window larger than the whole cache is not cached ========
+            self.pop(username, None)
@@ -1,4 +1,7 @@
 import os
+import asyncio
+import logging
+import threading
 import certifi
 from pymongo import MongoClient
 import dotenv
@@ -6,43 +9,113 @@ import dotenv
 # Load env variables
 dotenv.load_dotenv()
 
+# ======== Logging configuration ========
+logger = logging.getLogger(__name__)
+
 # MongoDB configuration
 MONGODB_URI = os.getenv("MONGO_CLIENT")
 DATABASE_NAME = os.getenv("DATABASE_NAME")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME")
 INDEX_NAME = os.getenv("INDEX_NAME")
 
+# Connection pool size of the MongoClient and the number of threads running blocking pymongo calls
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 32))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_EXECUTOR_WORKERS = int(os.getenv("MONGO_EXECUTOR_WORKERS", MONGO_MAX_POOL_SIZE))
+
+# Timeouts in milliseconds, an unreachable server fails the operation instead of hanging it
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 30000))
+
+# Seconds between two readiness checks while MongoDB is unreachable
+MONGO_READINESS_RETRY_INTERVAL = float(os.getenv("MONGO_READINESS_RETRY_INTERVAL", 5))
+
 # # Debug prints to check env variables
 # print(f"MONGO_CLIENT: {MONGODB_URI}")
 # print(f"DATABASE_NAME: {DATABASE_NAME}")
 # print(f"COLLECTION_NAME: {COLLECTION_NAME}")
 # print(f"INDEX_NAME: {INDEX_NAME}")
 
-# # Check if DATABASE_NAME is a string
-# if not isinstance(DATABASE_NAME, str):
-#     raise TypeError("DATABASE_NAME must be an instance of str")
+# ======== MongoDB Connection, created on first use instead of at import time ========
+_client = None
+_client_lock = threading.Lock()
+_ready = False
+
+
+def get_client() -> MongoClient:
+    """
+    Returns the process wide MongoClient, creating it on the first call.
+    The client connects in the background on its first operation, nothing blocks here.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(
+                    MONGODB_URI,
+                    tlsCAFile=certifi.where(),
+                    maxPoolSize=MONGO_MAX_POOL_SIZE,
+                    minPoolSize=MONGO_MIN_POOL_SIZE,
+                    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                    connect=False
+                )
+    return _client
+
+
+def get_database():
+    return get_client()[DATABASE_NAME]
+
 
-# MongoDB Connection
-ca_cert_path = certifi.where()
-client = MongoClient(MONGODB_URI, tlsCAFile=ca_cert_path)
-db = client[DATABASE_NAME]
-collection = db[COLLECTION_NAME]
+class LazyCollection:
+    """
+    Collection resolved on its first use, so modules can keep collections at import time without connecting.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._collection = None
+
+    def __getattr__(self, attribute):
+        if self._collection is None:
+            self._collection = get_database()[self.name]
+        return getattr(self._collection, attribute)
 
 
 def get_collection(collection_name):
-    return db[collection_name]
-
-
-# Send a ping to confirm a successful connection
-try:
-    client.admin.command("ping")
-    print("Pinged your deployment. You successfully connected to MongoDB!")
-except Exception as e:
-    print(e)
-
-# Print database names to verify connection
-try:
-    for db_name in client.list_database_names():
-        print(db_name)
-except Exception as e:
-    print(f"An error occurred while listing databases: {e}")
+    return LazyCollection(collection_name)
+
+
+def is_ready() -> bool:
+    """
+    :return: True once a readiness check reached the MongoDB deployment
+    """
+    return _ready
+
+
+async def wait_until_ready() -> None:
+    """
+    Pings the deployment until it answers. Meant to run as a background task next to the bot startup,
+    so an unreachable MongoDB delays the readiness, not the startup.
+    """
+    global _ready
+    while True:
+        try:
+            await asyncio.to_thread(get_client().admin.command, "ping")
+            _ready = True
+            logger.info("Pinged your deployment. You successfully connected to MongoDB!")
+            return
+        except Exception as e:
+            logger.error(f"MongoDB is not reachable yet: {e}")
+            await asyncio.sleep(MONGO_READINESS_RETRY_INTERVAL)
+
+
+def close_client() -> None:
+    global _client, _ready
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+        _ready = False
@@ -0,0 +1,198 @@
+import time
+import uuid
+import random
+import datetime
+from typing import Any, Dict, List, Optional
+from pymongo import ASCENDING, UpdateOne
+
+from src.apps.mongodb.repository import run_blocking
+
+
+def utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class DurableQueue:
+    """
+    Work queue persisted in a MongoDB collection, so queued items survive restarts.
+
+    Every item is a document with a `status` (pending, processing, done or failed), the number of `attempts`
+    and the time of the `next_attempt_at`. Items are claimed in batches, failed items are retried with
+    exponential backoff until `max_attempts`, and items left in processing by a crashed worker go back to
+    pending after `visibility_timeout` seconds (workers call requeue_stale_if_due in their loop). Several
+    workers may share one collection. With `retention`, done and failed items are deleted by MongoDB after
+    `retention` seconds, which also ends the deduplication of their key.
+    """
+
+    PENDING = "pending"
+    PROCESSING = "processing"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, collection, max_attempts: int, backoff: float, max_backoff: float,
+                 visibility_timeout: float = 600, retention: Optional[float] = None):
+        self.collection = collection
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.visibility_timeout = visibility_timeout
+        self.retention = retention
+        self._requeued_at = None
+
+    async def ensure_indexes(self) -> None:
+        await run_blocking(self.collection.create_index, [("status", ASCENDING), ("next_attempt_at", ASCENDING)])
+        await run_blocking(self.collection.create_index, "claim", sparse=True)
+        if self.retention:
+            # ======== Only done and failed items have finished_at, pending ones never expire ========
+            await run_blocking(self.collection.create_index, "finished_at", expireAfterSeconds=int(self.retention))
+
+    async def put(self, item: Dict[str, Any], key: Optional[Any] = None) -> bool:
+        """
+        Queues an item.
+        :param item: Fields of the item
+        :param key: Deduplication key, an item with a key that was queued before is ignored
+        :return: True if the item was queued, False if it was a duplicate
+        """
+        now = utcnow()
+        document = {**item, "status": self.PENDING, "attempts": 0, "next_attempt_at": now, "created_at": now}
+        if key is None:
+            await run_blocking(self.collection.insert_one, document)
+            return True
+        result = await run_blocking(
+            self.collection.update_one,
+            {"_id": key},
+            {"$setOnInsert": document},
+            upsert=True
+        )
+        return result.upserted_id is not None
+
+    async def claim(self, limit: int) -> List[Dict[str, Any]]:
+        """
+        Marks up to `limit` due items as processing.
+        :return: Claimed item documents, oldest first
+        """
+        now = utcnow()
+        due = {"status": self.PENDING, "next_attempt_at": {"$lte": now}}
+        candidates = await run_blocking(
+            lambda: [document["_id"] for document in
+                     self.collection.find(due, {"_id": 1}).sort("next_attempt_at", ASCENDING).limit(limit)]
+        )
+        if not candidates:
+            return []
+
+        # ======== Another worker may claim some of the candidates first, keep only the ones marked with our claim ========
+        claim = uuid.uuid4().hex
+        await run_blocking(
+            self.collection.update_many,
+            {"_id": {"$in": candidates}, **due},
+            {"$set": {"status": self.PROCESSING, "claim": claim, "claimed_at": now}}
+        )
+        return await run_blocking(
+            lambda: list(self.collection.find({"claim": claim}).sort("next_attempt_at", ASCENDING))
+        )
+
+    async def complete(self, documents: List[Dict[str, Any]]) -> None:
+        now = utcnow()
+        await run_blocking(
+            self.collection.update_many,
+            {"_id": {"$in": [document["_id"] for document in documents]}},
+            {"$set": {"status": self.DONE, "done_at": now, "finished_at": now}, "$unset": {"claim": ""}}
+        )
+
+    async def save(self, document: Dict[str, Any], fields: Dict[str, Any]) -> None:
+        """
+        Stores the progress of a claimed item (e.g. a result that must not be computed again), on the
+        document as well.
+        """
+        await run_blocking(self.collection.update_one, {"_id": document["_id"]}, {"$set": fields})
+        document.update(fields)
+
+    async def fail(self, documents: List[Dict[str, Any]], error: str) -> None:
+        """
+        Marks the items failed without further attempts, e.g. after an error that a retry cannot fix.
+        """
+        await run_blocking(
+            self.collection.update_many,
+            {"_id": {"$in": [document["_id"] for document in documents]}},
+            {"$set": {"status": self.FAILED, "last_error": error, "finished_at": utcnow()}, "$unset": {"claim": ""}}
+        )
+
+    async def retry(self, documents: List[Dict[str, Any]], error: str) -> None:
+        """
+        Schedules the next attempt of the items with exponential backoff and jitter, or marks them failed
+        after `max_attempts`.
+        """
+        now = utcnow()
+        operations = []
+        for document in documents:
+            attempts = document.get("attempts", 0) + 1
+            delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff) * random.uniform(0.8, 1.2)
+            fields = {"status": self.PENDING, "attempts": attempts, "last_error": error,
+                      "next_attempt_at": now + datetime.timedelta(seconds=delay)}
+            if attempts >= self.max_attempts:
+                fields.update(status=self.FAILED, finished_at=now)
+            operations.append(UpdateOne({"_id": document["_id"]}, {"$set": fields, "$unset": {"claim": ""}}))
+        if operations:
+            await run_blocking(self.collection.bulk_write, operations, ordered=False)
+
+    async def release(self, documents: List[Dict[str, Any]], delay: float) -> None:
+        """
+        Puts claimed items back to pending without counting an attempt, e.g. the rest of a batch that was not tried.
+        :param delay: Seconds before the items are due again
+        """
+        if not documents:
+            return
+        await run_blocking(
+            self.collection.update_many,
+            {"_id": {"$in": [document["_id"] for document in documents]}},
+            {"$set": {"status": self.PENDING, "next_attempt_at": utcnow() + datetime.timedelta(seconds=delay)},
+             "$unset": {"claim": ""}}
+        )
+
+    async def requeue_stale(self) -> int:
+        """
+        Puts the items left in processing by a crashed worker back to pending.
+        :return: Number of requeued items
+        """
+        stale_before = utcnow() - datetime.timedelta(seconds=self.visibility_timeout)
+        result = await run_blocking(
+            self.collection.update_many,
+            {"status": self.PROCESSING, "claimed_at": {"$lt": stale_before}},
+            {"$set": {"status": self.PENDING}, "$unset": {"claim": ""}}
+        )
+        return result.modified_count
+
+    async def requeue_stale_if_due(self) -> int:
+        """
+        Calls requeue_stale at most every half `visibility_timeout`, so the items of a worker process that
+        crashed go back to pending while the other processes keep running.
+        :return: Number of requeued items
+        """
+        now = time.monotonic()
+        if self._requeued_at is not None and now - self._requeued_at < self.visibility_timeout / 2:
+            return 0
+        self._requeued_at = now
+        return await self.requeue_stale()
+
+    async def depth(self) -> int:
+        """
+        :return: Number of pending items
+        """
+        return await run_blocking(self.collection.count_documents, {"status": self.PENDING})
+
+    async def oldest_age(self) -> float:
+        """
+        :return: Seconds since the oldest pending item was queued, 0 if there is none
+        """
+        document = await run_blocking(
+            self.collection.find_one,
+            {"status": self.PENDING},
+            {"created_at": 1},
+            sort=[("created_at", ASCENDING)]
+        )
+        if document is None:
+            return 0.0
+        created_at = document["created_at"]
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=datetime.timezone.utc)
+        return (utcnow() - created_at).total_seconds()
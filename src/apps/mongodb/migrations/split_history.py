@@ -0,0 +1,124 @@
+"""
+Copies the conversations of telegram_conversations (one document per chat with a `history` array) into the
+message-per-document layout of MessageRepository: one telegram_messages document per message and one
+telegram_chats document per chat with its message_count, summary and summarized_upto.
+
+The conversations are streamed with a cursor and written in bulk, `--batch-size` conversations at a time, so
+the memory does not grow with the collection. Chats that already have a telegram_chats document are skipped,
+a migration that was interrupted can be run again. The old documents carry no time per message, the `ts` of a
+migrated message is estimated between the creation of its conversation document and the time of the migration
+(with HISTORY_MESSAGE_TTL_DAYS, the TTL index deletes the migrated messages estimated older than that).
+
+Run it while the bot is stopped, then start the bot with HISTORY_STORAGE=messages.
+
+Usage:
+    python -m src.apps.mongodb.migrations.split_history [--batch-size N] [--dry-run]
+"""
+import asyncio
+import datetime
+import argparse
+import itertools
+from typing import Any, Dict, List, Tuple
+
+from pymongo import UpdateOne
+
+from src.config import settings
+from src.apps.mongodb.connection import get_collection
+from src.apps.mongodb.repository import MessageRepository
+
+# ======== Message documents sent to the server per insert_many ========
+INSERT_CHUNK = 1000
+
+
+def split_conversation(conversation: Dict[str, Any], now: datetime.datetime) -> Tuple[List[dict], dict]:
+    """
+    :param conversation: Document of telegram_conversations
+    :param now: Time of the migration, the `ts` of the newest message
+    :return: Message documents and the chat document of the conversation
+    """
+    history = conversation.get("history", [])
+    # ======== The array may have been trimmed, its messages are the last ones of message_count ========
+    stored_count = conversation.get("message_count", len(history))
+    message_count = max(stored_count, len(history))
+    first = message_count - len(history) + 1
+
+    created_at = conversation["_id"].generation_time if hasattr(conversation.get("_id"), "generation_time") else now
+    step = (now - created_at) / max(len(history), 1)
+    messages = [
+        {**message, "chat": conversation["username"], "seq": first + offset, "ts": created_at + step * (offset + 1)}
+        for offset, message in enumerate(history)
+    ]
+
+    chat = {"chat": conversation["username"], "message_count": message_count}
+    if "summary" in conversation:
+        chat["summary"] = conversation["summary"]
+    if "summarized_upto" in conversation:
+        # ======== Raised message_count: the folded messages moved to higher seqs by the same difference ========
+        chat["summarized_upto"] = min(conversation["summarized_upto"] + message_count - stored_count, message_count)
+    return messages, chat
+
+
+def split_history(conversations, messages, chats, batch_size: int, dry_run: bool = False) -> Tuple[int, int]:
+    """
+    :param conversations: telegram_conversations collection
+    :param messages: Collection of the message documents
+    :param chats: Collection of the chat documents
+    :param batch_size: Conversations written at a time
+    :param dry_run: Only count what would be migrated
+    :return: Number of the migrated conversations and messages
+    """
+    migrated_conversations = migrated_messages = 0
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cursor = iter(conversations.find({"username": {"$exists": True}}, batch_size=batch_size))
+
+    while batch := list(itertools.islice(cursor, batch_size)):
+        conversation_count, message_count = _migrate_batch(batch, messages, chats, now, dry_run)
+        migrated_conversations += conversation_count
+        migrated_messages += message_count
+    return migrated_conversations, migrated_messages
+
+
+def _migrate_batch(batch, messages, chats, now: datetime.datetime, dry_run: bool) -> Tuple[int, int]:
+    usernames = [conversation["username"] for conversation in batch]
+    done = {chat["chat"] for chat in chats.find({"chat": {"$in": usernames}}, {"_id": 0, "chat": 1})}
+    pending = [conversation for conversation in batch if conversation["username"] not in done]
+    if not pending:
+        return 0, 0
+    if dry_run:
+        return len(pending), sum(len(conversation.get("history", [])) for conversation in pending)
+
+    # ======== Leftovers of an interrupted run first, the chat documents last: they mark a chat as migrated ========
+    messages.delete_many({"chat": {"$in": [conversation["username"] for conversation in pending]}})
+    message_count, chat_updates = 0, []
+    for conversation in pending:
+        conversation_messages, chat = split_conversation(conversation, now)
+        for start in range(0, len(conversation_messages), INSERT_CHUNK):
+            messages.insert_many(conversation_messages[start:start + INSERT_CHUNK], ordered=False)
+        message_count += len(conversation_messages)
+        chat_updates.append(UpdateOne({"chat": chat["chat"]}, {"$setOnInsert": chat}, upsert=True))
+    chats.bulk_write(chat_updates, ordered=False)
+    return len(pending), message_count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--collection", default="telegram_conversations")
+    parser.add_argument("--messages-collection", default=settings.HISTORY_MESSAGES_COLLECTION)
+    parser.add_argument("--chats-collection", default=settings.HISTORY_CHATS_COLLECTION)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    messages, chats = get_collection(args.messages_collection), get_collection(args.chats_collection)
+    if not args.dry_run:
+        # ======== Same indexes as the bot creates on startup, the unique ones guard the copy ========
+        asyncio.run(MessageRepository(messages, chats, ttl=settings.HISTORY_MESSAGE_TTL_DAYS * 86400).ensure_indexes())
+
+    conversations, message_count = split_history(get_collection(args.collection), messages, chats,
+                                                 args.batch_size, args.dry_run)
+    action = "Conversations to migrate" if args.dry_run else "Migrated conversations"
+    print(f"{action}: {conversations}, messages: {message_count}")
+
+
+if __name__ == "__main__":
+    main()
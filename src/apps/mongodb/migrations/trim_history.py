@@ -0,0 +1,46 @@
+"""
+Trims the `history` of the existing conversations to the last HISTORY_MAX_MESSAGES messages.
+
+New writes are trimmed by ConversationRepository.append_messages, this migration only has to run once
+for the documents that grew before the cap existed (or after lowering HISTORY_MAX_MESSAGES).
+
+Usage:
+    python -m src.apps.mongodb.migrations.trim_history [--max-messages N] [--dry-run]
+"""
+import argparse
+
+from src.config import settings
+from src.apps.mongodb.connection import get_collection
+
+
+def trim_history(collection, max_messages: int, dry_run: bool = False) -> int:
+    """
+    :param collection: Conversations collection
+    :param max_messages: Number of the most recent messages to keep
+    :param dry_run: Only count the oversized documents
+    :return: Number of the oversized (or trimmed) documents
+    """
+    # ======== Only documents having more than max_messages entries ========
+    query = {f"history.{max_messages}": {"$exists": True}}
+    if dry_run:
+        return collection.count_documents(query)
+
+    # ======== Trim on the server side with an update pipeline, no document is read into Python ========
+    result = collection.update_many(query, [{"$set": {"history": {"$slice": ["$history", -max_messages]}}}])
+    return result.modified_count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--collection", default="telegram_conversations")
+    parser.add_argument("--max-messages", type=int, default=settings.HISTORY_MAX_MESSAGES)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    count = trim_history(get_collection(args.collection), args.max_messages, args.dry_run)
+    action = "Oversized" if args.dry_run else "Trimmed"
+    print(f"{action} conversations: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+import asyncio
+import logging
+import datetime
+import functools
+from typing import Any, Dict, List, Optional
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from concurrent.futures import ThreadPoolExecutor
+
+from src.config import settings
+from src.apps.mongodb.cache import Conversation, ConversationCache
+from src.apps.mongodb.connection import get_collection, MONGO_EXECUTOR_WORKERS
+from src.apps.rag.history_window import fold_into_summary
+
+
+# ======== Logging configuration ========
+logger = logging.getLogger(__name__)
+
+
+# ======== Bounded thread pool for the blocking pymongo calls ========
+_executor = ThreadPoolExecutor(max_workers=MONGO_EXECUTOR_WORKERS, thread_name_prefix="mongodb")
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Runs a blocking pymongo call in the MongoDB thread pool, so the event loop keeps serving other chats.
+    :param func: Blocking callable, e.g. collection.find_one
+    :return: Result of the callable
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def shutdown_executor() -> None:
+    """
+    Waits for the pending MongoDB calls and stops the thread pool.
+    """
+    _executor.shutdown(wait=True)
+
+
+class ConversationRepository:
+    """
+    Async access to the conversation history of the Telegram chats.
+    Every document is keyed by the username of the client chat and holds the `history` list of
+    {"role": ..., "content": ...} messages, capped at `max_messages` entries.
+    With a `cache`, recent windows of the active chats are served from memory and written through.
+
+    With `summary_batch`, messages older than the last `keep` are folded into the rolling `summary`
+    of the document in the background, `summary_batch` messages at a time. `message_count` counts the
+    appended messages and `summarized_upto` is the message_count covered by the summary.
+    """
+
+    def __init__(self, collection, max_messages: int = settings.HISTORY_MAX_MESSAGES,
+                 cache: Optional[ConversationCache] = None, keep: int = settings.HISTORY_WINDOW,
+                 summary_batch: int = settings.HISTORY_SUMMARY_BATCH):
+        self.collection = collection
+        self.max_messages = max_messages
+        self.cache = cache
+        self.keep = keep
+        self.summary_batch = summary_batch
+        self._summarizing = {}
+        # ======== Messages appended while the fold of the chat runs, they are not covered by its summary ========
+        self._appended_during_fold = {}
+
+    async def ensure_indexes(self) -> None:
+        await run_blocking(self.collection.create_index, "username")
+
+    async def get_recent_conversation(self, username, limit: int) -> Conversation:
+        """
+        Reads only the last `limit` messages and the summary of the chat, the rest of the history never leaves the server.
+        :param username: Username of the client chat
+        :param limit: Number of the most recent messages to return
+        :return: Recent window of the chat, with an empty history for a new chat
+        """
+        use_cache = self.cache is not None and limit <= self.cache.window
+        if use_cache:
+            conversation = self.cache.get_conversation(username)
+            if conversation is not None:
+                return conversation._replace(history=conversation.history[-limit:])
+            token = self.cache.begin_load(username)
+
+        conversation = await self._read_window(username, self.cache.window if use_cache else limit)
+
+        if use_cache:
+            self.cache.finish_load(username, token, conversation)
+        return conversation._replace(history=conversation.history[-limit:])
+
+    async def get_recent_history(self, username, limit: int) -> List[Dict[str, str]]:
+        """
+        :return: Last `limit` messages of the chat, empty list for a new chat
+        """
+        return (await self.get_recent_conversation(username, limit)).history
+
+    async def append_messages(self, username, messages: List[Dict[str, str]]) -> None:
+        """
+        Appends the messages to the conversation history in a single atomic update and trims the
+        history to the last `max_messages` entries. Updates or inserts (upsert) the conversation.
+        :param username: Username of the client chat
+        :param messages: Messages to append, in order
+        """
+        counters = await self._store(username, messages)
+        if self.cache is not None:
+            self.cache.append(username, messages)
+        if username in self._summarizing:
+            self._appended_during_fold[username] = self._appended_during_fold.get(username, 0) + len(messages)
+
+        if self.summary_batch > 0 and username not in self._summarizing:
+            unsummarized = counters["message_count"] - counters.get("summarized_upto", 0)
+            if unsummarized >= self.keep + self.summary_batch:
+                # ======== Folded in the background, the reply does not wait for the summary ========
+                task = asyncio.create_task(self.summarize(username, counters))
+                self._summarizing[username] = task
+                task.add_done_callback(lambda _: (self._summarizing.pop(username, None),
+                                                  self._appended_during_fold.pop(username, None)))
+
+    async def summarize(self, username, counters: Dict[str, int]) -> None:
+        """
+        Folds the messages older than the last `keep` into the rolling summary of the chat.
+        Only the messages appended since the previous fold are read, the first fold reads the whole history.
+        :param username: Username of the client chat
+        :param counters: message_count and summarized_upto of the conversation, as returned by append_messages
+        """
+        try:
+            summarized_upto = counters.get("summarized_upto")
+            unsummarized = counters["message_count"] - (summarized_upto or 0)
+            document = await self._read_for_summary(
+                username,
+                min(unsummarized, self.max_messages) if summarized_upto is not None else self.max_messages
+            )
+            # ======== Another fold or a newer append got there first, the next append triggers the fold again ========
+            if document is None or document.get("summarized_upto") != summarized_upto \
+                    or document["message_count"] != counters["message_count"]:
+                return
+
+            history = document.get("history", [])
+            folded = history[:max(len(history) - self.keep, 0)]
+            if not folded:
+                return
+            summary = fold_into_summary(document.get("summary", ""), folded)
+
+            saved = await self._save_summary(username, summarized_upto, summary, counters["message_count"] - self.keep)
+            if saved and self.cache is not None:
+                # ======== The active chat stays cached, its window now starts after the summary ========
+                self.cache.apply_summary(
+                    username, summary, self.keep + self._appended_during_fold.get(username, 0)
+                )
+        except Exception as e:
+            logger.warning(f"Summarizing the conversation of {username} failed: {e}")
+
+    async def _read_window(self, username, limit: int) -> Conversation:
+        document = await run_blocking(
+            self.collection.find_one,
+            {"username": username},
+            {"_id": 0, "history": {"$slice": -limit}, "summary": 1, "message_count": 1, "summarized_upto": 1}
+        ) or {}
+        return Conversation(
+            history=document.get("history", []),
+            summary=document.get("summary", ""),
+            unsummarized=document["message_count"] - document["summarized_upto"]
+            if "summarized_upto" in document else None
+        )
+
+    async def _store(self, username, messages: List[Dict[str, str]]) -> Optional[Dict[str, int]]:
+        """
+        :return: message_count and summarized_upto after the append, None when the summary is disabled
+        """
+        update = {"$push": {"history": {"$each": messages, "$slice": -self.max_messages}},
+                  "$inc": {"message_count": len(messages)}}
+        if self.summary_batch <= 0:
+            await run_blocking(self.collection.update_one, {"username": username}, update, upsert=True)
+            return None
+        return await run_blocking(
+            self.collection.find_one_and_update,
+            {"username": username},
+            update,
+            projection={"_id": 0, "message_count": 1, "summarized_upto": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _read_for_summary(self, username, limit: int) -> Optional[Dict[str, Any]]:
+        """
+        :return: summary, message_count, summarized_upto and the last `limit` messages as history, None for a new chat
+        """
+        return await run_blocking(
+            self.collection.find_one,
+            {"username": username},
+            {"_id": 0, "summary": 1, "message_count": 1, "summarized_upto": 1, "history": {"$slice": -limit}}
+        )
+
+    async def _save_summary(self, username, summarized_upto: Optional[int], summary: str, upto: int) -> bool:
+        # ======== Guarded by summarized_upto, a concurrent fold of the same messages loses ========
+        result = await run_blocking(
+            self.collection.update_one,
+            {"username": username, "summarized_upto": summarized_upto if summarized_upto is not None
+             else {"$exists": False}},
+            {"$set": {"summary": summary, "summarized_upto": upto}}
+        )
+        return bool(result.modified_count)
+
+
+class MessageRepository(ConversationRepository):
+    """
+    Conversation history stored as one document per message instead of a growing array per chat.
+
+    `messages` holds {"chat", "seq", "ts", "role", "content"} documents: `chat` is the username of the client
+    chat, `seq` the position of the message in the chat (1, 2, ...) and `ts` the time it was stored. `chats`
+    holds a small document per chat with the message_count, the rolling summary and summarized_upto, which
+    play the same role as in the conversation documents. The last N messages are read from the end of the
+    (chat, seq) index, an append inserts the new messages and never rewrites the older ones, so a chat has
+    no size limit. With `ttl`, MongoDB deletes the messages older than `ttl` seconds.
+    """
+
+    def __init__(self, messages, chats, cache: Optional[ConversationCache] = None, ttl: int = 0,
+                 keep: int = settings.HISTORY_WINDOW, summary_batch: int = settings.HISTORY_SUMMARY_BATCH,
+                 max_messages: int = settings.HISTORY_MAX_MESSAGES):
+        # ======== max_messages only bounds the first fold of a chat into the summary ========
+        super().__init__(messages, max_messages, cache, keep, summary_batch)
+        self.chats = chats
+        self.ttl = ttl
+
+    async def ensure_indexes(self) -> None:
+        await run_blocking(self.collection.create_index, [("chat", ASCENDING), ("seq", ASCENDING)], unique=True)
+        await run_blocking(self.collection.create_index, [("chat", ASCENDING), ("ts", ASCENDING), ("seq", ASCENDING)])
+        if self.ttl > 0:
+            await run_blocking(self.collection.create_index, "ts", expireAfterSeconds=self.ttl)
+        await run_blocking(self.chats.create_index, "chat", unique=True)
+
+    async def get_messages_between(self, username, start: datetime.datetime, end: datetime.datetime,
+                                   limit: int = 0) -> List[Dict[str, Any]]:
+        """
+        :param username: Username of the client chat
+        :param start: Oldest time included
+        :param end: Newest time, excluded
+        :param limit: Maximum number of messages, 0 for all of them
+        :return: Messages of the chat stored between start and end, oldest first, with their `ts`
+        """
+        cursor = self.collection.find(
+            {"chat": username, "ts": {"$gte": start, "$lt": end}},
+            {"_id": 0, "chat": 0, "seq": 0}
+        ).sort([("ts", ASCENDING), ("seq", ASCENDING)]).limit(limit)
+        return await run_blocking(list, cursor)
+
+    def _find_last(self, username, limit: int, upto: Optional[int] = None,
+                   with_seq: bool = False) -> List[Dict[str, Any]]:
+        # ======== Walks the (chat, seq) index backwards, only `limit` messages are read ========
+        if limit <= 0:
+            return []
+        query = {"chat": username} if upto is None else {"chat": username, "seq": {"$lte": upto}}
+        projection = {"_id": 0, "role": 1, "content": 1, "seq": 1} if with_seq else {"_id": 0, "role": 1, "content": 1}
+        cursor = self.collection.find(query, projection).sort("seq", DESCENDING).limit(limit)
+        return list(cursor)[::-1]
+
+    async def _read_state(self, username) -> Optional[Dict[str, Any]]:
+        return await run_blocking(
+            self.chats.find_one,
+            {"chat": username},
+            {"_id": 0, "summary": 1, "message_count": 1, "summarized_upto": 1}
+        )
+
+    async def _read_window(self, username, limit: int) -> Conversation:
+        state, history = await asyncio.gather(self._read_state(username),
+                                              run_blocking(self._find_last, username, limit))
+        state = state or {}
+        return Conversation(
+            history=history,
+            summary=state.get("summary", ""),
+            unsummarized=state["message_count"] - state["summarized_upto"] if "summarized_upto" in state else None
+        )
+
+    async def _store(self, username, messages: List[Dict[str, str]]) -> Optional[Dict[str, int]]:
+        # ======== Reserves the seq numbers of the messages, then inserts them ========
+        counters = await run_blocking(
+            self.chats.find_one_and_update,
+            {"chat": username},
+            {"$inc": {"message_count": len(messages)}},
+            projection={"_id": 0, "message_count": 1, "summarized_upto": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        first = counters["message_count"] - len(messages) + 1
+        now = datetime.datetime.now(datetime.timezone.utc)
+        await run_blocking(
+            self.collection.insert_many,
+            [{**message, "chat": username, "seq": first + offset, "ts": now} for offset, message in enumerate(messages)]
+        )
+        return counters if self.summary_batch > 0 else None
+
+    async def _read_for_summary(self, username, limit: int) -> Optional[Dict[str, Any]]:
+        state = await self._read_state(username)
+        if state is None:
+            return None
+        # ======== Messages appended after the state was read are left out, they are not counted in it ========
+        history = await run_blocking(self._find_last, username, limit, state["message_count"], True)
+        # ======== An append reserves its seqs before inserting its messages: while one is missing, no fold ========
+        seqs = [message.pop("seq") for message in history]
+        if seqs and (seqs[-1] != state["message_count"] or seqs[-1] - seqs[0] != len(seqs) - 1):
+            return None
+        return {**state, "history": history}
+
+    async def _save_summary(self, username, summarized_upto: Optional[int], summary: str, upto: int) -> bool:
+        result = await run_blocking(
+            self.chats.update_one,
+            {"chat": username, "summarized_upto": summarized_upto if summarized_upto is not None
+             else {"$exists": False}},
+            {"$set": {"summary": summary, "summarized_upto": upto}}
+        )
+        return bool(result.modified_count)
+
+
+# ======== Cache of the active chats, shared by the bot handlers ========
+conversation_cache = ConversationCache(
+    maxsize=settings.CONVERSATION_CACHE_MAX_CHARS,
+    ttl=settings.CONVERSATION_CACHE_TTL,
+    window=settings.CONVERSATION_CACHE_WINDOW
+) if settings.CONVERSATION_CACHE_ENABLED and settings.CONVERSATION_CACHE_MAX_CHARS > 0 else None
+
+# ======== Repository of the conversation history, in the layout chosen with HISTORY_STORAGE ========
+if settings.HISTORY_STORAGE == 'messages':
+    conversation_repository = MessageRepository(
+        get_collection(settings.HISTORY_MESSAGES_COLLECTION),
+        get_collection(settings.HISTORY_CHATS_COLLECTION),
+        cache=conversation_cache,
+        ttl=settings.HISTORY_MESSAGE_TTL_DAYS * 86400
+    )
+else:
+    conversation_repository = ConversationRepository(get_collection("telegram_conversations"), cache=conversation_cache)
@@ -0,0 +1,284 @@
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Set
+
+import httpx
+
+
+# ======== Logging configuration ========
+logger = logging.getLogger(__name__)
+
+# ======== Circuit breaker states ========
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+# ======== Weight of the newest latency in the moving average of a replica ========
+LATENCY_EWMA_ALPHA = 0.2
+
+# ======== Latencies needed before the hedge delay follows the observed percentile ========
+MIN_LATENCY_SAMPLES = 20
+
+# ======== Headers of the pre-serialized JSON bodies ========
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+class RAGUnavailableError(Exception):
+    """
+    Raised when no RAG replica can take the request, e.g. every circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a replica after `failure_threshold` consecutive failures.
+
+    After `reset_timeout` seconds in the open state, a single probe request is let through (half-open):
+    its success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def available(self) -> bool:
+        """
+        :return: True if a request would be let through, without reserving the half-open probe
+        """
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_timeout
+        return not self._probing
+
+    def allow(self) -> bool:
+        """
+        :return: True if the request may be sent, the half-open probe is reserved for the caller
+        """
+        if not self.available():
+            return False
+        if self.state != CLOSED:
+            self.state = HALF_OPEN
+            self._probing = True
+        return True
+
+    def record_success(self) -> None:
+        self.state = CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                logger.warning(f"Circuit breaker opened after {self.failures} consecutive failures")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        # ======== The request ended without telling anything about the replica (e.g. a cancelled hedge) ========
+        self._probing = False
+
+
+class RAGEndpoint:
+    """
+    A RAG replica with its load (requests in flight), moving average latency and circuit breaker.
+    """
+
+    def __init__(self, url: str, breaker: CircuitBreaker):
+        self.url = url
+        self.breaker = breaker
+        self.in_flight = 0
+        self.latency: Optional[float] = None
+        self.requests = 0
+        self.failures = 0
+
+    def observe(self, latency: float) -> None:
+        self.latency = latency if self.latency is None else \
+            LATENCY_EWMA_ALPHA * latency + (1 - LATENCY_EWMA_ALPHA) * self.latency
+
+    def score(self) -> float:
+        # ======== Expected wait: the queue in front of the request times its latency, unknown replicas first ========
+        return (self.in_flight + 1) * (self.latency or 0.0)
+
+
+class RAGBalancer:
+    """
+    Spreads the RAG requests over the replicas.
+
+    Every request goes to the available replica with the lowest (in_flight + 1) * latency score.
+    If it has not answered after the `hedge_percentile` of the recent latencies, a hedged duplicate
+    is sent to the next best replica and the first answer wins. A failed request fails over to another
+    replica right away, and every replica has its own circuit breaker.
+    """
+
+    def __init__(self, urls: List[str], hedge_percentile: float, hedge_min_delay: float,
+                 failure_threshold: int, reset_timeout: float, latency_window: int = 500):
+        self.endpoints = [RAGEndpoint(url, CircuitBreaker(failure_threshold, reset_timeout)) for url in urls]
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self._latencies = deque(maxlen=latency_window)
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.rejected = 0
+
+    @property
+    def hedging(self) -> bool:
+        return self.hedge_percentile > 0 and len(self.endpoints) > 1
+
+    def hedge_delay(self) -> float:
+        """
+        :return: Seconds to wait for the first replica before a hedged duplicate is sent
+        """
+        if len(self._latencies) < MIN_LATENCY_SAMPLES:
+            return self.hedge_min_delay
+        ordered = sorted(self._latencies)
+        index = min(int(len(ordered) * self.hedge_percentile / 100), len(ordered) - 1)
+        return max(ordered[index], self.hedge_min_delay)
+
+    def pick(self, exclude: Set[RAGEndpoint] = frozenset()) -> Optional[RAGEndpoint]:
+        """
+        Chooses the replica for the next request and reserves its half-open probe if needed.
+        :param exclude: Replicas already tried for this request
+        :return: Chosen replica, None if none is available
+        """
+        candidates = [e for e in self.endpoints if e not in exclude and e.breaker.available()]
+        if not candidates:
+            return None
+        endpoint = min(candidates, key=lambda e: (e.score(), random.random()))
+        endpoint.breaker.allow()
+        return endpoint
+
+    @asynccontextmanager
+    async def track(self, endpoint: RAGEndpoint, record_latency: bool = True):
+        """
+        Accounts a request to the replica: load, latency and the outcome for the circuit breaker.
+        Server errors (5xx) and transport errors count as failures, client errors (4xx) do not.
+        """
+        endpoint.in_flight += 1
+        endpoint.requests += 1
+        start = time.perf_counter()
+        try:
+            yield endpoint
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code >= 500:
+                endpoint.failures += 1
+                endpoint.breaker.record_failure()
+            else:
+                endpoint.breaker.record_success()
+            raise
+        except httpx.HTTPError:
+            endpoint.failures += 1
+            endpoint.breaker.record_failure()
+            raise
+        except asyncio.CancelledError:
+            # ======== A hedge lost the race: the time it took is a lower bound of the latency ========
+            endpoint.observe(time.perf_counter() - start)
+            endpoint.breaker.release()
+            raise
+        except BaseException:
+            endpoint.breaker.release()
+            raise
+        else:
+            endpoint.breaker.record_success()
+            if record_latency:
+                latency = time.perf_counter() - start
+                endpoint.observe(latency)
+                self._latencies.append(latency)
+        finally:
+            endpoint.in_flight -= 1
+
+    async def post(self, client: httpx.AsyncClient, body: bytes) -> httpx.Response:
+        """
+        Sends the body to the replicas, with hedging and failover.
+        :param client: Shared HTTP client
+        :param body: JSON body of the request, serialized once and reused by the hedged and failover attempts
+        :return: First successful response
+        :raises RAGUnavailableError: No replica is available
+        :raises httpx.HTTPError: Every tried replica failed, or the request was rejected (4xx)
+        """
+        self.requests += 1
+        tried: Set[RAGEndpoint] = set()
+        attempts: Dict[asyncio.Task, RAGEndpoint] = {}
+
+        async def attempt(endpoint: RAGEndpoint) -> httpx.Response:
+            async with self.track(endpoint):
+                response = await client.post(endpoint.url, content=body, headers=JSON_HEADERS)
+                response.raise_for_status()
+                return response
+
+        def launch() -> bool:
+            endpoint = self.pick(tried)
+            if endpoint is None:
+                return False
+            tried.add(endpoint)
+            attempts[asyncio.create_task(attempt(endpoint))] = endpoint
+            return True
+
+        if not launch():
+            self.rejected += 1
+            raise RAGUnavailableError("No RAG replica is available")
+        primary = next(iter(tried))
+
+        hedged = not self.hedging
+        hedge_sent = False
+        last_error: Optional[Exception] = None
+        try:
+            while attempts:
+                done, _ = await asyncio.wait(
+                    attempts, timeout=None if hedged else self.hedge_delay(), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # ======== The replica is slower than usual, race it against another one ========
+                    hedged = True
+                    if launch():
+                        hedge_sent = True
+                        self.hedges += 1
+                    continue
+
+                for task in done:
+                    endpoint = attempts.pop(task)
+                    try:
+                        response = task.result()
+                    except httpx.HTTPStatusError as e:
+                        if e.response.status_code < 500:
+                            raise
+                        last_error = e
+                        continue
+                    except httpx.HTTPError as e:
+                        last_error = e
+                        continue
+                    if hedge_sent and endpoint is not primary:
+                        self.hedge_wins += 1
+                    return response
+
+                # ======== Every finished attempt failed, fail over to another replica ========
+                logger.warning(f"RAG replica failed, failing over: {last_error}")
+                if launch():
+                    self.failovers += 1
+            raise last_error
+        finally:
+            for task in attempts:
+                task.cancel()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "rejected": self.rejected,
+            "hedge_delay_seconds": self.hedge_delay(),
+            "open_circuits": sum(e.breaker.state != CLOSED for e in self.endpoints),
+        }
@@ -0,0 +1,77 @@
+import re
+from typing import Dict, List
+
+from src.config import settings
+
+
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _truncate(text: str, max_chars: int) -> str:
+    return text if len(text) <= max_chars else text[:max_chars - 1].rstrip() + "…"
+
+
+def summarize_message(message: Dict[str, str], max_chars: int = settings.HISTORY_SUMMARY_LINE_CHARS) -> str:
+    """
+    Compresses a message into a single summary line: "role: content", whitespace collapsed and cut to max_chars.
+    """
+    content = _WHITESPACE.sub(" ", message.get("content") or "").strip()
+    return _truncate(f"{message.get('role', 'user')}: {content}", max_chars)
+
+
+def fold_into_summary(summary: str, messages: List[Dict[str, str]],
+                      line_chars: int = settings.HISTORY_SUMMARY_LINE_CHARS,
+                      max_chars: int = settings.HISTORY_SUMMARY_MAX_CHARS) -> str:
+    """
+    Appends a summary line for every message to the rolling summary, then drops the oldest lines
+    until the summary fits into max_chars.
+    :param summary: Current summary, one line per message, oldest first
+    :param messages: Messages that leave the history window, in order
+    :return: Updated summary
+    """
+    lines = (summary.splitlines() if summary else []) + [summarize_message(m, line_chars) for m in messages]
+    size = sum(len(line) + 1 for line in lines)
+    while lines and size > max_chars:
+        size -= len(lines.pop(0)) + 1
+    return "\n".join(lines)
+
+
+def build_history_window(history: List[Dict[str, str]], summary: str = "",
+                         char_budget: int = settings.HISTORY_CHAR_BUDGET,
+                         message_max_chars: int = settings.HISTORY_MESSAGE_MAX_CHARS,
+                         summary_max_chars: int = settings.HISTORY_SUMMARY_MAX_CHARS) -> List[Dict[str, str]]:
+    """
+    Builds the conversation_history of a RAG request within a character budget.
+
+    The most recent messages are kept verbatim (cut to message_max_chars) as long as they fit into the budget,
+    the newest one always. The messages that do not fit are folded into the rolling summary, which is sent
+    as a leading "system" message instead of them.
+    :param history: Messages not covered by the summary yet, oldest first
+    :param summary: Rolling summary of the older messages of the conversation
+    :return: List of {"role": ..., "content": ...} messages
+    """
+    def fit(budget: int):
+        window, used = [], 0
+        for message in reversed(history):
+            content = _truncate(message.get("content") or "", message_max_chars)
+            if window and used + len(content) > budget:
+                break
+            window.append({"role": message["role"], "content": content})
+            used += len(content)
+        window.reverse()
+        return window
+
+    # ======== Reserve room for the summary only when there is (or will be) one ========
+    window = fit(char_budget - (len(SUMMARY_HEADER) + len(summary) + 1 if summary else 0))
+    dropped = history[:len(history) - len(window)]
+    if dropped:
+        summary_chars = min(summary_max_chars, char_budget // 2)
+        window = fit(char_budget - len(SUMMARY_HEADER) - summary_chars - 1)
+        dropped = history[:len(history) - len(window)]
+        summary = fold_into_summary(summary, dropped, max_chars=summary_chars)
+
+    if summary:
+        window.insert(0, {"role": "system", "content": f"{SUMMARY_HEADER}\n{summary}"})
+    return window
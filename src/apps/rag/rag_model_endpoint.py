@@ -1,11 +1,16 @@
 # ===== Imports =====
 import json
-import requests
+import httpx
+import asyncio
 import logging
 from pydantic import BaseModel
-from typing import List, Optional
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+from typing_extensions import TypedDict
 from fastapi import HTTPException
 from src.config import settings
+from src.apps.metrics.instrumentation import RAG_IN_FLIGHT
+from src.apps.rag.balancer import RAGBalancer, RAGUnavailableError, JSON_HEADERS
 
 # ===== Logging configuration =====
 logging.basicConfig(level=logging.INFO)
@@ -13,18 +18,53 @@ logger = logging.getLogger(__name__)
 
 # ===== RAG Model URL =====
 RAG_MODEL_URL = settings.RAG_MODEL_URL
+RAG_STREAM_URL = settings.RAG_STREAM_URL
+
+# ===== Replicas of the RAG model, with load balancing, hedging and circuit breaking =====
+rag_balancer = RAGBalancer(
+    urls=[url for url in (settings.RAG_MODEL_URLS or [RAG_MODEL_URL]) if url],
+    hedge_percentile=settings.RAG_HEDGE_PERCENTILE,
+    hedge_min_delay=settings.RAG_HEDGE_MIN_DELAY,
+    failure_threshold=settings.RAG_BREAKER_FAILURES,
+    reset_timeout=settings.RAG_BREAKER_RESET_TIMEOUT
+)
+
+# ===== Balancers of the tenants with their own RAG replicas, by tuple of replica URLs =====
+_tenant_balancers: Dict[Tuple[str, ...], RAGBalancer] = {}
+
+# ===== Shared HTTP client and concurrency limiter (created lazily, inside the running event loop) =====
+_client: Optional[httpx.AsyncClient] = None
+_semaphore: Optional[asyncio.Semaphore] = None
 
 
 # ===== Pydantic models =====
-class Message(BaseModel):
+class Message(TypedDict):
+    # ======== A history message in the wire format of the RAG model, kept as a plain dict ========
     role: str
     content: str
 
 
 class QueryRequest(BaseModel):
     query: str
-    conversation_history: Optional[List[Message]] = ""
-    company_name: str = 'SpineUP'
+    conversation_history: List[Message] = []
+    company_name: str
+
+
+def encode_payload(request: QueryRequest, **extra) -> bytes:
+    """
+    Serializes the request into the JSON body of the RAG model, once per request.
+    The conversation_history is already a list of {"role", "content"} dicts and goes into the body as it is.
+    :param request:
+    :param extra: Additional fields of the body, e.g. stream=True
+    :return: UTF-8 JSON body
+    """
+    payload = {
+        "query": request.query,
+        "conversation_history": request.conversation_history,
+        "company_name": request.company_name,
+        **extra
+    }
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
 
 
 class CustomerInfo(BaseModel):
@@ -33,43 +73,201 @@ class CustomerInfo(BaseModel):
     service: Optional[str] = None
 
 
+# ===== Shared HTTP client =====
+def get_rag_client() -> httpx.AsyncClient:
+    """
+    Returns the shared, long-lived async HTTP client used for every RAG model request.
+    Connections are kept alive and reused between requests instead of opening a new one per message.
+    :return: httpx.AsyncClient
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                connect=settings.RAG_CONNECT_TIMEOUT,
+                read=settings.RAG_READ_TIMEOUT,
+                write=settings.RAG_WRITE_TIMEOUT,
+                pool=settings.RAG_POOL_TIMEOUT
+            ),
+            limits=httpx.Limits(
+                max_connections=settings.RAG_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.RAG_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.RAG_KEEPALIVE_EXPIRY
+            )
+        )
+    return _client
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(settings.RAG_MAX_CONCURRENT_REQUESTS)
+    return _semaphore
+
+
+async def close_rag_client() -> None:
+    """
+    Closes the shared HTTP client and releases its pooled connections.
+    Must be called on shutdown, a new client is created on the next request if needed.
+    """
+    global _client, _semaphore
+    if _client is not None:
+        await _client.aclose()
+    _client = None
+    _semaphore = None
+
+
+def get_balancer(urls: Sequence[str] = ()) -> RAGBalancer:
+    """
+    :param urls: RAG replicas of a tenant, empty for the replicas of the environment
+    :return: Balancer of the replicas, created once per set of URLs and shared by the tenants using it
+    """
+    if not urls:
+        return rag_balancer
+    key = tuple(urls)
+    balancer = _tenant_balancers.get(key)
+    if balancer is None:
+        balancer = _tenant_balancers[key] = RAGBalancer(
+            urls=list(key),
+            hedge_percentile=settings.RAG_HEDGE_PERCENTILE,
+            hedge_min_delay=settings.RAG_HEDGE_MIN_DELAY,
+            failure_threshold=settings.RAG_BREAKER_FAILURES,
+            reset_timeout=settings.RAG_BREAKER_RESET_TIMEOUT
+        )
+    return balancer
+
+
+def _request_failed(error: Exception) -> HTTPException:
+    """
+    :param error: Error of a RAG model request
+    :return: 503 for the failures worth a retry (transport errors, 5xx, 408 and 429 answers, no available
+        replica, a response that is not JSON), 502 when the RAG model rejected the request for good (other 4xx)
+    """
+    if isinstance(error, httpx.HTTPStatusError) and error.response.status_code < 500 \
+            and error.response.status_code not in (408, 429):
+        return HTTPException(status_code=502, detail="RAG model rejected the request.")
+    return HTTPException(status_code=503, detail="RAG model request failed.")
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    :return: True if the RAG request failed in a way a later retry of the same request may fix
+    """
+    return isinstance(error, HTTPException) and error.status_code == 503
+
+
 # ===== RAG Model Endpoint function =====
-async def rag_model_endpoint(request: QueryRequest):
+async def rag_model_endpoint(request: QueryRequest, rag_urls: Sequence[str] = ()):
     """
     Endpoint for rag model
     :role: rag model
     :purpose: Rag model endpoint for sending query request and conversation history and company name
     :param request:
+    :param rag_urls: RAG replicas of the tenant, the replicas of the environment when empty
     :return: Returns response from rag model for the telegram user message
     """
-    payload = {
-        "query": request.query,
-        "conversation_history": [{"role": msg.role, "content": msg.content} for msg in request.conversation_history],
-        "company_name": request.company_name
-    }
+    body = encode_payload(request)
 
     try:
-        formatted_payload = json.dumps(payload, indent=4)
-        # ====== Print Full payload for debug (can be deleted) ======
-        print(f"Payload being sent to RAG model: {formatted_payload}")
+        # ======== Full payload only at DEBUG level, nothing is formatted otherwise ========
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("RAG request of %s, %d history messages, %d bytes: %s", request.company_name,
+                         len(request.conversation_history), len(body), body.decode())
 
-        # ======== Print the exact payload structure being sent (can be deleted) ========
-        print(f"Exact payload being sent to RAG model: {payload}")
+        # ========= Send the payload to the best RAG replica (at most RAG_MAX_CONCURRENT_REQUESTS at a time) =========
+        with RAG_IN_FLIGHT.track_inprogress():
+            async with _get_semaphore():
+                response = await get_balancer(rag_urls).post(get_rag_client(), body)  # ========= Raises for bad responses =========
 
-        # ========= Send the payload to the RAG_MODEL_URL =========
-        response = requests.post(RAG_MODEL_URL, json=payload)
-        response.raise_for_status()  # ========= Raise an error for bad responses =========
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("RAG response after %.3fs, %d bytes: %s", response.elapsed.total_seconds(),
+                         len(response.content), response.text)
 
-        # ========= Print the full response from Rag Model (can be deleted) =======
-        print("Full Response from RAG model: ", json.dumps(response.json(), indent=4))
-        # ========= Print the full seconds waited for Rag Model's response (can be deleted) =======
-        print("Total Seconds waited for Response: ", response.elapsed.total_seconds())
+        # ========= Parse the response into json format, once (a truncated body is retried like a 5xx) =========
+        return response.json()
 
-        # ========= Parse the response into json format =========
-        response_data = response.json()
+    except (httpx.HTTPError, RAGUnavailableError, ValueError) as e:
+        logger.error(f"Request to RAG model failed: {e}")
+        raise _request_failed(e)
 
-        return response_data
 
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Request to RAG model failed: {e}")
-        raise HTTPException(status_code=500, detail="RAG model request failed.")
+# ===== Streaming RAG Model Endpoint function =====
+def _parse_stream_data(data: str) -> Dict[str, Any]:
+    """
+    Parses the data of one streamed event: JSON with "delta"/"token"/"content" for a piece of the answer,
+    or "response" (and "additional_data") for the final answer. Anything else is a piece of plain text.
+    """
+    try:
+        event = json.loads(data)
+    except ValueError:
+        return {"delta": data}
+    if not isinstance(event, dict):
+        return {"delta": data}
+    if "response" in event:
+        return {"response": event["response"], "additional_data": event.get("additional_data") or {}}
+    return {"delta": event.get("delta") or event.get("token") or event.get("content") or "",
+            "additional_data": event.get("additional_data") or {}}
+
+
+@asynccontextmanager
+async def _stream_target(balancer: RAGBalancer):
+    # ======== A dedicated streaming endpoint, or the least loaded replica (streams are not hedged) ========
+    if RAG_STREAM_URL and balancer is rag_balancer:
+        yield RAG_STREAM_URL
+        return
+    endpoint = balancer.pick()
+    if endpoint is None:
+        raise RAGUnavailableError("No RAG replica is available")
+    async with balancer.track(endpoint, record_latency=False):
+        yield endpoint.url
+
+
+async def stream_rag_model_endpoint(request: QueryRequest,
+                                    rag_urls: Sequence[str] = ()) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streaming endpoint for rag model
+    :purpose: Sends the same query request as rag_model_endpoint and yields the answer while it is generated.
+        The RAG service may answer with Server-Sent Events or with plain chunked text.
+    :param request:
+    :param rag_urls: RAG replicas of the tenant, the replicas of the environment when empty
+    :return: Yields {"delta": text} for every piece of the answer, then exactly one
+        {"response": full_text, "additional_data": {...}} with the final answer
+    """
+    body = encode_payload(request, stream=True)
+    pieces = []
+    final = None
+    additional_data = {}
+
+    try:
+        with RAG_IN_FLIGHT.track_inprogress():
+            async with _get_semaphore(), _stream_target(get_balancer(rag_urls)) as url:
+                async with get_rag_client().stream("POST", url, content=body, headers=JSON_HEADERS) as response:
+                    response.raise_for_status()
+
+                    if response.headers.get("content-type", "").startswith("text/event-stream"):
+                        # ======== Server-Sent Events, one "data:" line per event ========
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[len("data:"):].strip()
+                            if data == "[DONE]":
+                                break
+                            event = _parse_stream_data(data)
+                            additional_data.update(event.get("additional_data") or {})
+                            if "response" in event:
+                                final = event["response"]
+                            elif event["delta"]:
+                                pieces.append(event["delta"])
+                                yield {"delta": event["delta"]}
+                    else:
+                        # ======== Plain chunked text ========
+                        async for chunk in response.aiter_text():
+                            if chunk:
+                                pieces.append(chunk)
+                                yield {"delta": chunk}
+
+    except (httpx.HTTPError, RAGUnavailableError) as e:
+        logger.error(f"Streaming request to RAG model failed: {e}")
+        raise _request_failed(e)
+
+    yield {"response": final if final is not None else "".join(pieces), "additional_data": additional_data}
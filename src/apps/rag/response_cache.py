@@ -0,0 +1,183 @@
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+from cachetools import TTLCache
+
+from src.config import settings
+from src.apps.mongodb.connection import get_collection
+from src.apps.mongodb.repository import run_blocking
+from src.apps.rag.rag_model_endpoint import QueryRequest
+
+
+# ======== Logging configuration ========
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Lower-cases the text and drops punctuation and repeated whitespace, so "Narxi qancha?" and
+    "narxi  qancha" share a cache entry.
+    """
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def is_cacheable(rag_response: Dict[str, Any]) -> bool:
+    """
+    Answers that captured a lead belong to one customer and are never cached.
+    """
+    if "LEAD_CAPTURED" in (rag_response.get("response") or ""):
+        return False
+    return not (rag_response.get("additional_data") or {}).get("customer_info")
+
+
+class RAGResponseCache:
+    """
+    Cache of the RAG model answers, keyed by the normalized query, the company name and a fingerprint
+    of the last `history_depth` conversation messages.
+
+    Answers live in an in-memory LRU/TTL tier and, if a `collection` is given, in a persistent MongoDB
+    tier that expires documents with a TTL index. Concurrent identical requests share one RAG call.
+    """
+
+    def __init__(self, maxsize: int, ttl: int, history_depth: int, collection=None):
+        self.ttl = ttl
+        self.history_depth = history_depth
+        self.collection = collection
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.bypassed = 0
+        self.seconds_saved = 0.0
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._background = set()
+        self._indexes_ready = False
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "bypassed": self.bypassed,
+            "hit_rate": self.hit_rate,
+            "seconds_saved": self.seconds_saved,
+            "entries": len(self._memory),
+        }
+
+    def key(self, request: QueryRequest) -> str:
+        history = request.conversation_history[-self.history_depth:] if self.history_depth else []
+        fingerprint = [(message["role"], normalize_text(message["content"])) for message in history]
+        raw = json.dumps([normalize_text(request.query), request.company_name, fingerprint], ensure_ascii=False)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    async def get_or_fetch(self, request: QueryRequest,
+                           fetch: Callable[[QueryRequest], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        Returns the cached answer of the request, or calls `fetch` (rag_model_endpoint) and caches the answer.
+        :param request: RAG query request
+        :param fetch: Coroutine function calling the RAG model
+        :return: RAG model response
+        """
+        key = self.key(request)
+        entry = self._memory.get(key)
+        if entry is not None:
+            return self._hit(entry)
+
+        # ======== An identical request is already waiting for the RAG model, share its answer ========
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.coalesced += 1
+            rag_response = await asyncio.shield(in_flight)
+            if is_cacheable(rag_response):
+                return rag_response
+            return await fetch(request)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            entry = await self._load(key)
+            if entry is not None:
+                future.set_result(entry[0])
+                return self._hit(entry)
+
+            self.misses += 1
+            start = time.perf_counter()
+            rag_response = await fetch(request)
+            latency = time.perf_counter() - start
+            future.set_result(rag_response)
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+                # ======== Mark the exception as retrieved when nobody else waits for it ========
+                future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+        if is_cacheable(rag_response):
+            self._memory[key] = (rag_response, latency)
+            self._store(key, rag_response, latency)
+        else:
+            self.bypassed += 1
+        return rag_response
+
+    def _hit(self, entry):
+        rag_response, latency = entry
+        self.hits += 1
+        self.seconds_saved += latency
+        return rag_response
+
+    async def _load(self, key: str):
+        if self.collection is None:
+            return None
+        try:
+            document = await run_blocking(self.collection.find_one, {"_id": key})
+        except Exception as e:
+            logger.warning(f"Reading the persistent RAG response cache failed: {e}")
+            return None
+        if document is None:
+            return None
+        entry = (document["response"], document.get("latency", 0.0))
+        self._memory[key] = entry
+        return entry
+
+    def _store(self, key: str, rag_response: Dict[str, Any], latency: float) -> None:
+        if self.collection is None:
+            return
+        # ======== Written in the background, the reply does not wait for the persistent tier ========
+        task = asyncio.create_task(self._write(key, rag_response, latency))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _write(self, key: str, rag_response: Dict[str, Any], latency: float) -> None:
+        try:
+            if not self._indexes_ready:
+                await run_blocking(self.collection.create_index, "created_at", expireAfterSeconds=self.ttl)
+                self._indexes_ready = True
+            await run_blocking(
+                self.collection.replace_one,
+                {"_id": key},
+                {"response": rag_response, "latency": latency, "created_at": datetime.datetime.now(datetime.timezone.utc)},
+                upsert=True
+            )
+        except Exception as e:
+            logger.warning(f"Writing the persistent RAG response cache failed: {e}")
+
+
+# ======== Cache of the RAG answers, disabled when RAG_CACHE_MAX_ENTRIES is 0 ========
+rag_response_cache = RAGResponseCache(
+    maxsize=settings.RAG_CACHE_MAX_ENTRIES,
+    ttl=settings.RAG_CACHE_TTL,
+    history_depth=settings.RAG_CACHE_HISTORY_DEPTH,
+    collection=get_collection(settings.RAG_CACHE_COLLECTION) if settings.RAG_CACHE_PERSISTENT else None
+) if settings.RAG_CACHE_MAX_ENTRIES > 0 else None
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+from telegram.error import BadRequest, Forbidden
+
+from src.apps.mongodb.durable_queue import DurableQueue
+from src.apps.rag.rag_model_endpoint import rag_model_endpoint, is_transient, QueryRequest
+from src.apps.metrics.instrumentation import QUEUE_DEPTH, QUEUE_OLDEST_AGE
+
+
+# ===== Logging configuration =====
+logger = logging.getLogger(__name__)
+
+
+class RAGRetryQueue:
+    """
+    Background retries of the client messages the RAG model failed to answer.
+
+    The chat handler puts the failed request, together with the chat it came from, into a durable MongoDB
+    queue. A worker task retries the queued requests, at most `rate` per second (no limit when `rate` is 0 or
+    less) and with exponential backoff between the attempts of a request. When a RAG call fails, the rest of
+    the batch is postponed as well, without counting an attempt. Requests that run out of attempts, or that
+    the RAG model rejects (4xx), are passed to `give_up`.
+
+    The answer is stored on the queue item as soon as the RAG model gives it, then passed once to `record`
+    (history, leads) and to `deliver` (the Telegram reply). A failed delivery retries only the reply: the RAG
+    model is not called again and the history is not written twice. Replies Telegram refuses for good (blocked
+    bot, revoked business connection) are not retried.
+    """
+
+    def __init__(self, queue: DurableQueue, batch_size: int, rate: float, poll_interval: float,
+                 record: Callable[[Dict[str, Any], Dict[str, Any]], Awaitable[None]],
+                 deliver: Callable[[Any, Dict[str, Any], Dict[str, Any]], Awaitable[None]],
+                 give_up: Callable[[Dict[str, Any]], Awaitable[None]]):
+        self.queue = queue
+        self.batch_size = batch_size
+        self.rate = rate
+        self.poll_interval = poll_interval
+        self.record = record
+        self.deliver = deliver
+        self.give_up = give_up
+        self.answered = 0
+        self.undelivered = 0
+        self._bot = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def enqueue(self, request: QueryRequest, chat: Dict[str, Any]) -> bool:
+        """
+        Queues a failed request, errors are logged and never raised to the chat handler.
+        :param request: The RAG request that failed
+        :param chat: Where the answer goes: chat_id, business_connection_id, message_id, client_username, user_messages
+        :return: True if the request was queued
+        """
+        try:
+            await self.queue.put({"request": request.model_dump(), "chat": chat})
+        except Exception as e:
+            logger.error(f"Queueing the failed RAG request of {chat.get('client_username')} failed: {e}", exc_info=True)
+            return False
+        return True
+
+    def start(self, bot) -> None:
+        """
+        :param bot: telegram.Bot used to send the answers
+        """
+        self._bot = bot
+        self._task = asyncio.create_task(self._run(), name="RAGRetryQueue")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        try:
+            await self.queue.ensure_indexes()
+        except Exception as e:
+            logger.error(f"Preparing the RAG retry queue failed: {e}")
+
+        while True:
+            try:
+                await self.queue.requeue_stale_if_due()
+                QUEUE_DEPTH.labels("rag_retries").set(await self.queue.depth())
+                QUEUE_OLDEST_AGE.labels("rag_retries").set(await self.queue.oldest_age())
+                batch = await self.queue.claim(self.batch_size)
+            except Exception as e:
+                logger.error(f"Claiming failed RAG requests failed: {e}")
+                batch = []
+
+            if not batch:
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            try:
+                await self._process(batch)
+            except Exception as e:
+                # ======== MongoDB is unavailable, the claimed items go back to pending after the visibility timeout ========
+                logger.error(f"Processing failed RAG requests failed: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _process(self, batch) -> None:
+        for index, document in enumerate(batch):
+            chat = document["chat"]
+            rag_response = document.get("response")
+            if rag_response is None:
+                try:
+                    rag_response = await rag_model_endpoint(QueryRequest(**document["request"]),
+                                                            chat.get("rag_urls") or ())
+                except Exception as e:
+                    if not is_transient(e):
+                        # ======== Rejected by the RAG model, another attempt would be rejected too ========
+                        logger.error(f"The RAG model rejected the request of {chat.get('client_username')}: {e}")
+                        await self._give_up(document)
+                        await self.queue.fail([document], str(e))
+                        continue
+                    logger.warning(f"Retrying the RAG request of {chat.get('client_username')} failed: {e}")
+                    await self._postpone(document, batch[index + 1:], str(e))
+                    return
+                # ======== Keep the answer, a failed delivery must not call the RAG model again ========
+                await self.queue.save(document, {"response": rag_response})
+                self.answered += 1
+
+            if not document.get("recorded"):
+                await self.record(chat, rag_response)
+                await self.queue.save(document, {"recorded": True})
+
+            try:
+                await self.deliver(self._bot, chat, rag_response)
+            except (Forbidden, BadRequest) as e:
+                logger.error(f"Telegram refused the retried answer of {chat.get('client_username')}: {e}")
+                self.undelivered += 1
+                await self.queue.fail([document], str(e))
+            except Exception as e:
+                logger.warning(f"Sending the retried answer of {chat.get('client_username')} failed: {e}")
+                await self.queue.retry([document], str(e))
+            else:
+                await self.queue.complete([document])
+            if self.rate > 0:
+                await asyncio.sleep(1 / self.rate)
+
+    async def _postpone(self, document: Dict[str, Any], untried, error: str) -> None:
+        # ======== The RAG model is most likely still down, the rest of the batch waits without losing an attempt ========
+        if document.get("attempts", 0) + 1 >= self.queue.max_attempts:
+            await self._give_up(document)
+        await self.queue.retry([document], error)
+        await self.queue.release(untried, self.queue.backoff)
+
+    async def _give_up(self, document: Dict[str, Any]) -> None:
+        try:
+            await self.give_up(document["chat"])
+        except Exception as e:
+            logger.error(f"Giving up the RAG request of {document['chat'].get('client_username')} failed: {e}")
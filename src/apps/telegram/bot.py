@@ -1,27 +1,36 @@
 import re
 import json
 import logging
-from telegram import Update
+import functools
+from typing import Any, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from telegram import ReplyParameters, Update
 from telegram.ext import ContextTypes
 
 from src.config import settings
+from src.apps.mongodb.repository import conversation_repository
 from src.apps.mongodb.connection import get_collection
+from src.apps.mongodb.durable_queue import DurableQueue
 from src.apps.telegram.utils.save_admin_message import save_message_to_history
+from src.apps.telegram.coalescer import MessageCoalescer
+from src.apps.telegram.streaming import StreamingReply
+from src.apps.telegram.send_scheduler import send_priority, BACKGROUND
 
-from src.apps.rag.rag_model_endpoint import rag_model_endpoint, QueryRequest, Message
+from src.apps.rag.rag_model_endpoint import rag_model_endpoint, stream_rag_model_endpoint, is_transient, QueryRequest
+from src.apps.rag.response_cache import rag_response_cache
+from src.apps.rag.history_window import build_history_window
+from src.apps.rag.retry_queue import RAGRetryQueue
+from src.apps.amocrm.lead_queue import lead_export_queue
+from src.apps.metrics.instrumentation import stage_timer
+from src.apps.tenants.registry import get_tenant
 
 
 # ======== Logging configuration ========
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# ======== Get MongoDB collection ========
-conversation_collection = get_collection("telegram_conversations")
-
 # ======== Telegram bot token ========
 TELEGRAM_BOT_TOKEN = settings.TELEGRAM_BOT_TOKEN
-COMPANY_NAME = settings.COMPANY_NAME
-BUSINESS_USERNAME = settings.BUSINESS_USERNAME
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
@@ -37,14 +46,20 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     # The username of the client, always comes intact in any update from telegram as chat username ========
     client_username = update.business_message.chat.username
-    print("Client username: {}".format(client_username))
+    logger.debug("Client username: %s", client_username)
 
+    # ======== Business account the bot answers for, and the key of the chat in its history ========
+    tenant = await get_tenant(update.business_message.business_connection_id)
+    if tenant is None:
+        logger.warning(f"Business connection {update.business_message.business_connection_id} is not served")
+        return
+    chat_key = tenant.chat_key(client_username)
 
     # ========= Prevent bot from responding to its own business account messages ========
-    if str(business_username) == BUSINESS_USERNAME:
+    if str(business_username) == tenant.admin_username:
         print(f"Message from our own business account {business_username} detected."
               f"Saving in conversation_history but not responding.")
-        await save_message_to_history(update, client_username)
+        await save_message_to_history(update, chat_key)
         return
 
     try:
@@ -63,72 +78,220 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         logger.error(f"Error while handling message: {e}")
         return
 
-    # ======== Retrieve only the last 10 conversation messages from MongoDB ========
-    conversation = conversation_collection.find_one({"username": client_username})
-    history = conversation.get("history", [])[-10:] if conversation else []
+    if user_message_text:
+        # ======== Merge a burst of short messages into a single RAG query, or answer right away ========
+        if message_coalescer is not None:
+            message_coalescer.add(chat_key, update, user_message_text)
+        else:
+            await answer_messages(update, chat_key, [user_message_text])
+    else:
+        logger.error("Received a message with no text.")
+
 
-    # ==== Format the history into the role: user, role: assistant, content=content format for the rag_model input ====
-    conversation_history = [Message(content=msg['content'], role=msg['role']) for msg in history]
+async def answer_messages(update: Update, client_username, user_messages: List[str]) -> None:
+    """
+    Answers one or more consecutive user messages of the chat with a single RAG model call.
+    :param update: Telegram update of the last user message, the answer is sent as a reply to it.
+    :param client_username: Key of the CHAT between the client and the Telegram Business Account (Tenant.chat_key)
+    :param user_messages: Texts of the user messages, in order
+    """
+    # ======== Resolved by handle_message already, served from the tenant cache ========
+    business_connection_id = (update.message or update.business_message).business_connection_id
+    tenant = await get_tenant(business_connection_id)
+    if tenant is None:
+        return
 
-    # ======== Prepare the request for the RAG query ========
-    if user_message_text:
-        request = QueryRequest(
-            query=user_message_text,
-            conversation_history=conversation_history,
-            company_name=COMPANY_NAME
+    # ======== Retrieve the recent conversation messages not folded into the summary yet, and the summary ========
+    with stage_timer("history_fetch", tenant.company_name):
+        conversation = await conversation_repository.get_recent_conversation(
+            client_username, settings.HISTORY_WINDOW + settings.HISTORY_SUMMARY_BATCH
         )
 
-        try:
-            # ======== Call the RAG model endpoint ========
-            rag_response = await rag_model_endpoint(request)
-
-            # ======== Extract the response text ========
-            response_text = rag_response['response']
+    with stage_timer("request_build", tenant.company_name):
+        # ==== Fit the history and the summary into the character budget, as {"role", "content"} dicts ====
+        history = build_history_window(conversation.unsummarized_history, conversation.summary)
 
-            # ======== Remove any occurrence of "LEAD_CAPTURED" or "LEAD_CAPTURED: ..." from the response ========
-            response_text = re.sub(r'LEAD_CAPTURED(:.*?(\[.*?\])?)?$', '', response_text).strip()
+        # ======== Prepare the request for the RAG query, the history is already in the wire format ========
+        request = QueryRequest.model_construct(
+            query="\n".join(user_messages),
+            conversation_history=history,
+            company_name=tenant.company_name
+        )
 
-            # ==== Handle customer info if it's part of the response ====
-            # await handle_customer_info(rag_response)
-            customer_info = rag_response.get("additional_data", {}).get("customer_info", {})
+    # ======== In streaming mode the answer is shown while it is generated, by editing a single reply ========
+    streaming_reply = StreamingReply(
+        reply_to=update.message or update.business_message,
+        edit_interval=settings.STREAM_EDIT_INTERVAL,
+        company=tenant.company_name
+    ) if settings.RAG_STREAMING else None
 
-            # ==== Combine response_text and customer_info into a single string for saving it in History MongoDB ====
-            if customer_info:
-                customer_info_str = json.dumps(customer_info, indent=2)
-                content = f"{response_text}\n\n{customer_info_str}"
-            else:
-                content = response_text
+    try:
+        # ======== Call the RAG model endpoint, through the response cache if it is enabled ========
+        with stage_timer("rag", tenant.company_name):
+            try:
+                if streaming_reply is not None:
+                    rag_response = await streaming_reply.consume(stream_rag_model_endpoint(request, tenant.rag_urls))
+                elif rag_response_cache is not None:
+                    rag_response = await rag_response_cache.get_or_fetch(
+                        request, functools.partial(rag_model_endpoint, rag_urls=tenant.rag_urls)
+                    )
+                else:
+                    rag_response = await rag_model_endpoint(request, tenant.rag_urls)
+            except HTTPException as e:
+                # ======== Keep the message in the retry queue, it is answered once the RAG model recovers ========
+                if not is_transient(e) or rag_retry_queue is None or not await rag_retry_queue.enqueue(
+                        request, retry_chat(update, client_username, user_messages, tenant.rag_urls)):
+                    raise
+                rag_response = None
 
-            # ======== Update conversation history for "role": "user" ========
-            history.append({"role": "user", "content": user_message_text})
+        if rag_response is None:
+            logger.warning(f"RAG model failed, the message of {client_username} is queued for a retry")
+            await send_placeholder(update, streaming_reply)
+            return
 
-            # ======== Update conversation history for "role": "assistant" ========
-            history.append({"role": "assistant", "content": content})
+        with stage_timer("lead_postprocess", tenant.company_name):
+            response_text, content, customer_info = process_rag_response(rag_response)
 
-            # ======== Update or insert conversation in MongoDB ========
-            conversation_collection.update_one(
-                {"username": client_username},
-                {"$set": {"history": history}},
-                upsert=True
+        # ======== Append every "role": "user" message and the "role": "assistant" answer in MongoDB ========
+        with stage_timer("history_write", tenant.company_name):
+            await conversation_repository.append_messages(
+                client_username,
+                [{"role": "user", "content": text} for text in user_messages] + [{"role": "assistant", "content": content}]
             )
 
-            # ======== Send the response to the user in bot or in the PM ========
-            if update.message:
+        # ======== Send the response to the user in bot or in the PM ========
+        with stage_timer("telegram_reply", tenant.company_name):
+            if streaming_reply is not None:
+                await streaming_reply.finish(response_text)
+            elif update.message:
                 await update.message.reply_text(response_text)
             elif hasattr(update, 'business_message') and update.business_message:
                 await update.business_message.reply_text(response_text)
             else:
                 logger.error("No valid message type found for response.")
 
+        # ======== Queue the lead for the background amoCRM export, after the customer got the answer ========
+        if customer_info and lead_export_queue is not None:
+            await lead_export_queue.enqueue(customer_info, tenant, business_connection_id)
 
-        except Exception as e:
-            logger.error(f"Error handling message: {e}", exc_info=True)
-            if update.message:
-                await update.message.reply_text("Hozir javob yozvoraman, ozgina kutib turing, hop!?)")
-            elif hasattr(update, 'business_message') and update.business_message:
-                await update.business_message.reply_text("Hozir javob yozvoraman, ozgina kutib turing, hop?)")
+
+    except Exception as e:
+        logger.error(f"Error handling message: {e}", exc_info=True)
+        await send_placeholder(update, streaming_reply)
+
+
+def process_rag_response(rag_response: Dict[str, Any]) -> Tuple[str, str, Dict[str, Any]]:
+    """
+    Prepares a RAG answer for the client and for the conversation history.
+    :param rag_response: Response of the RAG model
+    :return: Text for the client, content for the history and the customer_info of a captured lead
+    """
+    # ======== Extract the response text ========
+    response_text = rag_response['response']
+
+    # ======== Remove any occurrence of "LEAD_CAPTURED" or "LEAD_CAPTURED: ..." from the response ========
+    response_text = re.sub(r'LEAD_CAPTURED(:.*?(\[.*?\])?)?$', '', response_text).strip()
+
+    # ==== Handle customer info if it's part of the response ====
+    # await handle_customer_info(rag_response)
+    customer_info = rag_response.get("additional_data", {}).get("customer_info", {})
+
+    # ==== Combine response_text and customer_info into a single string for saving it in History MongoDB ====
+    if customer_info:
+        customer_info_str = json.dumps(customer_info, indent=2)
+        content = f"{response_text}\n\n{customer_info_str}"
     else:
-        logger.error("Received a message with no text.")
+        content = response_text
+    return response_text, content, customer_info
+
+
+async def send_placeholder(update: Update, streaming_reply: Optional[StreamingReply] = None) -> None:
+    # ======== Placeholder reply while the answer is not ready ========
+    if update.message:
+        text = "Hozir javob yozvoraman, ozgina kutib turing, hop!?)"
+    elif hasattr(update, 'business_message') and update.business_message:
+        text = "Hozir javob yozvoraman, ozgina kutib turing, hop?)"
+    else:
+        return
+    # ======== A stream that failed midway shows the placeholder in its partial answer instead ========
+    if streaming_reply is not None and await streaming_reply.replace(text):
+        return
+    await (update.message or update.business_message).reply_text(text)
+
+
+def retry_chat(update: Update, client_username, user_messages: List[str], rag_urls=()) -> Dict[str, Any]:
+    """
+    :return: Everything the retry queue needs to answer the messages later, in the right (business) chat
+    """
+    message = update.message or update.business_message
+    return {
+        "chat_id": message.chat_id,
+        "business_connection_id": message.business_connection_id,
+        "message_id": message.message_id,
+        "client_username": client_username,
+        "user_messages": user_messages,
+        "rag_urls": list(rag_urls),
+    }
+
+
+async def record_retried_answer(chat: Dict[str, Any], rag_response: Dict[str, Any]) -> None:
+    """
+    Appends both turns of a retried RAG request to the history and queues its lead, once per request.
+    """
+    _, content, customer_info = process_rag_response(rag_response)
+    await conversation_repository.append_messages(
+        chat["client_username"],
+        [{"role": "user", "content": text} for text in chat["user_messages"]] + [{"role": "assistant", "content": content}]
+    )
+    tenant = await get_tenant(chat["business_connection_id"])
+    if customer_info and lead_export_queue is not None and tenant is not None:
+        await lead_export_queue.enqueue(customer_info, tenant, chat["business_connection_id"])
+
+
+async def deliver_retried_answer(bot, chat: Dict[str, Any], rag_response: Dict[str, Any]) -> None:
+    """
+    Sends the answer of a retried RAG request as a reply to the last message.
+    """
+    response_text, _, _ = process_rag_response(rag_response)
+    await bot.send_message(
+        chat["chat_id"],
+        response_text,
+        business_connection_id=chat["business_connection_id"],
+        reply_parameters=ReplyParameters(chat["message_id"], allow_sending_without_reply=True),
+        **send_priority(bot, BACKGROUND)
+    )
+
+
+async def record_unanswered_messages(chat: Dict[str, Any]) -> None:
+    # ======== The RAG model never answered, keep at least the client messages in the history ========
+    await conversation_repository.append_messages(
+        chat["client_username"], [{"role": "user", "content": text} for text in chat["user_messages"]]
+    )
+
+
+# ======== Retry queue of the messages the RAG model failed to answer ========
+rag_retry_queue = RAGRetryQueue(
+    queue=DurableQueue(
+        get_collection(settings.RAG_RETRY_COLLECTION),
+        max_attempts=settings.RAG_RETRY_MAX_ATTEMPTS,
+        backoff=settings.RAG_RETRY_BACKOFF,
+        max_backoff=settings.RAG_RETRY_MAX_BACKOFF,
+        retention=settings.RAG_RETRY_RETENTION_DAYS * 86400
+    ),
+    batch_size=settings.RAG_RETRY_BATCH_SIZE,
+    rate=settings.RAG_RETRY_RATE,
+    poll_interval=settings.RAG_RETRY_POLL_INTERVAL,
+    record=record_retried_answer,
+    deliver=deliver_retried_answer,
+    give_up=record_unanswered_messages
+) if settings.RAG_RETRY_ENABLED else None
+
+# ======== Burst coalescing of the client messages (disabled when COALESCE_QUIET_WINDOW is 0) ========
+message_coalescer = MessageCoalescer(
+    flush=answer_messages,
+    quiet_window=settings.COALESCE_QUIET_WINDOW,
+    max_wait=settings.COALESCE_MAX_WAIT
+) if settings.COALESCE_QUIET_WINDOW > 0 else None
 
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+
+# ======== Logging configuration ========
+logger = logging.getLogger(__name__)
+
+
+class _Burst:
+    __slots__ = ("update", "texts", "first_at", "last_at")
+
+    def __init__(self, now: float):
+        self.update = None
+        self.texts: List[str] = []
+        self.first_at = now
+        self.last_at = now
+
+
+class MessageCoalescer:
+    """
+    Debounces the messages of a chat and passes a whole burst to `flush(update, key, texts)` at once.
+
+    A burst is flushed when the chat has been quiet for `quiet_window` seconds, or `max_wait` seconds after
+    its first message. Flushes of the same chat run one after another: messages arriving while the previous
+    flush of the chat is still running join the next burst.
+    """
+
+    def __init__(self, flush: Callable[[Any, Hashable, List[str]], Awaitable[None]],
+                 quiet_window: float, max_wait: float):
+        self.flush = flush
+        self.quiet_window = quiet_window
+        self.max_wait = max_wait
+        self.messages = 0
+        self.flushes = 0
+        self._bursts: Dict[Hashable, _Burst] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+    @property
+    def coalescing_ratio(self) -> float:
+        """
+        :return: Average number of messages answered by a single flush
+        """
+        return self.messages / self.flushes if self.flushes else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "messages": self.messages,
+            "flushes": self.flushes,
+            "coalescing_ratio": self.coalescing_ratio,
+            "pending_bursts": len(self._bursts),
+        }
+
+    def add(self, key: Hashable, update, text: str) -> None:
+        """
+        Adds a message to the current burst of the chat, starting a new burst if there is none.
+        :param key: Chat the message belongs to
+        :param update: Telegram update of the message, the last one of a burst is passed to flush
+        :param text: Text of the message
+        """
+        self.messages += 1
+        now = asyncio.get_running_loop().time()
+        burst = self._bursts.get(key)
+        if burst is None:
+            burst = self._bursts[key] = _Burst(now)
+            task = asyncio.create_task(self._run(key, burst, self._tasks.get(key)))
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        burst.update = update
+        burst.texts.append(text)
+        burst.last_at = now
+
+    async def shutdown(self) -> None:
+        """
+        Waits until every pending burst has been flushed.
+        """
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def _run(self, key: Hashable, burst: _Burst, previous: Optional[asyncio.Task]) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            delay = min(burst.last_at + self.quiet_window, burst.first_at + self.max_wait) - loop.time()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+
+        # ======== Keep the answers of a chat in order ========
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        if self._bursts.get(key) is burst:
+            del self._bursts[key]
+        self.flushes += 1
+        try:
+            await self.flush(burst.update, key, burst.texts)
+        except Exception as e:
+            logger.error(f"Error while answering a burst of {len(burst.texts)} messages: {e}", exc_info=True)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
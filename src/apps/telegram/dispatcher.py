@@ -0,0 +1,144 @@
+import asyncio
+import inspect
+import logging
+from typing import Any, Awaitable, Dict, Hashable, Optional
+from telegram.ext import BaseUpdateProcessor
+
+
+# ======== Logging configuration ========
+logger = logging.getLogger(__name__)
+
+
+class _ChatQueue:
+    __slots__ = ("queue", "put_lock", "waiting", "overflowing", "worker")
+
+    def __init__(self, maxsize: int):
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        # ======== Keeps the arrival order when several updates wait for a full queue ========
+        self.put_lock = asyncio.Lock()
+        self.waiting = 0
+        # ======== Set while updates are dropped, the overflow of a chat is logged once ========
+        self.overflowing = False
+        self.worker: Optional[asyncio.Task] = None
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Update processor that handles updates of different chats concurrently, while updates of the same
+    chat are handled strictly one after another, in the order they arrived.
+
+    Every active chat gets a bounded queue and a worker task. At most `max_concurrent_chats` chats are
+    handled at the same time, a full chat queue makes the next updates of that chat wait (backpressure),
+    and the worker of a chat idle for `idle_timeout` seconds is stopped and its queue dropped.
+    The updates of a chat do not count against the shared limit of BaseUpdateProcessor, so a chat flooding
+    the bot only delays itself: at most `chat_queue_size` of its updates wait for room in its full queue,
+    the next ones are dropped and counted in `dropped_updates`. Updates without a chat are handled right
+    away, within the shared limit.
+    """
+
+    def __init__(self, max_concurrent_chats: int, chat_queue_size: int, idle_timeout: float):
+        # ======== Updates being handled plus updates waiting in the chat queues ========
+        super().__init__(max_concurrent_updates=max(max_concurrent_chats * chat_queue_size, 2))
+        self.max_concurrent_chats = max_concurrent_chats
+        self.chat_queue_size = chat_queue_size
+        self.idle_timeout = idle_timeout
+        self._chats: Dict[Hashable, _ChatQueue] = {}
+        self._running: Optional[asyncio.Semaphore] = None
+        self.dropped_updates = 0
+
+    @staticmethod
+    def chat_key(update: object) -> Optional[Hashable]:
+        """
+        :return: ID of the chat the update belongs to, None if it has no chat
+        """
+        business_message = getattr(update, "business_message", None)
+        if business_message is not None:
+            return business_message.chat.id
+        chat = getattr(update, "effective_chat", None)
+        return chat.id if chat is not None else None
+
+    @property
+    def active_chats(self) -> int:
+        return len(self._chats)
+
+    @property
+    def pending_updates(self) -> int:
+        return sum(chat.queue.qsize() + chat.waiting for chat in self._chats.values())
+
+    def stats(self) -> Dict[str, float]:
+        return {"active_chats": self.active_chats, "pending_updates": self.pending_updates,
+                "dropped_updates": self.dropped_updates}
+
+    async def initialize(self) -> None:
+        self._running = asyncio.Semaphore(self.max_concurrent_chats)
+
+    async def shutdown(self) -> None:
+        # ======== Application.stop() already waited for the queued updates, only idle workers are left ========
+        workers = [chat.worker for chat in self._chats.values() if chat.worker is not None]
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._chats.clear()
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        # ======== The shared slot is only taken by updates without a chat, a full chat queue holds none ========
+        if self.chat_key(update) is None:
+            await super().process_update(update, coroutine)
+        else:
+            await self.do_process_update(update, coroutine)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self.chat_key(update)
+        if key is None:
+            async with self._running:
+                await coroutine
+            return
+
+        chat = self._chats.get(key)
+        if chat is None:
+            chat = self._chats[key] = _ChatQueue(self.chat_queue_size)
+            chat.worker = asyncio.create_task(self._chat_worker(key, chat), name=f"PerChatUpdateProcessor:{key}")
+
+        if chat.waiting >= self.chat_queue_size:
+            # ======== The chat sends faster than it is answered, its overflow is dropped ========
+            self.dropped_updates += 1
+            if not chat.overflowing:
+                chat.overflowing = True
+                logger.warning(f"Chat {key} has {chat.waiting} updates waiting for its full queue, "
+                               f"its next updates are dropped until it drains")
+            if inspect.iscoroutine(coroutine):
+                coroutine.close()
+            return
+
+        done = asyncio.get_running_loop().create_future()
+        chat.waiting += 1
+        try:
+            async with chat.put_lock:
+                await chat.queue.put((coroutine, done))
+            chat.overflowing = False
+        finally:
+            chat.waiting -= 1
+        await done
+
+    async def _chat_worker(self, key: Hashable, chat: _ChatQueue) -> None:
+        try:
+            while True:
+                try:
+                    coroutine, done = await asyncio.wait_for(chat.queue.get(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    if chat.queue.empty():
+                        return
+                    continue
+
+                async with self._running:
+                    try:
+                        await coroutine
+                    except Exception as e:
+                        # ======== Application.process_update reports handler errors itself ========
+                        logger.error(f"Error while processing an update of chat {key}: {e}", exc_info=True)
+                    finally:
+                        if not done.done():
+                            done.set_result(None)
+        finally:
+            if self._chats.get(key) is chat:
+                del self._chats[key]
@@ -0,0 +1,279 @@
+import time
+import asyncio
+import logging
+import itertools
+from typing import Any, Callable, Coroutine, Dict, Hashable, List, Optional
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from src.config import settings
+from src.apps.metrics.instrumentation import SEND_QUEUE_WAIT
+
+
+# ======== Logging configuration ========
+logger = logging.getLogger(__name__)
+
+# ======== Priorities of the outbound requests, lower is sent first ========
+REPLY = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {REPLY: "reply", BACKGROUND: "background"}
+
+# ======== Bot API methods that post into a chat and count against the flood limits ========
+_LIMITED_PREFIXES = ("send", "edit", "copyMessage", "forwardMessage")
+_UNLIMITED_METHODS = {"sendChatAction"}
+
+
+def send_priority(bot, priority: int) -> Dict[str, Any]:
+    """
+    Keyword arguments that give a Bot API call the priority, e.g. bot.send_message(..., **send_priority(bot, BACKGROUND)).
+    Empty when the bot has no scheduler, PTB refuses rate_limit_args without a rate limiter.
+    """
+    if getattr(bot, "rate_limiter", None) is None:
+        return {}
+    return {"rate_limit_args": {"priority": priority}}
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second on average and bursts of up to `burst` requests.
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """
+        :return: Seconds until a token is available, 0 if there is one
+        """
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class _ChatState:
+    __slots__ = ("bucket", "paused_until", "busy")
+
+    def __init__(self, rate: float, burst: int):
+        self.bucket = TokenBucket(rate, burst)
+        self.paused_until = 0.0
+        # ======== One request per chat at a time, so the messages of a chat arrive in order ========
+        self.busy = False
+
+
+class _Send:
+    __slots__ = ("priority", "seq", "chat_id", "callback", "args", "kwargs", "future", "enqueued_at", "retries")
+
+    def __init__(self, priority: int, seq: int, chat_id, callback, args, kwargs, future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.retries = 0
+
+    def __lt__(self, other: "_Send") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundScheduler(BaseRateLimiter[Dict[str, Any]]):
+    """
+    Rate limiter of the bot that sends every outbound message through a single scheduler.
+
+    Requests wait in a priority queue: customer replies (REPLY, the default) go before background sends
+    such as retried answers and intermediate streaming edits (BACKGROUND, set with send_priority).
+    A request is sent when the global and its chat's token buckets allow it. Requests of a chat are sent one
+    at a time and in order, and a throttled chat does not hold back the other chats. A 429 pauses the chat
+    (or every chat, for requests without one) for retry_after seconds and puts the request back in the queue
+    instead of failing it. Calls that do not post into a chat (getUpdates, sendChatAction, ...) are not limited.
+    """
+
+    def __init__(self, global_rate: float, global_burst: int, chat_rate: float, chat_burst: int, max_retries: int):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_burst)
+        self._global_paused_until = 0.0
+        self._chats: Dict[Hashable, _ChatState] = {}
+        self._queue: List[_Send] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._in_flight = set()
+        self.sent = 0
+        self.retried_after = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._queue)
+
+    async def initialize(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="OutboundScheduler")
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, *self._in_flight, return_exceptions=True)
+            self._task = None
+        for send in self._queue:
+            if not send.future.done():
+                send.future.set_exception(RuntimeError("The send scheduler was shut down"))
+        self._queue.clear()
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ) -> Any:
+        if endpoint in _UNLIMITED_METHODS or not endpoint.startswith(_LIMITED_PREFIXES):
+            return await callback(*args, **kwargs)
+        await self.initialize()
+
+        priority = (rate_limit_args or {}).get("priority", REPLY)
+        send = _Send(priority, next(self._seq), data.get("chat_id"), callback, args, kwargs,
+                     asyncio.get_running_loop().create_future())
+        self._queue.append(send)
+        self._wakeup.set()
+        return await send.future
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "pending": len(self._queue),
+            "in_flight": len(self._in_flight),
+            "sent": self.sent,
+            "retried_after": self.retried_after,
+            "chats": len(self._chats),
+        }
+
+    async def _run(self) -> None:
+        while True:
+            delay = self._dispatch(time.monotonic())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _chat(self, chat_id) -> _ChatState:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _ChatState(self.chat_rate, self.chat_burst)
+        return chat
+
+    def _dispatch(self, now: float) -> Optional[float]:
+        """
+        Sends every queued request the limits allow.
+        :return: Seconds until the next request may be sent, None if it depends on a new request or a response
+        """
+        next_wait = None
+        held_back = set()
+        for send in sorted(self._queue):
+            if send.future.done():
+                # ======== The caller gave up (e.g. the handler was cancelled) ========
+                self._queue.remove(send)
+                continue
+            if send.chat_id in held_back:
+                continue
+
+            chat = self._chat(send.chat_id)
+            wait = 0.0 if chat.busy else max(chat.paused_until - now, chat.bucket.wait_time(now))
+            if chat.busy or wait > 0:
+                # ======== The later requests of the chat wait as well, the other chats go on ========
+                held_back.add(send.chat_id)
+                if wait > 0:
+                    next_wait = wait if next_wait is None else min(next_wait, wait)
+                continue
+
+            global_wait = max(self._global_paused_until - now, self._global.wait_time(now))
+            if global_wait > 0:
+                return global_wait if next_wait is None else min(next_wait, global_wait)
+
+            self._global.take(now)
+            chat.bucket.take(now)
+            chat.busy = True
+            self._queue.remove(send)
+            task = asyncio.create_task(self._send(send, chat))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+        self._forget_idle_chats(now)
+        return next_wait
+
+    async def _send(self, send: _Send, chat: _ChatState) -> None:
+        started = time.monotonic()
+        try:
+            result = await send.callback(*send.args, **send.kwargs)
+        except RetryAfter as e:
+            self.retried_after += 1
+            paused_until = time.monotonic() + float(e.retry_after)
+            if send.chat_id is None:
+                self._global_paused_until = max(self._global_paused_until, paused_until)
+            else:
+                chat.paused_until = max(chat.paused_until, paused_until)
+            send.retries += 1
+            if send.retries > self.max_retries:
+                self._finish(send, started, exception=e)
+            else:
+                logger.warning(f"Flood control in chat {send.chat_id}, sending again in {e.retry_after}s")
+                self._queue.append(send)
+        except Exception as e:
+            self._finish(send, started, exception=e)
+        else:
+            self.sent += 1
+            self._finish(send, started, result=result)
+        finally:
+            chat.busy = False
+            self._wakeup.set()
+
+    @staticmethod
+    def _finish(send: _Send, started: float, result: Any = None, exception: Optional[BaseException] = None) -> None:
+        SEND_QUEUE_WAIT.labels(PRIORITY_NAMES.get(send.priority, str(send.priority))).observe(started - send.enqueued_at)
+        if send.future.done():
+            return
+        if exception is not None:
+            send.future.set_exception(exception)
+        else:
+            send.future.set_result(result)
+
+    def _forget_idle_chats(self, now: float) -> None:
+        # ======== Chats with a full bucket and nothing going on are indistinguishable from new ones ========
+        if len(self._chats) < 1000:
+            return
+        queued = {send.chat_id for send in self._queue}
+        for chat_id in [chat_id for chat_id, chat in self._chats.items()
+                        if chat_id not in queued and not chat.busy and chat.paused_until <= now and chat.bucket.full(now)]:
+            del self._chats[chat_id]
+
+
+# ======== Scheduler of the outbound Telegram requests, disabled with SEND_SCHEDULER_ENABLED=false ========
+send_scheduler = OutboundScheduler(
+    global_rate=settings.SEND_GLOBAL_RATE,
+    global_burst=settings.SEND_GLOBAL_BURST,
+    chat_rate=settings.SEND_CHAT_RATE,
+    chat_burst=settings.SEND_CHAT_BURST,
+    max_retries=settings.SEND_MAX_RETRIES
+) if settings.SEND_SCHEDULER_ENABLED else None
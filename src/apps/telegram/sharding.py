@@ -0,0 +1,353 @@
+import os
+import sys
+import json
+import bisect
+import signal
+import asyncio
+import hashlib
+import logging
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application, BaseUpdateProcessor
+
+from src.apps.telegram.dispatcher import PerChatUpdateProcessor
+
+
+# ======== Logging configuration ========
+logger = logging.getLogger(__name__)
+
+# ======== Longest line (one JSON update) accepted on the worker sockets ========
+STREAM_LIMIT = 16 * 1024 * 1024
+# ======== Sent by a stopping worker, the ingress stops routing to it and closes the connection ========
+LEAVING = b"leaving\n"
+# ======== Seconds a stopping worker waits for the ingress to close the connection ========
+LEAVE_TIMEOUT = 10
+
+
+class HashRing:
+    """
+    Consistent hashing of chat IDs over the worker processes.
+    Every worker owns `virtual_nodes` points of the ring, so the chats spread evenly over the workers and
+    removing or adding a worker only moves the chats of that worker.
+    """
+
+    def __init__(self, virtual_nodes: int = 100):
+        self.virtual_nodes = virtual_nodes
+        self._points: List[int] = []
+        self._owners: Dict[int, Hashable] = {}
+
+    @staticmethod
+    def _hash(value) -> int:
+        return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "big")
+
+    @property
+    def nodes(self) -> set:
+        return set(self._owners.values())
+
+    def add(self, node: Hashable) -> None:
+        for replica in range(self.virtual_nodes):
+            point = self._hash(f"{node}#{replica}")
+            if point not in self._owners:
+                bisect.insort(self._points, point)
+            self._owners[point] = node
+
+    def remove(self, node: Hashable) -> None:
+        points = [point for point, owner in self._owners.items() if owner == node]
+        for point in points:
+            del self._owners[point]
+        self._points = [point for point in self._points if point in self._owners]
+
+    def get(self, key) -> Optional[Hashable]:
+        """
+        :return: Node owning the key, None if the ring is empty
+        """
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[self._points[index]]
+
+
+class _Worker:
+    __slots__ = ("index", "socket_path", "process", "writer", "held", "evict_timer", "routed", "restarts")
+
+    def __init__(self, index: int, socket_path: str):
+        self.index = index
+        self.socket_path = socket_path
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        # ======== (chat key, line) of the updates waiting for the worker to (re)start ========
+        self.held: List[Tuple[Hashable, bytes]] = []
+        self.evict_timer: Optional[asyncio.TimerHandle] = None
+        self.routed = 0
+        self.restarts = 0
+
+
+class ShardRouter(BaseUpdateProcessor):
+    """
+    Update processor of the ingress process: the updates are not handled here but sent to worker processes.
+
+    The ingress receives the updates (polling or webhook, as usual) and writes every update, as a JSON line,
+    to the unix socket of the worker that owns its chat on a consistent hash ring. The updates of a chat
+    therefore always reach the same worker in order, and its caches stay warm. The router starts the
+    `workers` processes with `command(index, socket_path)` and restarts the ones that exit.
+
+    While a worker is down or restarting, the updates of its chats wait in the ingress and are sent, in order,
+    to the restarted process, which only starts once the previous one has finished its updates. A stopping
+    worker announces it and keeps reading until the ingress closes the connection, so no update sent to it
+    is lost. A worker that is not back after `hold_timeout` seconds leaves the ring: its chats, and the updates
+    waiting for it, move to the other workers until it comes back.
+    """
+
+    def __init__(self, workers: int, command: Callable[[int, str], List[str]], socket_dir: str,
+                 virtual_nodes: int = 100, restart_backoff: float = 1.0, hold_timeout: float = 30,
+                 stop_timeout: float = 30, env: Optional[Callable[[int], Dict[str, str]]] = None):
+        # ======== One update at a time, the order of the socket writes is the order of the updates ========
+        super().__init__(max_concurrent_updates=1)
+        self.command = command
+        self.env = env
+        self.restart_backoff = restart_backoff
+        self.hold_timeout = hold_timeout
+        self.stop_timeout = stop_timeout
+        self.ring = HashRing(virtual_nodes)
+        self.workers = [_Worker(index, os.path.join(socket_dir, f"worker-{index}.sock")) for index in range(workers)]
+        self.socket_dir = socket_dir
+        self._supervisors: List[asyncio.Task] = []
+        self._stopping = False
+
+    @property
+    def held_updates(self) -> int:
+        return sum(len(worker.held) for worker in self.workers)
+
+    async def initialize(self) -> None:
+        os.makedirs(self.socket_dir, exist_ok=True)
+        self._stopping = False
+        for worker in self.workers:
+            self.ring.add(worker.index)
+            self._schedule_eviction(worker)
+        self._supervisors = [asyncio.create_task(self._supervise(worker), name=f"ShardRouter:worker-{worker.index}")
+                             for worker in self.workers]
+
+    async def shutdown(self) -> None:
+        self._stopping = True
+        for worker in self.workers:
+            self._disconnect(worker)
+            if worker.evict_timer is not None:
+                worker.evict_timer.cancel()
+        if self.held_updates:
+            logger.error(f"{self.held_updates} updates were still waiting for their worker process")
+        # ======== Workers finish the updates they already received, then exit ========
+        processes = [worker.process for worker in self.workers
+                     if worker.process is not None and worker.process.returncode is None]
+        for process in processes:
+            process.terminate()
+        try:
+            await asyncio.wait_for(asyncio.gather(*(process.wait() for process in processes)), self.stop_timeout)
+        except asyncio.TimeoutError:
+            for process in processes:
+                if process.returncode is None:
+                    process.kill()
+        for task in self._supervisors:
+            task.cancel()
+        await asyncio.gather(*self._supervisors, return_exceptions=True)
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        # ======== The ingress has no handlers, the worker handles the update ========
+        coroutine.close()
+        if not isinstance(update, Update):
+            return
+        line = json.dumps(update.to_dict(), ensure_ascii=False).encode() + b"\n"
+        await self.route(PerChatUpdateProcessor.chat_key(update), line)
+
+    async def route(self, key: Optional[Hashable], line: bytes) -> None:
+        """
+        Sends the line to the worker owning the key, or holds it until that worker is back.
+        """
+        worker = self._dispatch(key, line)
+        if worker is None:
+            return
+        try:
+            # ======== Backpressure: a worker that does not keep up slows the ingress down ========
+            await worker.writer.drain()
+        except (ConnectionError, OSError) as e:
+            logger.warning(f"Sending an update to worker {worker.index} failed: {e}")
+            self._disconnect(worker)
+
+    def signal_workers(self, signum: int) -> None:
+        """
+        Sends the signal to the running worker processes (e.g. SIGHUP to reload their configuration).
+        """
+        for worker in self.workers:
+            if worker.process is not None and worker.process.returncode is None:
+                worker.process.send_signal(signum)
+
+    def stats(self) -> Dict[str, float]:
+        stats = {"workers_connected": sum(worker.writer is not None for worker in self.workers),
+                 "workers_in_ring": len(self.ring.nodes), "workers": len(self.workers),
+                 "held_updates": self.held_updates}
+        for worker in self.workers:
+            stats[f"worker_{worker.index}_routed"] = worker.routed
+            stats[f"worker_{worker.index}_restarts"] = worker.restarts
+        return stats
+
+    def _dispatch(self, key: Optional[Hashable], line: bytes) -> Optional[_Worker]:
+        # ======== Synchronous, so the lines of a chat are written (or held) in the order they come ========
+        worker = self.workers[self.ring.get(key if key is not None else "")]
+        if worker.writer is None:
+            worker.held.append((key, line))
+            return None
+        try:
+            worker.writer.write(line)
+        except (ConnectionError, OSError, RuntimeError) as e:
+            logger.warning(f"Sending an update to worker {worker.index} failed: {e}")
+            self._disconnect(worker)
+            worker.held.append((key, line))
+            return None
+        worker.routed += 1
+        return worker
+
+    async def _supervise(self, worker: _Worker) -> None:
+        while not self._stopping:
+            if os.path.exists(worker.socket_path):
+                os.unlink(worker.socket_path)
+            worker.process = await asyncio.create_subprocess_exec(
+                *self.command(worker.index, worker.socket_path),
+                env={**os.environ, **(self.env(worker.index) if self.env else {})}
+            )
+            if await self._connect(worker):
+                logger.info(f"Worker {worker.index} (pid {worker.process.pid}) is connected")
+            returncode = await worker.process.wait()
+            self._disconnect(worker)
+            if self._stopping:
+                return
+            worker.restarts += 1
+            logger.warning(f"Worker {worker.index} exited with {returncode}, restarting in {self.restart_backoff}s")
+            await asyncio.sleep(self.restart_backoff)
+
+    async def _connect(self, worker: _Worker) -> bool:
+        # ======== The worker accepts connections once its application is started ========
+        while worker.process.returncode is None and not self._stopping:
+            try:
+                reader, writer = await asyncio.open_unix_connection(worker.socket_path, limit=STREAM_LIMIT)
+            except (FileNotFoundError, ConnectionRefusedError):
+                await asyncio.sleep(0.1)
+                continue
+            if worker.evict_timer is not None:
+                worker.evict_timer.cancel()
+                worker.evict_timer = None
+            if worker.index not in self.ring.nodes:
+                self.ring.add(worker.index)
+            # ======== The held updates go first, written at once so that no newer update overtakes them ========
+            held, worker.held = worker.held, []
+            for _, line in held:
+                writer.write(line)
+            worker.routed += len(held)
+            worker.writer = writer
+            asyncio.create_task(self._watch(worker, reader, writer))
+            return True
+        return False
+
+    async def _watch(self, worker: _Worker, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # ======== A stopping worker says so first, the next updates of its chats wait for the restart ========
+        try:
+            await reader.readline()
+        except (ConnectionError, OSError):
+            pass
+        if worker.writer is writer:
+            logger.info(f"Worker {worker.index} is stopping")
+            self._disconnect(worker)
+
+    def _disconnect(self, worker: _Worker) -> None:
+        if worker.writer is not None:
+            # ======== Closing flushes the lines already written, the worker reads them before it stops ========
+            worker.writer.close()
+            worker.writer = None
+        if not self._stopping and worker.evict_timer is None:
+            self._schedule_eviction(worker)
+
+    def _schedule_eviction(self, worker: _Worker) -> None:
+        worker.evict_timer = asyncio.get_running_loop().call_later(self.hold_timeout, self._evict, worker)
+
+    def _evict(self, worker: _Worker) -> None:
+        worker.evict_timer = None
+        if worker.writer is not None or self.ring.nodes == {worker.index}:
+            return
+        logger.warning(f"Worker {worker.index} is not back after {self.hold_timeout}s, moving its chats")
+        self.ring.remove(worker.index)
+        held, worker.held = worker.held, []
+        for key, line in held:
+            self._dispatch(key, line)
+
+
+def run_worker(application: Application, socket_path: str) -> None:
+    """
+    Runs the application as a worker process: the updates come from the ingress process through the unix socket.
+    """
+    asyncio.run(_serve_worker(application, socket_path))
+
+
+async def _serve_worker(application: Application, socket_path: str) -> None:
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+    connections: Dict[asyncio.StreamWriter, asyncio.Task] = {}
+
+    async def receive(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        connections[writer] = asyncio.current_task()
+        try:
+            while line := await reader.readline():
+                try:
+                    update = Update.de_json(json.loads(line), application.bot)
+                except Exception as e:
+                    logger.error(f"Invalid update received from the ingress: {e}")
+                    continue
+                await application.update_queue.put(update)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            connections.pop(writer, None)
+            writer.close()
+
+    async def watch_parent(parent: int) -> None:
+        # ======== Do not outlive a killed ingress process ========
+        while os.getppid() == parent:
+            await asyncio.sleep(1)
+        stop.set()
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    server = await asyncio.start_unix_server(receive, path=socket_path, limit=STREAM_LIMIT)
+    parent_watch = asyncio.create_task(watch_parent(os.getppid()))
+    logger.info(f"Worker {os.getpid()} serving updates on {socket_path}")
+    try:
+        await stop.wait()
+    finally:
+        # ======== Leave the ring first, read what the ingress sent until then, then finish the updates ========
+        server.close()
+        for writer in connections:
+            writer.write(LEAVING)
+        if connections:
+            await asyncio.wait(list(connections.values()), timeout=LEAVE_TIMEOUT)
+        for writer in list(connections):
+            writer.close()
+        parent_watch.cancel()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def worker_command(script: str) -> Callable[[int, str], List[str]]:
+    """
+    :param script: Entry point that accepts --mode worker --shard <index> --socket <path>
+    :return: Command builder for ShardRouter
+    """
+    return lambda index, socket_path: [sys.executable, script, "--mode", "worker",
+                                       "--shard", str(index), "--socket", socket_path]
@@ -0,0 +1,147 @@
+import time
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, Optional
+from telegram import Message
+from telegram.constants import ChatAction
+from telegram.error import BadRequest
+
+from src.apps.metrics.instrumentation import STAGE_LATENCY
+from src.apps.telegram.send_scheduler import send_priority, BACKGROUND, REPLY
+
+
+# ======== Logging configuration ========
+logger = logging.getLogger(__name__)
+
+LEAD_MARKER = "LEAD_CAPTURED"
+
+# ======== Telegram shows a chat action for about 5 seconds ========
+TYPING_REFRESH_INTERVAL = 4.5
+
+
+def visible_text(text: str) -> str:
+    """
+    Hides the LEAD_CAPTURED marker while the answer is still streamed, including a marker cut in the middle.
+    """
+    text = text.split(LEAD_MARKER, 1)[0]
+    for length in range(min(len(LEAD_MARKER) - 1, len(text)), 0, -1):
+        if text.endswith(LEAD_MARKER[:length]):
+            return text[:-length].rstrip()
+    return text.rstrip()
+
+
+class StreamingReply:
+    """
+    Shows a streamed RAG answer to the client while it is generated.
+
+    The typing indicator is shown right away and kept alive until the first piece of the answer arrives,
+    which is sent as a reply. Later pieces edit that reply at most every `edit_interval` seconds, and
+    `finish` puts the final (post-processed) text into it. When the answer cannot be completed, `replace`
+    turns a partly shown answer into another text, so the client is not left with a truncated answer.
+    """
+
+    def __init__(self, reply_to: Message, edit_interval: float, company: str):
+        self.reply_to = reply_to
+        self.edit_interval = edit_interval
+        self.company = company
+        self.message: Optional[Message] = None
+        self.finished = False
+        self._shown_text = ""
+        self._last_edit = 0.0
+        self._started = time.perf_counter()
+        self._typing: Optional[asyncio.Task] = None
+
+    async def consume(self, stream: AsyncIterator[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Shows the pieces of the stream progressively.
+        :param stream: stream_rag_model_endpoint(request)
+        :return: The final RAG response ({"response": ..., "additional_data": ...})
+        """
+        self._typing = asyncio.create_task(self._keep_typing())
+        text = ""
+        try:
+            async for event in stream:
+                if "response" in event:
+                    return event
+                text += event["delta"]
+                await self._show(text)
+        finally:
+            self._stop_typing()
+        raise RuntimeError("RAG stream ended without a final response")
+
+    async def finish(self, text: str) -> None:
+        """
+        Puts the final text into the reply, or sends it if nothing was shown yet.
+        """
+        self._stop_typing()
+        if self.message is None:
+            self.message = await self.reply_to.reply_text(text)
+            self._observe_first_message()
+        elif text != self._shown_text:
+            await self._edit(text, REPLY)
+        self.finished = True
+
+    async def replace(self, text: str) -> bool:
+        """
+        Puts `text` (e.g. a placeholder) in place of the partly shown answer of a failed stream.
+        :return: True if the client has a reply already: the replaced one, or the final answer after finish().
+            False if nothing was shown yet, or the partial answer could not be edited
+        """
+        self._stop_typing()
+        if self.finished:
+            return True
+        if self.message is None:
+            return False
+        return await self._edit(text, REPLY)
+
+    async def _show(self, text: str) -> None:
+        text = visible_text(text)
+        if not text:
+            return
+        if self.message is None:
+            self._stop_typing()
+            self.message = await self.reply_to.reply_text(text)
+            self._shown_text = text
+            self._last_edit = time.monotonic()
+            self._observe_first_message()
+        elif time.monotonic() - self._last_edit >= self.edit_interval and text != self._shown_text:
+            await self._edit(text, BACKGROUND)
+
+    async def _edit(self, text: str, priority: int) -> bool:
+        self._last_edit = time.monotonic()
+        try:
+            # ======== PTB has no business_connection_id for edits yet, pass it to the Bot API directly ========
+            api_kwargs = {"business_connection_id": self.reply_to.business_connection_id} \
+                if self.reply_to.business_connection_id else None
+            # ======== Intermediate edits give way to the replies of the other chats, the final one does not ========
+            bot = self.message.get_bot()
+            await bot.edit_message_text(
+                text, chat_id=self.message.chat_id, message_id=self.message.message_id, api_kwargs=api_kwargs,
+                **send_priority(bot, priority)
+            )
+            self._shown_text = text
+            return True
+        except BadRequest as e:
+            # ======== e.g. "message is not modified", the next edit catches up ========
+            logger.warning(f"Editing the streamed reply failed: {e}")
+            return False
+
+    async def _keep_typing(self) -> None:
+        while True:
+            try:
+                await self.reply_to.get_bot().send_chat_action(
+                    self.reply_to.chat_id, ChatAction.TYPING,
+                    business_connection_id=self.reply_to.business_connection_id
+                )
+            except Exception as e:
+                logger.warning(f"Sending the typing indicator failed: {e}")
+                return
+            await asyncio.sleep(TYPING_REFRESH_INTERVAL)
+
+    def _stop_typing(self) -> None:
+        if self._typing is not None:
+            self._typing.cancel()
+            self._typing = None
+
+    def _observe_first_message(self) -> None:
+        STAGE_LATENCY.labels("time_to_first_message", self.company).observe(time.perf_counter() - self._started)
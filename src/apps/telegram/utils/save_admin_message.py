@@ -1,9 +1,5 @@
 from src.apps.telegram.bot import Update
-from src.apps.mongodb.connection import get_collection
-
-
-# ======== Get MongoDB collection ========
-conversation_collection = get_collection("telegram_conversations")
+from src.apps.mongodb.repository import conversation_repository
 
 
 async def save_message_to_history(update: Update, client_username):
@@ -29,16 +25,7 @@ async def save_message_to_history(update: Update, client_username):
     # ======== Get the admin_message ========
     admin_message = update.business_message.text
 
-    # ======== Append the message to conversation_history ========
-    conversation = conversation_collection.find_one({"username": client_username})
-    history = conversation.get("history", []) if conversation else []
-    history.append({"role": "admin", "content": admin_message})
-
-    # ======== Update or insert the conversation in MongoDB ========
-    conversation_collection.update_one(
-        {"username":client_username},  # Query to find the document by username (business_username)
-        {"$set":{"history":history}},  # Set the 'history' field to the current history value
-        upsert=True  # If no document is found with the username, insert a new one (update + insert)
-    )
+    # ======== Append the message to conversation_history (update or insert the conversation in MongoDB) ========
+    await conversation_repository.append_messages(client_username, [{"role": "admin", "content": admin_message}])
 
 
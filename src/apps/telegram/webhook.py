@@ -0,0 +1,104 @@
+import secrets
+import logging
+from contextlib import asynccontextmanager
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from prometheus_client import make_asgi_app
+from telegram import Update
+from telegram.ext import Application
+
+from src.config import settings
+from src.apps.mongodb.connection import is_ready
+
+
+# ======== Logging configuration ========
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def create_webhook_app(application: Application, webhook_url: str, secret_token: str,
+                       path: str = settings.WEBHOOK_PATH) -> FastAPI:
+    """
+    Builds the ASGI app serving the Telegram updates of the application through a webhook.
+
+    The app owns the application lifecycle (initialize, set the webhook, start, stop, shutdown together with
+    the post_* hooks). Updates are validated with the secret token, put into the application's update queue
+    and acknowledged right away, the handlers run in the background. Also serves /healthz, /readyz and /metrics.
+    :param application: Application built without an Updater
+    :param webhook_url: Full public URL of the webhook endpoint
+    :param secret_token: Secret token Telegram sends with every update
+    :param path: Path of the webhook endpoint
+    :return: FastAPI app
+    """
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.bot.set_webhook(url=webhook_url, secret_token=secret_token,
+                                          allowed_updates=Update.ALL_TYPES)
+        await application.start()
+        logger.info(f"Serving Telegram updates through the webhook {webhook_url}")
+        try:
+            yield
+        finally:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+            await application.shutdown()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+
+    app = FastAPI(lifespan=lifespan, docs_url=None, redoc_url=None, openapi_url=None)
+    expected_token = secret_token.encode()
+
+    @app.post(path)
+    async def telegram_webhook(request: Request) -> Response:
+        # ======== Only Telegram knows the secret token ========
+        received_token = request.headers.get(SECRET_TOKEN_HEADER, "").encode()
+        if not secrets.compare_digest(received_token, expected_token):
+            return Response(status_code=403)
+
+        try:
+            update = Update.de_json(await request.json(), application.bot)
+        except Exception as e:
+            logger.error(f"Invalid update received through the webhook: {e}")
+            return Response(status_code=400)
+
+        # ======== Ack right away, the application processes the update in the background ========
+        await application.update_queue.put(update)
+        return Response(status_code=200)
+
+    if settings.METRICS_ENABLED:
+        app.mount("/metrics", make_asgi_app())
+
+    @app.get("/healthz")
+    async def health() -> dict:
+        return {"status": "ok"}
+
+    @app.get("/readyz")
+    async def readiness() -> Response:
+        status_code = 200 if application.running and is_ready() else 503
+        return Response(status_code=status_code)
+
+    return app
+
+
+def run_webhook(application: Application) -> None:
+    """
+    Serves the application through a webhook with uvicorn on uvloop and httptools until it is stopped.
+    """
+    if not settings.WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL must be set to run the bot in webhook mode")
+    # ======== Every instance registers the webhook, a token made up per process would lock the others out ========
+    if not settings.WEBHOOK_SECRET_TOKEN:
+        raise ValueError("WEBHOOK_SECRET_TOKEN must be set to run the bot in webhook mode")
+
+    secret_token = settings.WEBHOOK_SECRET_TOKEN
+    webhook_url = settings.WEBHOOK_URL.rstrip("/") + settings.WEBHOOK_PATH
+
+    app = create_webhook_app(application, webhook_url, secret_token)
+    uvicorn.run(app, host=settings.WEBHOOK_HOST, port=settings.WEBHOOK_PORT, loop="uvloop", http="httptools")
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+from cachetools import TTLCache
+
+from src.config import settings
+from src.apps.mongodb.connection import get_collection
+from src.apps.mongodb.repository import run_blocking
+
+
+# ======== Logging configuration ========
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT_ID = "default"
+
+# ======== Cached for the business connections whose tenant document is invalid ========
+_UNSERVED = object()
+
+
+class Tenant(NamedTuple):
+    """
+    Configuration of a business account served by the bot.
+    `rag_urls` replaces the default RAG replicas when not empty. `amocrm` holds the client_id, client_secret,
+    subdomain, redirect_uri and auth_code of the tenant's amoCRM account, None means the credentials of the
+    environment for the default tenant and no lead export for the others.
+    """
+    id: str
+    company_name: str
+    admin_username: Optional[str] = None
+    rag_urls: Tuple[str, ...] = ()
+    amocrm: Optional[Dict[str, str]] = None
+
+    @property
+    def is_default(self) -> bool:
+        return self.id == DEFAULT_TENANT_ID
+
+    def chat_key(self, client_username) -> str:
+        """
+        :return: Key of the client chat in the history, the coalescer and the queues. Two tenants may talk to the
+            same client, so the username is prefixed by the tenant id (except for the default tenant, whose
+            conversations were stored before the tenants existed)
+        """
+        return client_username if self.is_default else f"{self.id}:{client_username}"
+
+
+def tenant_from_document(document: Dict[str, Any], default: Tenant) -> Tenant:
+    """
+    :raises ValueError: The document has no admin_username, the messages of the business owner could not be
+        told apart from the ones of the clients
+    """
+    tenant_id = str(document.get("tenant_id") or document["_id"])
+    if not document.get("admin_username"):
+        raise ValueError(f"Tenant {tenant_id} has no admin_username")
+    return Tenant(
+        id=tenant_id,
+        company_name=document.get("company_name") or default.company_name,
+        admin_username=document.get("admin_username"),
+        rag_urls=tuple(document.get("rag_urls") or ()),
+        amocrm=document.get("amocrm")
+    )
+
+
+class TenantRegistry:
+    """
+    Resolves the tenant of a business connection from the tenants collection, through an in-process cache.
+
+    A tenant document looks like {"tenant_id": "spineup", "business_connection_ids": [...], "company_name": ...,
+    "admin_username": "@spineup", "rag_urls": [...], "amocrm": {...}}: a business account that reconnects the bot
+    gets a new connection id, which is added to the list of the same tenant. admin_username is required, the
+    connections of a tenant document without it are not served. Resolved connections (unknown ones map to
+    the default tenant) stay cached for `ttl` seconds, so edits of the collection are picked up after `ttl`
+    seconds, or right away after reload(). Concurrent lookups of a connection share one read, and while MongoDB
+    is unavailable the last known tenant of the connection is used. A connection that was never read is not
+    served until MongoDB answers, rather than being answered in the name of the default tenant.
+    """
+
+    def __init__(self, collection, default: Tenant, ttl: float, maxsize: int):
+        self.collection = collection
+        self.default = default
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._last_known: Dict[str, Optional[Tenant]] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    async def ensure_indexes(self) -> None:
+        await run_blocking(self.collection.create_index, "business_connection_ids")
+
+    async def get(self, business_connection_id: Optional[str]) -> Optional[Tenant]:
+        """
+        :param business_connection_id: business_connection_id of the update, None outside of business chats
+        :return: Tenant of the business connection, the default tenant for unknown connections, None when the
+            tenant document is invalid, or cannot be read and was never read before, and the connection must
+            not be served
+        """
+        if not business_connection_id:
+            return self.default
+        tenant = self._cache.get(business_connection_id)
+        if tenant is not None:
+            self.hits += 1
+            return None if tenant is _UNSERVED else tenant
+        self.misses += 1
+
+        loading = self._loading.get(business_connection_id)
+        if loading is not None:
+            return await asyncio.shield(loading)
+        loading = self._loading[business_connection_id] = asyncio.get_running_loop().create_future()
+        try:
+            tenant = await self._load(business_connection_id)
+        except BaseException:
+            loading.cancel()
+            raise
+        finally:
+            del self._loading[business_connection_id]
+        loading.set_result(tenant)
+        return tenant
+
+    def reload(self) -> None:
+        """
+        Forgets the cached tenants, the next update of every connection reads its tenant again.
+        """
+        self._cache.clear()
+        self.reloads += 1
+        logger.info("Tenant cache cleared, the tenants are read again")
+
+    def stats(self) -> Dict[str, float]:
+        return {"hits": self.hits, "misses": self.misses, "reloads": self.reloads, "entries": len(self._cache)}
+
+    async def _load(self, business_connection_id: str) -> Optional[Tenant]:
+        try:
+            document = await run_blocking(self.collection.find_one, {"business_connection_ids": business_connection_id})
+        except Exception as e:
+            # ======== Not cached, the next update of the connection reads its tenant again ========
+            logger.error(f"Reading the tenant of the business connection {business_connection_id} failed: {e}")
+            return self._last_known.get(business_connection_id)
+
+        if document is None:
+            logger.warning(f"Business connection {business_connection_id} has no tenant, serving it as the default one")
+            tenant = self.default
+        else:
+            try:
+                tenant = tenant_from_document(document, self.default)
+            except ValueError as e:
+                logger.error(f"{e}, the business connection {business_connection_id} is not served")
+                tenant = None
+        self._cache[business_connection_id] = _UNSERVED if tenant is None else tenant
+        self._last_known[business_connection_id] = tenant
+        return tenant
+
+
+# ======== Tenant of the environment settings, the only one when TENANTS_ENABLED is false ========
+default_tenant = Tenant(
+    id=DEFAULT_TENANT_ID,
+    company_name=settings.COMPANY_NAME,
+    admin_username=settings.BUSINESS_USERNAME
+)
+
+# ======== Registry of the tenants, shared by the bot handlers and the background workers ========
+tenant_registry = TenantRegistry(
+    get_collection(settings.TENANTS_COLLECTION),
+    default=default_tenant,
+    ttl=settings.TENANT_CACHE_TTL,
+    maxsize=settings.TENANT_CACHE_MAX_ENTRIES
+) if settings.TENANTS_ENABLED else None
+
+
+async def get_tenant(business_connection_id: Optional[str]) -> Optional[Tenant]:
+    """
+    :return: Tenant of the business connection, the default tenant when the registry is disabled,
+        None when the connection must not be served
+    """
+    if tenant_registry is None:
+        return default_tenant
+    return await tenant_registry.get(business_connection_id)
@@ -1,26 +1,250 @@
 import os
 import sys
+import signal
+import asyncio
+import argparse
 from telegram.ext import (Application, MessageHandler, Updater, filters, )
+from prometheus_client import start_http_server
 
 # ======== Add the project root directory to the Python path ========
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
-from src.apps.telegram.bot import handle_message, error_handler
+from src.config import settings
+from src.apps.telegram.bot import handle_message, error_handler, message_coalescer, rag_retry_queue
+from src.apps.telegram.dispatcher import PerChatUpdateProcessor
+from src.apps.telegram.send_scheduler import send_scheduler
+from src.apps.telegram.sharding import ShardRouter, run_worker, worker_command
+from src.apps.telegram.webhook import run_webhook
+from src.apps.rag.rag_model_endpoint import close_rag_client, rag_balancer
+from src.apps.rag.balancer import CLOSED
+from src.apps.mongodb.repository import shutdown_executor
+from src.apps.mongodb.connection import wait_until_ready, close_client
+from src.apps.mongodb.repository import conversation_repository
+from src.apps.rag.response_cache import rag_response_cache
+from src.apps.metrics.instrumentation import QUEUE_DEPTH, RAG_ENDPOINT_IN_FLIGHT, RAG_ENDPOINT_CIRCUIT_OPEN, register_stats
+from src.apps.amocrm.lead_queue import lead_export_queue
+from src.apps.tenants.registry import tenant_registry
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
-def main() -> None:
-    print("Starting bot...")
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+# ======== Background tasks started with the bot ========
+_background_tasks = set()
+
+
+def start_background_task(coroutine) -> None:
+    task = asyncio.create_task(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def prepare_database() -> None:
+    await wait_until_ready()
+    # ======== Indexes of the conversation history, a no-op when they exist ========
+    try:
+        await conversation_repository.ensure_indexes()
+    except Exception as e:
+        print(f"Creating the conversation history indexes failed: {e}")
+    if tenant_registry is not None:
+        try:
+            await tenant_registry.ensure_indexes()
+        except Exception as e:
+            print(f"Creating the tenant indexes failed: {e}")
+
+
+async def on_startup(application: Application) -> None:
+    # ======== Check MongoDB in the background, the bot starts receiving updates meanwhile ========
+    start_background_task(prepare_database())
+
+    # ======== SIGHUP reloads the tenants without a restart ========
+    if tenant_registry is not None:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, tenant_registry.reload)
+
+    # ======== Start the background workers ========
+    if lead_export_queue is not None:
+        lead_export_queue.start()
+    if rag_retry_queue is not None:
+        rag_retry_queue.start(application.bot)
+
+
+async def on_stop(application: Application) -> None:
+    for task in _background_tasks:
+        task.cancel()
+    # ======== Answer the bursts still waiting for their quiet window while the bot can send ========
+    if message_coalescer is not None:
+        await message_coalescer.shutdown()
+    if lead_export_queue is not None:
+        await lead_export_queue.stop()
+    if rag_retry_queue is not None:
+        await rag_retry_queue.stop()
+
+
+async def on_shutdown(application: Application) -> None:
+    # ======== Release the pooled connections of the shared clients ========
+    await close_rag_client()
+    shutdown_executor()
+    close_client()
+
+
+async def on_ingress_startup(application: Application) -> None:
+    # ======== /readyz of the webhook ingress reports MongoDB as well ========
+    start_background_task(wait_until_ready())
+    # ======== The tenants live in the worker processes, pass SIGHUP on to them ========
+    if tenant_registry is not None:
+        router = application.update_processor
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, router.signal_workers, signal.SIGHUP)
+
+
+async def on_ingress_stop(application: Application) -> None:
+    for task in _background_tasks:
+        task.cancel()
+
+
+async def on_ingress_shutdown(application: Application) -> None:
+    close_client()
+
+
+def register_metrics(application: Application) -> None:
+    # ======== Queue depths and the counters of the caches, read on every scrape ========
+    update_processor = application.update_processor
+    if isinstance(update_processor, PerChatUpdateProcessor):
+        QUEUE_DEPTH.labels("chat_updates").set_function(lambda: update_processor.pending_updates)
+        register_stats("bot_chat_updates", update_processor.stats, "Per-chat update dispatching")
+    QUEUE_DEPTH.labels("telegram_updates").set_function(application.update_queue.qsize)
+    if message_coalescer is not None:
+        register_stats("bot_coalescer", message_coalescer.stats, "Message burst coalescing")
+    if conversation_repository.cache is not None:
+        register_stats("bot_conversation_cache", conversation_repository.cache.stats, "In-process conversation cache")
+    if rag_response_cache is not None:
+        register_stats("bot_rag_response_cache", rag_response_cache.stats, "RAG response cache")
+    register_stats("bot_rag_balancer", rag_balancer.stats, "RAG replicas load balancing")
+    if tenant_registry is not None:
+        register_stats("bot_tenant_registry", tenant_registry.stats, "Tenant configuration cache")
+    if send_scheduler is not None:
+        QUEUE_DEPTH.labels("telegram_sends").set_function(lambda: send_scheduler.pending)
+        register_stats("bot_send_scheduler", send_scheduler.stats, "Outbound Telegram send scheduler")
+    for endpoint in rag_balancer.endpoints:
+        RAG_ENDPOINT_IN_FLIGHT.labels(endpoint.url).set_function(lambda e=endpoint: e.in_flight)
+        RAG_ENDPOINT_CIRCUIT_OPEN.labels(endpoint.url).set_function(lambda e=endpoint: e.breaker.state != CLOSED)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Telegram business bot")
+    parser.add_argument("--mode", choices=("polling", "webhook", "worker"), default=settings.BOT_MODE,
+                        help="Receive updates with long polling or through a webhook (default: BOT_MODE), "
+                             "'worker' is used by the ingress process for its worker processes")
+    parser.add_argument("--workers", type=int, default=settings.SHARD_WORKERS,
+                        help="Worker processes the chats are sharded across (default: SHARD_WORKERS)")
+    parser.add_argument("--shard", type=int, default=0, help="Index of the worker process")
+    parser.add_argument("--socket", help="Unix socket the worker process receives its updates on")
+    return parser.parse_args()
+
+
+def worker_env(workers: int):
+    """
+    :return: Environment overrides of a worker process, the limits shared by the bot are split between the workers
+    """
+    def env(index: int):
+        return {
+            "SEND_GLOBAL_RATE": str(settings.SEND_GLOBAL_RATE / workers),
+            "SEND_GLOBAL_BURST": str(max(settings.SEND_GLOBAL_BURST // workers, 1)),
+            "METRICS_PORT": str(settings.METRICS_PORT + 1 + index),
+        }
+    return env
+
+
+def build_application(mode: str) -> Application:
+    builder = (Application.builder().token(TELEGRAM_BOT_TOKEN)
+               .post_init(on_startup).post_stop(on_stop).post_shutdown(on_shutdown))
+
+    # ======== Local Bot API server (or a stub in the benchmarks) instead of api.telegram.org ========
+    if settings.TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(settings.TELEGRAM_API_BASE_URL)
+
+    # ======== The webhook app (or the ingress process, for a worker) feeds the update queue itself ========
+    if mode in ('webhook', 'worker'):
+        builder = builder.updater(None)
+
+    # ======== Handle different chats concurrently, keeping the order of updates inside a chat ========
+    if settings.UPDATE_DISPATCH_MODE == 'per_chat':
+        builder = builder.concurrent_updates(PerChatUpdateProcessor(
+            max_concurrent_chats=settings.MAX_CONCURRENT_CHATS,
+            chat_queue_size=settings.CHAT_QUEUE_SIZE,
+            idle_timeout=settings.CHAT_IDLE_TIMEOUT
+        ))
+
+    # ======== Every outbound message goes through the send scheduler (flood limits, priorities) ========
+    if send_scheduler is not None:
+        builder = builder.rate_limiter(send_scheduler)
+    application = builder.build()
 
     # ======== Add other handlers ========
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
     application.add_error_handler(error_handler)
 
+    if settings.METRICS_ENABLED:
+        register_metrics(application)
+    return application
+
+
+def build_ingress_application(mode: str, workers: int) -> Application:
+    # ======== No handlers here, every update goes to the worker process owning its chat ========
+    router = ShardRouter(
+        workers=workers,
+        command=worker_command(os.path.abspath(__file__)),
+        socket_dir=settings.SHARD_SOCKET_DIR,
+        virtual_nodes=settings.SHARD_VIRTUAL_NODES,
+        restart_backoff=settings.SHARD_RESTART_BACKOFF,
+        hold_timeout=settings.SHARD_HOLD_TIMEOUT,
+        stop_timeout=settings.SHARD_STOP_TIMEOUT,
+        env=worker_env(workers)
+    )
+    builder = (Application.builder().token(TELEGRAM_BOT_TOKEN).concurrent_updates(router)
+               .post_init(on_ingress_startup).post_stop(on_ingress_stop).post_shutdown(on_ingress_shutdown))
+    if settings.TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(settings.TELEGRAM_API_BASE_URL)
+    if mode == 'webhook':
+        builder = builder.updater(None)
+    application = builder.build()
+
+    if settings.METRICS_ENABLED:
+        QUEUE_DEPTH.labels("telegram_updates").set_function(application.update_queue.qsize)
+        QUEUE_DEPTH.labels("held_updates").set_function(lambda: router.held_updates)
+        register_stats("bot_shard_router", router.stats, "Sharding of the chats across the worker processes")
+    return application
+
+
+def main() -> None:
+    args = parse_args()
+
+    if args.mode == 'worker':
+        print(f"Starting worker {args.shard}...")
+        application = build_application(args.mode)
+        if settings.METRICS_ENABLED:
+            start_http_server(settings.METRICS_PORT)
+        run_worker(application, args.socket)
+        return
+
+    print("Starting bot...")
+    # ======== --mode webhook without BOT_MODE=webhook: the cache default of webhook mode applies as well ========
+    if args.mode == 'webhook' and os.getenv('CONVERSATION_CACHE_ENABLED') is None:
+        conversation_repository.cache = None
+    if args.workers > 1:
+        print(f"Sharding the chats across {args.workers} worker processes...")
+        application = build_ingress_application(args.mode, args.workers)
+    else:
+        application = build_application(args.mode)
+
     # ======== Start the bot ========
-    print("Starting Telegram bot polling...")
-    application.run_polling()
+    if args.mode == 'webhook':
+        print("Starting Telegram bot webhook...")
+        run_webhook(application)
+    else:
+        # ======== In webhook mode /metrics is served by the webhook app ========
+        if settings.METRICS_ENABLED:
+            start_http_server(settings.METRICS_PORT)
+        print("Starting Telegram bot polling...")
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
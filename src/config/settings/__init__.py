@@ -1,2 +1,7 @@
 from .base import *
-from .telegram_settings import *
\ No newline at end of file
+from .telegram_settings import *
+from .rag_settings import *
+from .history_settings import *
+from .amocrm_settings import *
+from .metrics_settings import *
+from .tenant_settings import *
\ No newline at end of file
@@ -0,0 +1,22 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# =============== amoCRM lead export Configurations ====================
+# Leads are exported in the background only when amoCRM credentials are configured (or come with the tenants)
+LEAD_EXPORT_ENABLED = os.getenv(
+    'LEAD_EXPORT_ENABLED',
+    'true' if os.getenv('CLIENT_ID') or os.getenv('TENANTS_ENABLED', 'false').lower() == 'true' else 'false'
+).lower() == 'true'
+LEAD_QUEUE_COLLECTION = os.getenv('LEAD_QUEUE_COLLECTION', 'amocrm_lead_queue')
+# Leads created with a single amoCRM request (the API accepts up to 250)
+LEAD_BATCH_SIZE = int(os.getenv('LEAD_BATCH_SIZE', 50))
+# Seconds between two checks of the queue when it is empty
+LEAD_POLL_INTERVAL = float(os.getenv('LEAD_POLL_INTERVAL', 10))
+LEAD_MAX_ATTEMPTS = int(os.getenv('LEAD_MAX_ATTEMPTS', 10))
+LEAD_RETRY_BACKOFF = float(os.getenv('LEAD_RETRY_BACKOFF', 30))
+LEAD_RETRY_MAX_BACKOFF = float(os.getenv('LEAD_RETRY_MAX_BACKOFF', 3600))
+# Days during which another lead with the same phone number is ignored, counted from the export of the first one.
+# A TTL index deletes the exported leads after that, changing it later needs the index to be modified (collMod)
+LEAD_DEDUP_WINDOW_DAYS = float(os.getenv('LEAD_DEDUP_WINDOW_DAYS', 7))
@@ -0,0 +1,56 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# =============== Conversation history Configurations ====================
+# Maximum number of messages kept in a conversation document, older ones are trimmed on every write
+HISTORY_MAX_MESSAGES = int(os.getenv('HISTORY_MAX_MESSAGES', 200))
+
+# Number of the most recent messages sent to the RAG model as conversation_history, older ones are summarized
+HISTORY_WINDOW = int(os.getenv('HISTORY_WINDOW', 10))
+
+# =============== History window and rolling summary Configurations ====================
+# Character budget of the conversation_history sent to the RAG model, summary included (about 4 characters per token)
+HISTORY_CHAR_BUDGET = int(os.getenv('HISTORY_CHAR_BUDGET', 6000))
+
+# Longer messages (pasted customer_info JSON, long admin messages) are cut to this many characters in the window
+HISTORY_MESSAGE_MAX_CHARS = int(os.getenv('HISTORY_MESSAGE_MAX_CHARS', 1500))
+
+# Messages older than the last HISTORY_WINDOW are folded into the rolling summary of the conversation
+# in batches of HISTORY_SUMMARY_BATCH messages (0 disables the summary)
+HISTORY_SUMMARY_BATCH = int(os.getenv('HISTORY_SUMMARY_BATCH', 6))
+
+# Maximum length of the rolling summary, the oldest lines are dropped first
+HISTORY_SUMMARY_MAX_CHARS = int(os.getenv('HISTORY_SUMMARY_MAX_CHARS', 1500))
+
+# Maximum length of the summary line of a single message
+HISTORY_SUMMARY_LINE_CHARS = int(os.getenv('HISTORY_SUMMARY_LINE_CHARS', 200))
+
+# =============== In-process conversation cache Configurations ====================
+# The cache is written through only by the process that handles the chat, it is correct when every chat is
+# handled by a single process (polling, or the sharded worker processes). Webhook instances behind a load
+# balancer share the chats and would serve each other stale windows, so it is off by default in webhook mode:
+# enable it there only with a single instance or a load balancer routing every chat to the same instance
+CONVERSATION_CACHE_ENABLED = os.getenv(
+    'CONVERSATION_CACHE_ENABLED', 'false' if os.getenv('BOT_MODE') == 'webhook' else 'true'
+).lower() == 'true'
+
+# Memory bound of the cache, in characters of cached message content (0 disables the cache)
+CONVERSATION_CACHE_MAX_CHARS = int(os.getenv('CONVERSATION_CACHE_MAX_CHARS', 8_000_000))
+
+# Seconds an idle chat stays in the cache
+CONVERSATION_CACHE_TTL = int(os.getenv('CONVERSATION_CACHE_TTL', 3600))
+
+# Number of the most recent messages cached per chat (covers the messages not folded into the summary yet)
+CONVERSATION_CACHE_WINDOW = int(os.getenv('CONVERSATION_CACHE_WINDOW', HISTORY_WINDOW + HISTORY_SUMMARY_BATCH))
+
+# =============== History storage layout Configurations ====================
+# 'document' keeps every chat as one telegram_conversations document with a history array,
+# 'messages' stores one document per message (migrate first: python -m src.apps.mongodb.migrations.split_history)
+HISTORY_STORAGE = os.getenv('HISTORY_STORAGE', 'document')
+HISTORY_MESSAGES_COLLECTION = os.getenv('HISTORY_MESSAGES_COLLECTION', 'telegram_messages')
+HISTORY_CHATS_COLLECTION = os.getenv('HISTORY_CHATS_COLLECTION', 'telegram_chats')
+# Days after which MongoDB deletes a stored message with a TTL index (0 keeps them forever, 'messages' layout only).
+# Changing it later needs the TTL index to be modified (collMod) or dropped first
+HISTORY_MESSAGE_TTL_DAYS = int(os.getenv('HISTORY_MESSAGE_TTL_DAYS', 0))
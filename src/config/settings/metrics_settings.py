@@ -0,0 +1,9 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# =============== Metrics Configurations ====================
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+# Port of the /metrics endpoint in polling mode, in webhook mode it is served by the webhook app
+METRICS_PORT = int(os.getenv('METRICS_PORT', 8888))
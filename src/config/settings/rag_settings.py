@@ -0,0 +1,65 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# =============== RAG Model HTTP client Configurations ====================
+RAG_CONNECT_TIMEOUT = float(os.getenv('RAG_CONNECT_TIMEOUT', 5))
+RAG_READ_TIMEOUT = float(os.getenv('RAG_READ_TIMEOUT', 60))
+RAG_WRITE_TIMEOUT = float(os.getenv('RAG_WRITE_TIMEOUT', 10))
+RAG_POOL_TIMEOUT = float(os.getenv('RAG_POOL_TIMEOUT', 10))
+
+# ======= Connection pool (keep-alive) limits ========
+RAG_MAX_CONNECTIONS = int(os.getenv('RAG_MAX_CONNECTIONS', 100))
+RAG_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('RAG_MAX_KEEPALIVE_CONNECTIONS', 20))
+RAG_KEEPALIVE_EXPIRY = float(os.getenv('RAG_KEEPALIVE_EXPIRY', 30))
+
+# ======= Maximum number of RAG requests in flight at the same time ========
+RAG_MAX_CONCURRENT_REQUESTS = int(os.getenv('RAG_MAX_CONCURRENT_REQUESTS', 50))
+
+# =============== RAG replicas Configurations ====================
+# Comma separated URLs of the RAG replicas, the single RAG_MODEL_URL when not set
+RAG_MODEL_URLS = [url.strip() for url in os.getenv('RAG_MODEL_URLS', '').split(',') if url.strip()]
+# Percentile of the recent latencies after which a hedged duplicate is sent to another replica (0 disables hedging)
+RAG_HEDGE_PERCENTILE = float(os.getenv('RAG_HEDGE_PERCENTILE', 95))
+# Lower bound of the hedge delay in seconds, also used until enough latencies were observed
+RAG_HEDGE_MIN_DELAY = float(os.getenv('RAG_HEDGE_MIN_DELAY', 2.0))
+# Consecutive failures after which the circuit breaker of a replica opens
+RAG_BREAKER_FAILURES = int(os.getenv('RAG_BREAKER_FAILURES', 5))
+# Seconds an open circuit waits before a single half-open probe request is let through
+RAG_BREAKER_RESET_TIMEOUT = float(os.getenv('RAG_BREAKER_RESET_TIMEOUT', 30))
+
+# =============== RAG response cache Configurations ====================
+# Maximum number of cached answers kept in memory (0 disables the cache)
+RAG_CACHE_MAX_ENTRIES = int(os.getenv('RAG_CACHE_MAX_ENTRIES', 2000))
+RAG_CACHE_TTL = int(os.getenv('RAG_CACHE_TTL', 3600))
+# Number of the last conversation messages that are part of the cache key
+RAG_CACHE_HISTORY_DEPTH = int(os.getenv('RAG_CACHE_HISTORY_DEPTH', 2))
+# Persistent tier in a MongoDB collection, shared between restarts and instances
+RAG_CACHE_PERSISTENT = os.getenv('RAG_CACHE_PERSISTENT', 'false').lower() == 'true'
+RAG_CACHE_COLLECTION = os.getenv('RAG_CACHE_COLLECTION', 'rag_response_cache')
+
+# =============== Streaming Configurations ====================
+# Stream the answer (chunked text or SSE) and show it progressively by editing the reply
+RAG_STREAMING = os.getenv('RAG_STREAMING', 'false').lower() == 'true'
+# Streaming endpoint of the RAG service, the regular one when not set
+RAG_STREAM_URL = os.getenv('RAG_STREAM_URL')
+# Minimum seconds between two edits of a streamed reply
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', 1.0))
+
+# =============== Retry queue of the failed RAG requests Configurations ====================
+# Failed queries are kept in a MongoDB collection and answered in the background once the RAG model recovers
+RAG_RETRY_ENABLED = os.getenv('RAG_RETRY_ENABLED', 'true').lower() == 'true'
+RAG_RETRY_COLLECTION = os.getenv('RAG_RETRY_COLLECTION', 'rag_retry_queue')
+RAG_RETRY_BATCH_SIZE = int(os.getenv('RAG_RETRY_BATCH_SIZE', 10))
+# Maximum retried RAG requests per second, so a recovering RAG model is not flooded with the backlog, 0 for no limit
+RAG_RETRY_RATE = float(os.getenv('RAG_RETRY_RATE', 2))
+# Seconds between two checks of an empty queue
+RAG_RETRY_POLL_INTERVAL = float(os.getenv('RAG_RETRY_POLL_INTERVAL', 5))
+RAG_RETRY_MAX_ATTEMPTS = int(os.getenv('RAG_RETRY_MAX_ATTEMPTS', 12))
+# Exponential backoff between the attempts of a query, in seconds
+RAG_RETRY_BACKOFF = float(os.getenv('RAG_RETRY_BACKOFF', 10))
+RAG_RETRY_MAX_BACKOFF = float(os.getenv('RAG_RETRY_MAX_BACKOFF', 900))
+# Days the answered and abandoned requests stay in the collection before a TTL index deletes them.
+# Changing it later needs the index to be modified (collMod)
+RAG_RETRY_RETENTION_DAYS = float(os.getenv('RAG_RETRY_RETENTION_DAYS', 7))
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -22,3 +23,61 @@ TELEGRAM_BOT_TOKEN = TELEGRAM_DEV_BOT_TOKEN if ENV == 'development' else TELEGRA
 TELEGRAM_BOT_USERNAME = DEV_BOT_USERNAME if ENV == 'development' else REVITE_BOT_USERNAME
 BUSINESS_USERNAME = DEV_BUSINESS_USERNAME if ENV == 'development' else BUSINESS_USERNAME
 COMPANY_NAME = DEV_COMPANY_NAME if ENV == 'development' else COMPANY_NAME
+
+# Base URL of the Bot API, e.g. a local Bot API server (api.telegram.org when not set)
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL')
+
+# =============== Update dispatching Configurations ====================
+# 'sequential' handles one update at a time, 'per_chat' handles different chats concurrently
+# while the updates of the same chat stay in order
+UPDATE_DISPATCH_MODE = os.getenv('UPDATE_DISPATCH_MODE', 'sequential')
+MAX_CONCURRENT_CHATS = int(os.getenv('MAX_CONCURRENT_CHATS', 64))
+# Updates of a chat queued while it is handled, as many more may wait for room and the next ones are dropped
+CHAT_QUEUE_SIZE = int(os.getenv('CHAT_QUEUE_SIZE', 16))
+CHAT_IDLE_TIMEOUT = float(os.getenv('CHAT_IDLE_TIMEOUT', 60))
+
+# =============== Message burst coalescing Configurations ====================
+# Seconds of silence after which a burst of client messages is answered at once (0 disables coalescing)
+COALESCE_QUIET_WINDOW = float(os.getenv('COALESCE_QUIET_WINDOW', 0))
+# Maximum seconds a burst waits after its first message, however chatty the client is
+COALESCE_MAX_WAIT = float(os.getenv('COALESCE_MAX_WAIT', 6))
+
+# =============== Serving mode Configurations ====================
+# 'polling' fetches updates with getUpdates, 'webhook' receives them through the ASGI app
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# Public base URL Telegram sends the updates to, e.g. https://bot.example.com
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+# Checked against the X-Telegram-Bot-Api-Secret-Token header, required in webhook mode and shared by all the
+# instances (1-256 characters of A-Z, a-z, 0-9, _ and -)
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8888))
+
+# =============== Outbound send scheduler Configurations ====================
+# Every message sent or edited by the bot goes through a scheduler that keeps to the Telegram flood limits
+SEND_SCHEDULER_ENABLED = os.getenv('SEND_SCHEDULER_ENABLED', 'true').lower() == 'true'
+# Messages per second over all the chats, and the burst allowed above that rate
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', 30))
+SEND_GLOBAL_BURST = int(os.getenv('SEND_GLOBAL_BURST', 30))
+# Messages per second in a single chat, and the burst allowed above that rate
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', 1))
+SEND_CHAT_BURST = int(os.getenv('SEND_CHAT_BURST', 3))
+# Times a request is sent again after a 429 (retry_after) before the error reaches the caller
+SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', 5))
+
+# =============== Horizontal sharding Configurations ====================
+# Worker processes handling the chats, > 1 makes this process an ingress that routes every update
+# to the worker owning its chat (consistent hash of the chat ID)
+SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', 1))
+# Directory of the unix sockets between the ingress and the workers
+SHARD_SOCKET_DIR = os.getenv('SHARD_SOCKET_DIR', os.path.join(tempfile.gettempdir(), 'revise-bot'))
+# Points of every worker on the hash ring, more points spread the chats more evenly
+SHARD_VIRTUAL_NODES = int(os.getenv('SHARD_VIRTUAL_NODES', 100))
+# Seconds before a worker that exited is started again
+SHARD_RESTART_BACKOFF = float(os.getenv('SHARD_RESTART_BACKOFF', 1.0))
+# Seconds the updates of a stopped worker wait for its restart before its chats move to the other workers
+SHARD_HOLD_TIMEOUT = float(os.getenv('SHARD_HOLD_TIMEOUT', 30))
+# Seconds the workers get to finish their updates on shutdown before they are killed
+SHARD_STOP_TIMEOUT = float(os.getenv('SHARD_STOP_TIMEOUT', 30))
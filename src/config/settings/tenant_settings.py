@@ -0,0 +1,17 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# =============== Multi-tenant Configurations ====================
+# Serve several business accounts from one process, the tenant of an update is resolved from its
+# business_connection_id in the tenants collection. Unknown connections are served as the default tenant
+# (COMPANY_NAME, BUSINESS_USERNAME, RAG_MODEL_URL and the amoCRM credentials of the environment)
+TENANTS_ENABLED = os.getenv('TENANTS_ENABLED', 'false').lower() == 'true'
+TENANTS_COLLECTION = os.getenv('TENANTS_COLLECTION', 'tenants')
+# Seconds a resolved tenant stays cached, edits of the tenants collection are picked up after that
+# (or right away on SIGHUP)
+TENANT_CACHE_TTL = float(os.getenv('TENANT_CACHE_TTL', 300))
+TENANT_CACHE_MAX_ENTRIES = int(os.getenv('TENANT_CACHE_MAX_ENTRIES', 10000))
+# Directory of the amoCRM tokens of the tenants, one sub-directory per amoCRM subdomain
+AMOCRM_TOKENS_DIR = os.getenv('AMOCRM_TOKENS_DIR', os.path.join(os.getcwd(), 'amocrm_tokens'))
@@ -0,0 +1,90 @@
+"""
+Fakes shared by the tests, no MongoDB server is needed.
+"""
+import copy
+import types
+import threading
+
+import pytest
+
+
+class FakeCollection:
+    """
+    Blocking stand-in for a pymongo collection of conversation documents, with the operations and update
+    operators used by ConversationRepository. Every call is counted in `calls`.
+    """
+
+    def __init__(self):
+        self.documents = []
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _matches(document, field, value) -> bool:
+        if isinstance(value, dict) and "$exists" in value:
+            return (field in document) == value["$exists"]
+        return document.get(field) == value
+
+    def _find(self, query):
+        return next((document for document in self.documents
+                     if all(self._matches(document, field, value) for field, value in query.items())), None)
+
+    @staticmethod
+    def _project(document, projection):
+        document = copy.deepcopy(document)
+        if not projection:
+            return document
+        if any(spec == 1 or isinstance(spec, dict) for spec in projection.values()):
+            document = {field: value for field, value in document.items() if field in projection or field == "_id"}
+        for field, spec in projection.items():
+            if spec == 0:
+                document.pop(field, None)
+            elif isinstance(spec, dict) and "$slice" in spec:
+                document[field] = document.get(field, [])[spec["$slice"]:]
+        return document
+
+    def _update(self, query, update, upsert):
+        document = self._find(query)
+        if document is None:
+            if not upsert:
+                return None
+            document = {field: value for field, value in query.items() if not isinstance(value, dict)}
+            self.documents.append(document)
+        for field, value in update.get("$set", {}).items():
+            document[field] = copy.deepcopy(value)
+        for field, value in update.get("$inc", {}).items():
+            document[field] = document.get(field, 0) + value
+        for field, spec in update.get("$push", {}).items():
+            values = document.get(field, []) + copy.deepcopy(list(spec["$each"]))
+            document[field] = values[spec["$slice"]:] if "$slice" in spec else values
+        return document
+
+    def create_index(self, keys, **kwargs):
+        return str(keys)
+
+    def find_one(self, query, projection=None):
+        with self._lock:
+            self.calls += 1
+            document = self._find(query)
+            return None if document is None else self._project(document, projection)
+
+    def update_one(self, query, update, upsert=False):
+        with self._lock:
+            self.calls += 1
+            document = self._update(query, update, upsert)
+            return types.SimpleNamespace(modified_count=int(document is not None))
+
+    def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=None):
+        # ======== Always returns the document after the update, like ReturnDocument.AFTER ========
+        with self._lock:
+            self.calls += 1
+            document = self._update(query, update, upsert)
+            return None if document is None else self._project(document, projection)
+
+
+@pytest.fixture
+def make_collection():
+    """
+    :return: Factory of empty fake collections
+    """
+    return FakeCollection
@@ -0,0 +1,76 @@
+"""
+The write-through conversation cache keeps the hot path of active chats off MongoDB.
+
+Run with:
+    pytest
+"""
+import asyncio
+
+from src.apps.mongodb.cache import ConversationCache
+from src.apps.mongodb.repository import ConversationRepository
+
+WINDOW = 10
+SUMMARY_BATCH = 6
+
+
+def make_repository(collection, cached: bool = True):
+    cache = ConversationCache(maxsize=1_000_000, ttl=3600, window=WINDOW + SUMMARY_BATCH) if cached else None
+    repository = ConversationRepository(collection, cache=cache, keep=WINDOW, summary_batch=SUMMARY_BATCH)
+
+    # ======== Window reads of the hot path, the fold reads of the summary are counted apart ========
+    repository.window_reads = 0
+    read_window = repository._read_window
+
+    async def counted_read_window(*args, **kwargs):
+        repository.window_reads += 1
+        return await read_window(*args, **kwargs)
+    repository._read_window = counted_read_window
+    return repository
+
+
+async def exchange(repository, username, turns: int, wait_for_folds: bool) -> None:
+    for turn in range(turns):
+        await repository.get_recent_conversation(username, WINDOW + SUMMARY_BATCH)
+        await repository.append_messages(username, [
+            {"role": "user", "content": f"question {turn}"},
+            {"role": "assistant", "content": f"answer {turn}"}
+        ])
+        if wait_for_folds:
+            await asyncio.gather(*repository._summarizing.values())
+        else:
+            await asyncio.sleep(0)
+    await asyncio.gather(*repository._summarizing.values())
+
+
+def test_hot_path_reads_drop_to_zero_after_the_first_message(make_collection):
+    async def run():
+        repository = make_repository(make_collection())
+        await asyncio.gather(*(exchange(repository, f"client_{n}", 20, wait_for_folds=True) for n in range(5)))
+        return repository
+
+    repository = asyncio.run(run())
+    # ======== One read per chat, the summary folds do not evict the active chats ========
+    assert repository.window_reads == 5
+    assert repository.cache.stats()["misses"] == 5
+
+
+def test_without_cache_every_message_reads_the_window(make_collection):
+    repository = make_repository(make_collection(), cached=False)
+    asyncio.run(exchange(repository, "client", 20, wait_for_folds=True))
+    assert repository.window_reads == 20
+
+
+def test_cached_window_matches_mongodb_after_summary_folds(make_collection):
+    for wait_for_folds in (True, False):
+        async def run():
+            repository = make_repository(make_collection())
+            await exchange(repository, "client", 37, wait_for_folds)
+            cached = await repository.get_recent_conversation("client", WINDOW + SUMMARY_BATCH)
+            stored = await ConversationRepository._read_window(repository, "client", WINDOW + SUMMARY_BATCH)
+            return repository, cached, stored
+
+        repository, cached, stored = asyncio.run(run())
+        assert repository.window_reads == 1
+        assert cached.summary and cached.summary == stored.summary
+        assert cached.unsummarized == stored.unsummarized
+        assert cached.unsummarized_history == stored.unsummarized_history
@@ -0,0 +1,69 @@
+"""
+The tenant registry never answers a business connection in the name of another tenant.
+
+Run with:
+    pytest
+"""
+import asyncio
+
+from src.apps.tenants.registry import Tenant, TenantRegistry
+
+DEFAULT = Tenant(id="default", company_name="Default", admin_username="@default")
+
+
+class TenantsCollection:
+    def __init__(self, documents):
+        self.documents = documents
+        self.available = True
+        self.reads = 0
+
+    def find_one(self, query):
+        self.reads += 1
+        if not self.available:
+            raise ConnectionError("MongoDB is unavailable")
+        return next((document for document in self.documents
+                     if query["business_connection_ids"] in document["business_connection_ids"]), None)
+
+
+def make_registry(documents=()):
+    collection = TenantsCollection(list(documents))
+    return collection, TenantRegistry(collection, default=DEFAULT, ttl=3600, maxsize=100)
+
+
+def test_unread_connection_is_not_served_while_mongodb_is_unavailable():
+    async def run():
+        collection, registry = make_registry([{"tenant_id": "spineup", "business_connection_ids": ["bc-1"],
+                                               "admin_username": "@spineup"}])
+        collection.available = False
+        unavailable = await registry.get("bc-1")
+        collection.available = True
+        # ======== The failure is not cached, the next update reads the tenant again ========
+        available = await registry.get("bc-1")
+        return collection, unavailable, available
+
+    collection, unavailable, available = asyncio.run(run())
+    assert unavailable is None
+    assert available.id == "spineup"
+    assert collection.reads == 2
+
+
+def test_last_known_tenant_is_served_while_mongodb_is_unavailable():
+    async def run():
+        collection, registry = make_registry([{"tenant_id": "spineup", "business_connection_ids": ["bc-1"],
+                                               "admin_username": "@spineup"}])
+        await registry.get("bc-1")
+        registry.reload()
+        collection.available = False
+        return await registry.get("bc-1")
+
+    assert asyncio.run(run()).id == "spineup"
+
+
+def test_tenant_without_admin_username_is_not_served():
+    async def run():
+        _, registry = make_registry([{"tenant_id": "spineup", "business_connection_ids": ["bc-1"]}])
+        return await registry.get("bc-1"), await registry.get("bc-2")
+
+    unserved, unknown = asyncio.run(run())
+    assert unserved is None
+    assert unknown is DEFAULT